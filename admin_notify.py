@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from rate_limit import TokenBucket
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS digests (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest_id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    items TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class DigestStore:
+    """
+    Items of sent digests in SQLite, shared by all bot processes.
+
+    The process that sends a digest is not necessarily the one that
+    handles the admin's click on it (worker mode), so the items are saved
+    here under the digest ID. Only the last ``keep`` digests are kept.
+    """
+
+    def __init__(self, path: str, keep: int = 100, on_timing=None):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            keep (int): Number of most recent digests kept
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every database call, e.g. to feed metrics
+        """
+        self.path = path
+        self.keep = keep
+        self.on_timing = on_timing
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="digests-sqlite")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_timing is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    async def start(self):
+        await self._run(self._open)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def _save(self, digest_id: str, kind: str, items: str):
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO digests (digest_id, kind, items, created_at) VALUES (?, ?, ?, ?)",
+                (digest_id, kind, items, time.time())
+            )
+            self._conn.execute("DELETE FROM digests WHERE seq <= ?", (cursor.lastrowid - self.keep,))
+
+    async def save(self, digest_id: str, kind: str, items: list):
+        """Save the items of a digest; they must be JSON-serializable."""
+        await self._run(self._save, digest_id, kind, json.dumps(items, ensure_ascii=False))
+
+    def _get(self, digest_id: str):
+        row = self._conn.execute("SELECT items FROM digests WHERE digest_id = ?", (digest_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    async def get(self, digest_id: str) -> list | None:
+        """Items of a digest (tuples come back as lists), or None if it is unknown."""
+        items = await self._run(self._get, digest_id)
+        return json.loads(items) if items is not None else None
+
+
+class AdminNotifier:
+    """
+    Notifications to the bot admins.
+
+    notify() sends a message to every admin concurrently; urgent events
+    (payments) go this way. Frequent events are added to a digest instead:
+    items of one kind arriving within ``digest_window`` seconds are
+    collapsed into a single message, rendered by the function registered
+    for the kind. A digest is sent early once it holds ``digest_max`` items.
+
+    Every digest gets a random ID, and its items are kept for the last
+    ``keep_digests`` digests so that buttons like "approve all" can look
+    them up with digest(). Without a DigestStore they live in memory only:
+    after a restart, or in another worker process, digest() returns None.
+
+    All sends take tokens from the shared TokenBucket, so a burst of
+    notifications can't eat the budget of user-facing messages.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        admin_ids: list,
+        limiter: TokenBucket,
+        digest_window: float = 30.0,
+        digest_max: int = 50,
+        keep_digests: int = 100,
+        max_retries: int = 3,
+        store: DigestStore | None = None,
+    ):
+        """
+        Args:
+            bot (Bot): Bot instance used for sending
+            admin_ids (list): Chat IDs of the admins
+            limiter (TokenBucket): Shared limiter for outgoing messages
+            digest_window (float): Seconds items are collected before a digest is sent
+            digest_max (int): Send the digest right away once it has this many items
+            keep_digests (int): Number of sent digests whose items are kept
+            max_retries (int): Retries for transient errors per admin
+            store (DigestStore, optional): Shared storage of digest items
+        """
+        self.bot = bot
+        self.admin_ids = list(admin_ids)
+        self.limiter = limiter
+        self.digest_window = digest_window
+        self.digest_max = digest_max
+        self.keep_digests = keep_digests
+        self.max_retries = max_retries
+        self.store = store
+        self._renderers = {}  # kind -> render(digest_id, items) -> (text, reply_markup)
+        self._pending = {}  # kind -> OrderedDict key -> item
+        self._timers = {}  # kind -> task sending the digest when the window ends
+        self._digests = OrderedDict()  # digest_id -> items
+        self._tasks = set()
+        self._sent = 0
+        self._failed = 0
+        self._digests_sent = 0
+        self._digested_items = 0
+
+    # --- Public API ---
+    async def start(self):
+        if self.store is not None:
+            await self.store.start()
+
+    def register_digest(self, kind: str, render):
+        """
+        Register a digest kind.
+
+        Args:
+            kind (str): Name of the kind, e.g. "gpt_request"
+            render: ``render(digest_id, items) -> (text, reply_markup)``
+        """
+        self._renderers[kind] = render
+
+    async def notify(self, text: str, reply_markup=None) -> int:
+        """
+        Send a message to all admins at once.
+
+        Returns:
+            int: Number of admins the message was delivered to
+        """
+        results = await asyncio.gather(*(self._send(admin_id, text, reply_markup) for admin_id in self.admin_ids))
+        return sum(results)
+
+    def add(self, kind: str, key, item):
+        """
+        Add an item to the next digest of a kind.
+
+        Args:
+            kind (str): Registered digest kind
+            key: Deduplication key; a repeated key replaces the earlier item
+            item: Anything the renderer understands
+        """
+        if kind not in self._renderers:
+            raise ValueError(f"Unknown digest kind: {kind!r}")
+        pending = self._pending.setdefault(kind, OrderedDict())
+        pending[key] = item
+        if len(pending) >= self.digest_max:
+            # Забираем элементы сразу: добавленные до отправки попадут уже в следующую сводку
+            self._spawn(self._send_digest(kind, self._take(kind)))
+        elif kind not in self._timers:
+            self._timers[kind] = self._spawn(self._flush_later(kind))
+
+    async def digest(self, digest_id: str) -> list | None:
+        """Items of a sent digest, or None if it is unknown (too old, or not stored and from another process)."""
+        items = self._digests.get(digest_id)
+        if items is None and self.store is not None:
+            try:
+                items = await self.store.get(digest_id)
+            except Exception as e:
+                logging.error(f"Failed to load digest {digest_id}: {e}")
+        return items
+
+    async def flush(self, kind: str | None = None):
+        """Send the pending digest of a kind (of every kind if None) now."""
+        for name in [kind] if kind is not None else list(self._pending):
+            items = self._take(name)
+            if items:
+                await self._send_digest(name, items)
+
+    async def close(self):
+        """Send the pending digests and wait for the notifications in flight."""
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.store is not None:
+            await self.store.close()
+
+    def stats(self) -> dict:
+        return {
+            "sent": self._sent,
+            "failed": self._failed,
+            "digests": self._digests_sent,
+            "digested_items": self._digested_items,
+            "pending": sum(len(pending) for pending in self._pending.values()),
+        }
+
+    # --- Internals ---
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _take(self, kind: str) -> list:
+        """Detach the pending items of a kind and stop its window timer."""
+        timer = self._timers.pop(kind, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        pending = self._pending.pop(kind, None)
+        return list(pending.values()) if pending else []
+
+    async def _send_digest(self, kind: str, items: list):
+        digest_id = secrets.token_hex(4)
+        self._digests[digest_id] = items
+        while len(self._digests) > self.keep_digests:
+            self._digests.popitem(last=False)
+        self._digests_sent += 1
+        self._digested_items += len(items)
+        if self.store is not None:
+            try:
+                await self.store.save(digest_id, kind, items)
+            except Exception as e:
+                logging.error(f"Failed to save {kind} digest: {e}")
+        try:
+            text, reply_markup = self._renderers[kind](digest_id, items)
+        except Exception as e:
+            logging.error(f"Failed to render {kind} digest: {e}")
+            return
+        await self.notify(text, reply_markup)
+
+    async def _flush_later(self, kind: str):
+        await asyncio.sleep(self.digest_window)
+        await self.flush(kind)
+
+    async def _send(self, chat_id: int, text: str, reply_markup=None) -> bool:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+                self._sent += 1
+                return True
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                logging.error(f"Ошибка при отправке уведомления админу {chat_id}: {e}")
+                break
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logging.error(f"Ошибка при отправке уведомления админу {chat_id}: {e}")
+                    break
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except Exception as e:
+                logging.error(f"Ошибка при отправке уведомления админу {chat_id}: {e}")
+                break
+        self._failed += 1
+        return False
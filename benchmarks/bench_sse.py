@@ -0,0 +1,117 @@
+"""
+Correctness and throughput of the incremental SSE decoder.
+
+Usage:
+    python benchmarks/bench_sse.py [--events 20000] [--runs 5] [--max-chunk 512]
+
+A large OpenRouter-style stream with Cyrillic content is generated and cut
+into chunks at random byte offsets, like TCP reads would. The legacy parser
+(decode each chunk, split on newlines) is compared with sse.SSEDecoder on
+the same chunks: lost text and time per MB are reported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse import iter_openrouter_deltas  # noqa: E402
+
+WORDS = ["Привет", "мир", "VPN", "настройка", "сервер", "ключ", "соединение", "шифрование", "🔐", "ok"]
+
+
+def make_stream(events: int, seed: int = 0) -> tuple:
+    rng = random.Random(seed)
+    fragments = []
+    lines = [": OPENROUTER PROCESSING\n\n"]
+    for _ in range(events):
+        content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))) + " "
+        fragments.append(content)
+        chunk = {"id": "gen-1", "choices": [{"index": 0, "delta": {"role": "assistant", "content": content}}]}
+        lines.append("data: " + json.dumps(chunk, ensure_ascii=False) + "\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8"), "".join(fragments)
+
+
+def split_randomly(body: bytes, max_chunk: int, seed: int) -> list:
+    rng = random.Random(seed)
+    chunks = []
+    pos = 0
+    while pos < len(body):
+        size = rng.randint(1, max_chunk)
+        chunks.append(body[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def legacy_parse(chunks: list) -> str:
+    """The pre-SSEDecoder loop from query_openrouter_stream."""
+    buffer = ""
+    for chunk in chunks:
+        try:
+            chunk_text = chunk.decode("utf-8")
+            for line in chunk_text.split("\n"):
+                if not line.strip():
+                    continue
+                if line.startswith("data: "):
+                    line_data = line[6:].strip()
+                    if line_data == "[DONE]":
+                        break
+                    try:
+                        json_data = json.loads(line_data)
+                        content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                        if content:
+                            buffer += content
+                    except Exception:
+                        pass
+        except Exception:
+            pass
+    return buffer
+
+
+async def decoder_parse(chunks: list) -> str:
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    fragments = []
+    async for delta in iter_openrouter_deltas(source()):
+        content = delta.get("content")
+        if content:
+            fragments.append(content)
+    return "".join(fragments)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-chunk", type=int, default=512)
+    args = parser.parse_args()
+
+    body, expected = make_stream(args.events)
+    megabytes = len(body) / 1e6
+    print(f"stream: {args.events} events, {megabytes:.2f} MB, chunks of 1..{args.max_chunk} bytes")
+
+    for name, parse in (("legacy", legacy_parse), ("decoder", lambda c: asyncio.run(decoder_parse(c)))):
+        elapsed = 0.0
+        lost = 0
+        for run in range(args.runs):
+            chunks = split_randomly(body, args.max_chunk, seed=run)
+            started = time.perf_counter()
+            text = parse(chunks)
+            elapsed += time.perf_counter() - started
+            lost += len(expected) - len(text) if text != expected else 0
+        print(
+            f"  {name:<8} {elapsed / args.runs * 1000:8.1f} ms/run  "
+            f"{megabytes * args.runs / elapsed:7.1f} MB/s  "
+            f"lost chars/run: {lost / args.runs:.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Lookup and filter latency of the JSON and SQLite user stores.
+
+Usage:
+    python benchmarks/bench_user_store.py [--sizes 1000 100000 1000000] [--lookups 2000]
+
+For every size a synthetic users.json is generated in a temporary directory,
+loaded into UserStore and migrated into SQLiteUserStore; then both stores are
+timed on the same workload.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_user_store import SQLiteUserStore, migrate_json_to_sqlite  # noqa: E402
+from user_store import UserStore  # noqa: E402
+
+
+def make_users_file(path: str, size: int):
+    rng = random.Random(size)
+    users = {}
+    for i in range(size):
+        uid = 100000 + i
+        info = {"username": f"user{uid}", "gpt_access": rng.random() < 0.3}
+        if rng.random() < 0.1:
+            info["vpn_access"] = True
+            info["vpn_expires"] = f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00"
+        users[str(uid)] = info
+    blocked = [100000 + i for i in rng.sample(range(size), max(1, size // 100))]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"users": users, "blocked": blocked}, f)
+
+
+async def timed(coro_factory, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await coro_factory()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def fmt(samples: list) -> str:
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {p50 * 1e6:9.1f} us  p99 {p99 * 1e6:9.1f} us"
+
+
+async def bench_store(name: str, store, size: int, lookups: int, filters: int):
+    started = time.perf_counter()
+    await store.start()
+    print(f"  {name:<6} start         {time.perf_counter() - started:8.3f} s")
+    rng = random.Random(1)
+    ids = [100000 + rng.randrange(size) for _ in range(lookups)]
+    it = iter(ids)
+    print(f"  {name:<6} get_user      " + fmt(await timed(lambda: store.get_user(next(it)), lookups)))
+    it = iter(ids)
+    print(f"  {name:<6} is_blocked    " + fmt(await timed(lambda: store.is_blocked(next(it)), lookups)))
+    print(f"  {name:<6} gpt_access=1  " + fmt(await timed(lambda: store.list_users(gpt_access=True), filters)))
+    print(f"  {name:<6} blocked_ids   " + fmt(await timed(store.blocked_ids, filters)))
+    await store.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--filters", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            print(f"{size} users")
+            json_path = os.path.join(tmp, f"users-{size}.json")
+            db_path = os.path.join(tmp, f"users-{size}.db")
+            make_users_file(json_path, size)
+            started = time.perf_counter()
+            migrate_json_to_sqlite(json_path, db_path)
+            print(f"  migrate       {time.perf_counter() - started:8.3f} s")
+            await bench_store("json", UserStore(json_path), size, args.lookups, args.filters)
+            await bench_store("sqlite", SQLiteUserStore(db_path), size, args.lookups, args.filters)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
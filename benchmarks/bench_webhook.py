@@ -0,0 +1,137 @@
+"""
+Ingestion throughput of the webhook mode, without reaching Telegram.
+
+Usage:
+    python benchmarks/bench_webhook.py [--updates 20000] [--concurrency 64]
+        [--recorded updates.jsonl] [--handler-delay 0.0] [--workers 16] [--queue-size 1000]
+
+A WebhookServer is started on localhost with a dispatcher whose message
+handler only counts updates (optionally sleeping --handler-delay seconds to
+imitate real work). Recorded updates (one Telegram Update JSON per line, as
+received by a real webhook) are POSTed to it with the secret header; without
+--recorded, synthetic text messages are generated. Reported: acknowledged
+requests per second, 503 rejections from the bounded queue and the time
+until every accepted update was processed.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook import SECRET_HEADER, WebhookServer  # noqa: E402
+
+SECRET = "bench-secret"
+PORT = 18080
+
+
+def synthetic_updates(count: int) -> list:
+    updates = []
+    for i in range(count):
+        user_id = 100000 + i % 5000
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Bench", "username": f"user{user_id}"},
+                "text": f"Сообщение номер {i}",
+            },
+        })
+    return updates
+
+
+def load_recorded(path: str, count: int) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    # Repeat the recording with fresh update IDs until there are enough updates
+    updates = []
+    while len(updates) < count:
+        for update in recorded:
+            updates.append({**update, "update_id": len(updates) + 1})
+            if len(updates) == count:
+                break
+    return updates
+
+
+async def post_all(updates: list, concurrency: int) -> dict:
+    url = f"http://127.0.0.1:{PORT}/webhook"
+    counts = {"ok": 0, "rejected": 0, "other": 0}
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async def sender(session):
+        while not queue.empty():
+            update = queue.get_nowait()
+            async with session.post(url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                if response.status == 200:
+                    counts["ok"] += 1
+                elif response.status == 503:
+                    counts["rejected"] += 1
+                else:
+                    counts["other"] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+    return counts
+
+
+async def run(args):
+    bot = Bot(token="123456:BENCHMARK")  # never used to call the Bot API
+    dp = Dispatcher()
+    handled = 0
+
+    @dp.message()
+    async def count_message(message: Message):
+        nonlocal handled
+        handled += 1
+        if args.handler_delay:
+            await asyncio.sleep(args.handler_delay)
+
+    server = WebhookServer(
+        bot, dp, secret_token=SECRET, host="127.0.0.1", port=PORT,
+        queue_size=args.queue_size, workers=args.workers,
+    )
+    await server.start()
+    updates = load_recorded(args.recorded, args.updates) if args.recorded else synthetic_updates(args.updates)
+    try:
+        started = time.perf_counter()
+        counts = await post_all(updates, args.concurrency)
+        acked = time.perf_counter() - started
+        await server.drain()
+        processed = time.perf_counter() - started
+    finally:
+        await server.close()
+        await bot.session.close()
+
+    print(f"updates: {len(updates)}, concurrency: {args.concurrency}, workers: {args.workers}, "
+          f"queue: {args.queue_size}, handler delay: {args.handler_delay * 1000:.1f} ms")
+    print(f"acknowledged: {counts['ok']} ({counts['ok'] / acked:.0f} req/s), "
+          f"rejected with 503: {counts['rejected']}, other: {counts['other']}")
+    print(f"handled: {handled} in {processed:.2f} s ({handled / processed:.0f} updates/s)")
+    print(f"server stats: {server.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--recorded", help="JSONL file with recorded Telegram updates")
+    parser.add_argument("--handler-delay", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
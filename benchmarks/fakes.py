@@ -0,0 +1,223 @@
+"""
+Local stand-ins for the Bot API and OpenRouter, used by benchmarks/loadtest.py.
+
+FakeTelegramServer answers Bot API methods the way Telegram does (a Message
+for sendMessage/editMessageText, True for the rest), records every call and
+can answer a share of the message calls with 429 Too Many Requests.
+FakeOpenRouterServer streams chat completions as SSE with a configurable time
+to first token, token rate and chunking, and answers non-streamed requests
+(history summaries) with a plain completion.
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+# Ends every generated reply, so a client can tell the reply is complete
+END_MARKER = "[end]"
+
+RATE_LIMITED_METHODS = {"sendmessage", "editmessagetext"}
+
+
+class FakeTelegramServer:
+    """Bot API stand-in: POST /bot<token>/<method>."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 18081,
+        latency: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        retry_after: int = 1,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            latency (float): Seconds added to every call
+            rate_limit_ratio (float): Share of sendMessage/editMessageText calls answered with 429
+            retry_after (int): retry_after of the injected 429 answers
+            seed (int): Seed of the 429 injection
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.rate_limited = 0
+        self._rng = random.Random(seed)
+        self._message_ids = Counter()
+        self._watchers = {}  # chat_id -> callback(method, text) -> bool
+        self._runner = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def reset(self):
+        self.calls.clear()
+        self.rate_limited = 0
+
+    def watch(self, chat_id: int, callback):
+        """
+        Call ``callback(method, text)`` for every message text sent to a chat.
+
+        The watcher is removed once the callback returns True.
+        """
+        self._watchers[int(chat_id)] = callback
+
+    async def start(self):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _message(self, chat_id: int, text: str, message_id: int | None = None) -> dict:
+        if message_id is None:
+            self._message_ids[chat_id] += 1
+            message_id = self._message_ids[chat_id]
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 123456, "is_bot": True, "first_name": "Bot"},
+            "text": text,
+        }
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        lowered = method.lower()
+        if lowered in RATE_LIMITED_METHODS and self.rate_limit_ratio and self._rng.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+
+        if lowered == "getme":
+            result = {"id": 123456, "is_bot": True, "first_name": "Bot", "username": "loadtest_bot"}
+        elif lowered in RATE_LIMITED_METHODS:
+            chat_id = int(params.get("chat_id", 0))
+            text = params.get("text", "")
+            message_id = int(params["message_id"]) if "message_id" in params else None
+            result = self._message(chat_id, text, message_id)
+            watcher = self._watchers.get(chat_id)
+            if watcher is not None and watcher(method, text):
+                self._watchers.pop(chat_id, None)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+class FakeOpenRouterServer:
+    """OpenRouter stand-in: POST /api/v1/chat/completions."""
+
+    path = "/api/v1/chat/completions"
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 18082,
+        ttft: float = 0.5,
+        tokens: int = 100,
+        token_rate: float = 50.0,
+        tokens_per_event: int = 1,
+        events_per_write: int = 1,
+        error_ratio: float = 0.0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            ttft (float): Seconds until the first token
+            tokens (int): Tokens per reply
+            token_rate (float): Tokens per second after the first one
+            tokens_per_event (int): Tokens per SSE event
+            events_per_write (int): SSE events per network write
+            error_ratio (float): Share of requests answered with 429
+            seed (int): Seed of the error injection
+        """
+        self.host = host
+        self.port = port
+        self.ttft = ttft
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.tokens_per_event = tokens_per_event
+        self.events_per_write = events_per_write
+        self.error_ratio = error_ratio
+        self.requests = 0
+        self.streams = 0
+        self.completions = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self._rng = random.Random(seed)
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}{self.path}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _reply_tokens(self) -> list:
+        return [f"слово{i} " for i in range(self.tokens - 1)] + [END_MARKER]
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        if self.error_ratio and self._rng.random() < self.error_ratio:
+            self.errors += 1
+            return web.json_response({"error": {"message": "Rate limit exceeded"}}, status=429)
+        await asyncio.sleep(self.ttft)
+        tokens = self._reply_tokens()
+        if not body.get("stream"):
+            self.completions += 1
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": "".join(tokens)}}]})
+
+        self.streams += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        events = []
+        for start in range(0, len(tokens), self.tokens_per_event):
+            content = "".join(tokens[start:start + self.tokens_per_event])
+            payload = {"choices": [{"delta": {"content": content}}]}
+            events.append(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode())
+        events.append(b"data: [DONE]\n\n")
+        # Sleep between writes so that tokens arrive at token_rate on average
+        interval = self.tokens_per_event * self.events_per_write / self.token_rate if self.token_rate else 0.0
+        for start in range(0, len(events), self.events_per_write):
+            if start:
+                await asyncio.sleep(interval)
+            data = b"".join(events[start:start + self.events_per_write])
+            self.bytes_sent += len(data)
+            await response.write(data)
+        await response.write_eof()
+        return response
@@ -0,0 +1,321 @@
+"""
+End-to-end load test of the bot on localhost.
+
+Usage:
+    python benchmarks/loadtest.py chat [--chatters 50] [--messages 5]
+        [--ttft 0.5] [--tokens 100] [--token-rate 50] [--tokens-per-event 1] [--events-per-write 1]
+    python benchmarks/loadtest.py broadcast [--users 100000] [--send-rate 0]
+    python benchmarks/loadtest.py admin [--users 100000] [--pages 200] [--searches 200]
+    common options: [--tg-latency 0.0] [--tg-429 0.0] [--or-429 0.0] [--reply-timeout 120]
+
+bot.py is imported unchanged in a temporary directory (so users.json,
+fsm.db, history.db and bot.log are created there), with TELEGRAM_API_SERVER
+and OPENROUTER_API_URL pointing at the fakes from benchmarks/fakes.py.
+Synthetic updates are fed to its Dispatcher with ``feed_update``, exactly
+as polling or the webhook would.
+
+Scenarios:
+    chat       N chatters with GPT access talk concurrently; each sends the
+               next message when the previous reply is complete
+    broadcast  the admin sends a broadcast to --users users through the
+               admin menu; --send-rate 0 lifts the 30 msg/s limiter to
+               measure the engine itself
+    admin      the admin pages through the user lists and searches users
+
+Reported: p50/p95/p99 handler latency (feed_update duration), reply
+latency and time to first content (chat), messages per second, Bot API
+calls per reply or per message and the growth of the process RSS.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiogram.types import Update  # noqa: E402
+from fakes import END_MARKER, FakeOpenRouterServer, FakeTelegramServer  # noqa: E402
+
+TOKEN = "123456:LOADTEST"
+CHATTER_BASE_ID = 10_000_000
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (peak RSS where /proc is not available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def percentiles(values: list) -> str:
+    if not values:
+        return "no samples"
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return f"p50 {pick(0.50):.1f} ms, p95 {pick(0.95):.1f} ms, p99 {pick(0.99):.1f} ms (n={len(values)})"
+
+
+def load_bot(telegram: FakeTelegramServer, openrouter: FakeOpenRouterServer):
+    """Import bot.py against the fakes; the working directory must already be the temporary one."""
+    os.environ["TELEGRAM_BOT_TOKEN"] = TOKEN
+    os.environ["TELEGRAM_API_SERVER"] = telegram.base_url
+    os.environ["OPENROUTER_API_URL"] = openrouter.url
+    import bot as app
+    logging.getLogger().setLevel(logging.WARNING)
+    app.METRICS_ENABLED = False
+    return app
+
+
+class Driver:
+    """Builds updates and feeds them to the bot's dispatcher."""
+
+    def __init__(self, app):
+        self.app = app
+        self.update_id = 0
+        self.handler_latency = []
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str):
+        self.update_id += 1
+        return Update.model_validate({
+            "update_id": self.update_id,
+            "message": {
+                "message_id": self.update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }, context={"bot": self.app.bot})
+
+    def callback(self, user_id: int, data: str):
+        self.update_id += 1
+        return Update.model_validate({
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id),
+                "from": self._user(user_id),
+                "chat_instance": "loadtest",
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": 123456, "is_bot": True, "first_name": "Bot"},
+                    "text": "menu",
+                },
+            },
+        }, context={"bot": self.app.bot})
+
+    async def feed(self, update):
+        started = time.perf_counter()
+        await self.app.dp.feed_update(self.app.bot, update)
+        self.handler_latency.append(time.perf_counter() - started)
+
+
+def print_api_calls(telegram: FakeTelegramServer, per: int, unit: str):
+    total = sum(telegram.calls.values())
+    per = max(per, 1)
+    detail = ", ".join(f"{method} {count / per:.2f}" for method, count in telegram.calls.most_common())
+    print(f"Bot API calls per {unit}: {total / per:.2f} ({detail}); injected 429: {telegram.rate_limited}")
+
+
+# --- Scenarios ---
+async def scenario_chat(app, driver: Driver, telegram: FakeTelegramServer, openrouter: FakeOpenRouterServer, args):
+    chatters = [CHATTER_BASE_ID + i for i in range(args.chatters)]
+    for user_id in chatters:
+        await app.user_store.ensure_user(user_id, f"user{user_id}")
+        await app.user_store.update_user(user_id, gpt_access=True)
+    telegram.reset()
+    first_content = []
+    replies = []
+    timeouts = 0
+
+    async def chatter(user_id: int):
+        nonlocal timeouts
+        for n in range(args.messages):
+            loop = asyncio.get_running_loop()
+            done = loop.create_future()
+            sent_at = time.perf_counter()
+            seen_content = False
+
+            def on_text(method, text):
+                nonlocal seen_content
+                if not seen_content and text.strip(".") and method.lower() == "editmessagetext":
+                    seen_content = True
+                    first_content.append(time.perf_counter() - sent_at)
+                if END_MARKER in text:
+                    if not done.done():
+                        done.set_result(time.perf_counter() - sent_at)
+                    return True
+                return False
+
+            telegram.watch(user_id, on_text)
+            # Distinct texts: identical prompts would be answered from the response cache
+            await driver.feed(driver.message(user_id, f"Вопрос {n} от {user_id}: как настроить VPN?"))
+            try:
+                replies.append(await asyncio.wait_for(done, args.reply_timeout))
+            except asyncio.TimeoutError:
+                timeouts += 1
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(chatter(user_id) for user_id in chatters))
+    elapsed = time.perf_counter() - started
+
+    print(f"chat: {args.chatters} chatters x {args.messages} messages, TTFT {args.ttft}s, "
+          f"{args.tokens} tokens at {args.token_rate}/s, {args.tokens_per_event} tokens/event, "
+          f"{args.events_per_write} events/write")
+    print(f"handler latency:  {percentiles(driver.handler_latency)}")
+    print(f"first content:    {percentiles(first_content)}")
+    print(f"complete reply:   {percentiles(replies)}")
+    print(f"replies: {len(replies)} ok, {timeouts} timed out in {elapsed:.1f} s ({len(replies) / elapsed:.2f} replies/s)")
+    print_api_calls(telegram, len(replies), "reply")
+    print(f"OpenRouter: {openrouter.streams} streams, {openrouter.completions} summaries, {openrouter.errors} injected 429")
+    print(f"RSS: {rss_before:.1f} MB -> {rss_mb():.1f} MB")
+
+
+async def create_users(app, count: int) -> list:
+    user_ids = [CHATTER_BASE_ID + i for i in range(count)]
+    for user_id in user_ids:
+        await app.user_store.ensure_user(user_id, f"user{user_id}")
+    await app.user_store.flush()
+    return user_ids
+
+
+async def scenario_broadcast(app, driver: Driver, telegram: FakeTelegramServer, args):
+    admin_id = app.ADMIN_IDS[0]
+    rss_before = rss_mb()
+    await create_users(app, args.users)
+    rss_users = rss_mb()
+    if args.send_rate:
+        app.send_limiter.rate = app.send_limiter.capacity = args.send_rate
+    else:
+        app.send_limiter.rate = app.send_limiter.capacity = 1e9
+    telegram.reset()
+
+    started = time.perf_counter()
+    await driver.feed(driver.callback(admin_id, app.AdminBroadcastCallback().pack()))
+    await driver.feed(driver.message(admin_id, "Нагрузочная рассылка"))
+    while app.broadcast_engine.running:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    stats = app.broadcast_engine.stats()
+
+    limit = f"{args.send_rate:.0f} msg/s" if args.send_rate else "unlimited"
+    print(f"broadcast: {args.users} users, send rate {limit}, {app.BROADCAST_SETTINGS['workers']} workers")
+    print(f"handler latency: {percentiles(driver.handler_latency)}")
+    print(f"sent: {stats['sent']}, failed: {stats['failed']}, retries: {stats['retries']} in {elapsed:.1f} s "
+          f"({(stats['sent'] + stats['failed']) / elapsed:.0f} messages/s)")
+    print_api_calls(telegram, stats["sent"] + stats["failed"], "message")
+    print(f"RSS: {rss_before:.1f} MB -> {rss_users:.1f} MB with users -> {rss_mb():.1f} MB after the broadcast")
+
+
+async def scenario_admin(app, driver: Driver, telegram: FakeTelegramServer, args):
+    admin_id = app.ADMIN_IDS[0]
+    user_ids = await create_users(app, args.users)
+    # Half of the users get GPT access, every tenth is blocked
+    for user_id in user_ids[::2]:
+        await app.user_store.update_user(user_id, gpt_access=True)
+    for user_id in user_ids[::10]:
+        await app.user_store.block_user(user_id)
+    telegram.reset()
+    rss_before = rss_mb()
+    page_size = app.ADMIN_PAGE_SIZE
+    results = {}
+
+    started = time.perf_counter()
+    for menu in app.ADMIN_USER_MENUS:
+        driver.handler_latency = []
+        await driver.feed(driver.callback(admin_id, app.UserListCallback(menu=menu).pack()))
+        for page in range(1, args.pages):
+            # Cursors of the "all" view; other views skip the users they don't list
+            cursor = user_ids[min(len(user_ids) - 1, page * page_size - 1)]
+            await driver.feed(driver.callback(admin_id, app.UserListCallback(menu=menu, after=cursor).pack()))
+        results[menu] = driver.handler_latency
+    driver.handler_latency = []
+    await driver.feed(driver.callback(admin_id, app.AdminSearchCallback().pack()))
+    for n in range(args.searches):
+        query = f"user{CHATTER_BASE_ID + n * 37 % max(args.users, 1)}"[:8 + n % 6]
+        await driver.feed(driver.message(admin_id, query))
+    results["search"] = driver.handler_latency
+    elapsed = time.perf_counter() - started
+
+    print(f"admin: {args.users} users, {args.pages} pages per list, {args.searches} searches")
+    for name, latency in results.items():
+        print(f"{name:>7}: {percentiles(latency)}")
+    actions = sum(len(latency) for latency in results.values())
+    print(f"actions: {actions} in {elapsed:.1f} s ({actions / elapsed:.0f} actions/s)")
+    print_api_calls(telegram, actions, "action")
+    print(f"RSS: {rss_before:.1f} MB -> {rss_mb():.1f} MB")
+
+
+async def run(args):
+    telegram = FakeTelegramServer(latency=args.tg_latency, rate_limit_ratio=args.tg_429)
+    openrouter = FakeOpenRouterServer(
+        ttft=args.ttft, tokens=args.tokens, token_rate=args.token_rate,
+        tokens_per_event=args.tokens_per_event, events_per_write=args.events_per_write,
+        error_ratio=args.or_429,
+    )
+    await telegram.start()
+    await openrouter.start()
+    app = load_bot(telegram, openrouter)
+    try:
+        await app.start_services()
+        driver = Driver(app)
+        if args.scenario == "chat":
+            await scenario_chat(app, driver, telegram, openrouter, args)
+        elif args.scenario == "broadcast":
+            await scenario_broadcast(app, driver, telegram, args)
+        else:
+            await scenario_admin(app, driver, telegram, args)
+    finally:
+        await app.stop_services()
+        await app.bot.session.close()
+        await openrouter.close()
+        await telegram.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=["chat", "broadcast", "admin"])
+    parser.add_argument("--chatters", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--tokens-per-event", type=int, default=1)
+    parser.add_argument("--events-per-write", type=int, default=1)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--send-rate", type=float, default=0.0, help="0 lifts the Bot API send limiter")
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--searches", type=int, default=200)
+    parser.add_argument("--tg-latency", type=float, default=0.0, help="seconds added to every Bot API call")
+    parser.add_argument("--tg-429", type=float, default=0.0, help="share of message calls answered with 429")
+    parser.add_argument("--or-429", type=float, default=0.0, help="share of OpenRouter requests answered with 429")
+    parser.add_argument("--reply-timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix="bot-loadtest-") as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    main()
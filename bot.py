@@ -1,8 +1,8 @@
 import logging
 import os
-import json
+import sys
 import asyncio
-import aiohttp
+import time
 from datetime import datetime, timedelta
 
 from aiogram import Bot, Dispatcher, types
@@ -10,7 +10,7 @@ from aiogram.filters import Command, CommandStart, CommandObject, StateFilter
 from aiogram.types import (
     Message, 
     CallbackQuery, 
-    FSInputFile,
+    BufferedInputFile,
     ReplyKeyboardMarkup, 
     KeyboardButton,
     InlineKeyboardMarkup,
@@ -18,23 +18,190 @@ from aiogram.types import (
     ReplyKeyboardRemove
 )
 from aiogram.filters import StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
-
-from vpn_users_utils import load_vpn_users, save_vpn_users
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+from vpn_users_utils import VPN_USERS_FILE, load_vpn_users, save_vpn_users
+from user_store import create_user_store
+from http_client import HttpClient
+from sse import iter_openrouter_deltas
+from message_editor import MAX_MESSAGE_LENGTH, StreamingMessageEditor
+from rate_limit import TokenBucket
+from broadcast import BroadcastEngine, STOP_CALLBACK as BROADCAST_STOP_CALLBACK
+from vpn_expiry import ExpiryScheduler
+from vpn_pool import CredentialPool, add_peer, remove_peer, render_config
+from orders import APPROVED, PENDING, REJECTED, OrderStore
+from admin_notify import AdminNotifier, DigestStore
+from gpt_scheduler import GptScheduler
+from history import HistoryManager
+from history_store import HistoryDiskStore
+from response_cache import ResponseCache
+from image_pipeline import ImagePipeline
+from model_router import ModelRouter
+from hedging import HedgePolicy
+from webhook import WebhookServer
+from fsm_storage import SQLiteStorage
+from workers import WorkerSupervisor, read_status, shard_of, worker_loop
+from callback_router import CallbackRouter
+from metrics import HandlerMetricsMiddleware, MeteredSession, MetricsRegistry, MetricsServer
 
 # --- Constants ---
-TELEGRAM_BOT_TOKEN = "TELEGRAM_BOT_TOKEN"
-OPENROUTER_API_URL = "OPENROUTER_API_URL"
-OPENROUTER_API_KEY = "OPENROUTER_API_KEY"
+# Можно задать переменными окружения (так делает и нагрузочный тест в benchmarks/loadtest.py)
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "TELEGRAM_BOT_TOKEN")
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "OPENROUTER_API_URL")
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "OPENROUTER_API_KEY")
+# Свой сервер Bot API (например, локальный telegram-bot-api); None — api.telegram.org
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
+# Модели OpenRouter в порядке предпочтения; vision — умеет работать с изображениями
+OPENROUTER_MODELS = [
+    {"name": "qwen/qwen2.5-vl-3b-instruct:free", "vision": True},
+    {"name": "google/gemma-3-27b-it:free", "vision": True},
+    {"name": "meta-llama/llama-3.3-70b-instruct:free", "vision": False},
+    {"name": "mistralai/mistral-7b-instruct:free", "vision": False},
+]
 ADMIN_IDS = [403786501]
 USERS_DB_FILE = "users.json"
-HISTORY_LIMIT = 10
+# "json" — перезапись users.json, "journal" — журнал изменений, "sqlite" — база SQLite
+# (перенос данных: python sqlite_user_store.py users.json users.db)
+USERS_STORE_BACKEND = "json"
+USERS_STORE_OPTIONS = {
+    "json": {"path": USERS_DB_FILE, "flush_interval": 1.0},  # seconds between coalesced writes
+    "journal": {"path": USERS_DB_FILE, "flush_interval": 0.05, "compact_bytes": 4 * 1024 * 1024},
+    "sqlite": {"path": "users.db"},
+}
+# История диалога: бюджет в токенах на запрос; вытесненные сообщения
+# сворачиваются в краткое содержание фоновой задачей. В памяти держится
+# не больше max_resident диалогов, остальные лежат в HISTORY_DB_FILE.
+HISTORY_DB_FILE = "history.db"
+HISTORY_SETTINGS = {
+    "token_budget": 3000,
+    "max_messages": 50,
+    "summary_max_tokens": 400,
+    "max_resident": 1000,
+    "flush_interval": 2.0,
+    "summary_retries": 3,  # после стольких повторов неудачного сжатия старые сообщения отбрасываются
+}
+HISTORY_SUMMARY_PROMPT = (
+    "Сократи переписку пользователя с ассистентом до краткого содержания на русском языке. "
+    "Сохрани факты, договорённости и контекст, нужные для продолжения диалога. "
+    "Если дано предыдущее краткое содержание, дополни его."
+)
+ADMIN_PAGE_SIZE = 10  # пользователей на странице в админ-меню
+ADMIN_STATS_LIST_LIMIT = 10  # строк в списках статистики (рабочие процессы, модели)
+ADMIN_STATS_ERROR_CHARS = 120  # длина текста последней ошибки модели в статистике
+
+# Пул HTTP-соединений к OpenRouter (таймауты в секундах)
+OPENROUTER_HTTP_SETTINGS = {
+    "limit": 100,
+    "limit_per_host": 20,
+    "keepalive_timeout": 60,
+    "dns_cache_ttl": 300,
+    "connect_timeout": 5,
+    "first_byte_timeout": 30,
+    "read_timeout": 30,
+    "total_timeout": 180,
+}
+
+# Очередь запросов к GPT: один запрос на пользователя одновременно,
+# общий лимит параллельных запросов и очередь по кругу между пользователями
+GPT_SCHEDULER_SETTINGS = {
+    "max_concurrent": 8,
+    "max_pending_per_user": 3,
+    "max_pending_total": 200,
+}
+GPT_BUSY_TEXT = "⏳ Слишком много запросов. Дождитесь ответа на предыдущие сообщения и попробуйте снова."
+
+# Ответ на нажатие кнопки, которую бот больше не обслуживает (старое сообщение)
+CALLBACK_OUTDATED_TEXT = "Кнопка устарела. Откройте меню заново."
+VPN_UNAVAILABLE_TEXT = "Выдача VPN сейчас недоступна: пул ключей не запущен. Попробуйте позже."
+
+# Кэш готовых ответов на повторяющиеся вопросы (сброс: /flush_cache)
+RESPONSE_CACHE_SETTINGS = {
+    "ttl": 6 * 3600,
+    "max_entries": 2000,
+    "max_temperature": 0.3,  # ответы с более высокой температурой не кэшируются
+}
+
+# Подготовка изображений для GPT: самый маленький размер фото не меньше
+# max_side пикселей, уменьшение и перекодирование в JPEG (нужен Pillow)
+IMAGE_PIPELINE_SETTINGS = {
+    "max_side": 1024,
+    "jpeg_quality": 85,
+    "cache_entries": 256,
+    "cache_bytes": 32 * 1024 * 1024,
+    "workers": 2,
+}
+
+# Выбор модели: EWMA времени до первого токена и доли ошибок,
+# circuit breaker при повторяющихся 429/5xx/таймаутах
+MODEL_ROUTER_SETTINGS = {
+    "ewma_alpha": 0.2,
+    "error_penalty": 4.0,
+    "default_ttft": 3.0,
+    "failure_threshold": 3,
+    "open_seconds": 30.0,
+    "max_open_seconds": 600.0,
+    "max_attempts": 2,  # сколько моделей пробовать, пока не пришёл первый токен
+}
+
+# Хеджирование: если первый токен не пришёл за percentile обычного времени,
+# отправляется второй запрос (к запасной или той же модели) и побеждает
+# тот, кто ответит первым. budget_ratio — доля дополнительных запросов.
+HEDGE_SETTINGS = {
+    "enabled": True,
+    "percentile": 0.95,
+    "window": 200,
+    "min_samples": 20,
+    "min_delay": 0.5,
+    "max_delay": 15.0,
+    "budget_ratio": 0.1,
+    "budget_burst": 5.0,
+}
+
+# Получение обновлений: "polling" — long polling, "webhook" — HTTP-сервер
+UPDATE_MODE = "polling"
+WEBHOOK_URL = "https://example.com/webhook"  # публичный адрес, который регистрируется в Telegram
+WEBHOOK_SETTINGS = {
+    "path": "/webhook",
+    "secret_token": "WEBHOOK_SECRET_TOKEN",
+    "host": "0.0.0.0",
+    "port": 8080,
+    "queue_size": 1000,
+    "workers": 16,
+}
+
+# Состояния диалогов (FSM); файл общий для всех процессов бота
+FSM_DB_FILE = "fsm.db"
+FSM_STORAGE_SETTINGS = {
+    "state_ttl": 24 * 3600,  # брошенные диалоги сбрасываются через сутки
+    "cache_ttl": 30.0,
+    "cache_size": 10000,
+    "purge_interval": 600.0,
+}
+
+# Несколько процессов: 0 — всё в одном процессе; N > 0 — процесс-приёмник
+# обновлений и N рабочих процессов, пользователи распределяются по user_id.
+# Рабочие процессы делят хранилища, поэтому нужен USERS_STORE_BACKEND = "sqlite".
+# Все админы обслуживаются одним процессом — тем, которому достался ADMIN_IDS[0].
+WORKER_PROCESSES = 0
+WORKER_SETTINGS = {
+    "queue_size": 1000,
+    "restart_delay": 1.0,
+    "status_path": "workers_status.json",
+    "status_interval": 5.0,
+}
+
+# Метрики в формате Prometheus: http://127.0.0.1:9100/metrics.
+# В многопроцессном режиме рабочий процесс N слушает порт port + 1 + N.
+METRICS_ENABLED = True
+METRICS_SETTINGS = {
+    "host": "127.0.0.1",  # только локально: метрики не для публичного доступа
+    "port": 9100,
+}
 
 # --- Global Variables ---
-user_histories = {}
-pending_vpn_requests = {}
 
 # --- Bot Settings ---
 BOT_SETTINGS = {
@@ -43,14 +210,174 @@ BOT_SETTINGS = {
     "stream": True,
 }
 
+# Общий лимит исходящих сообщений Bot API (~30 сообщений в секунду)
+TELEGRAM_SEND_RATE = 30
+
+# Рассылка
+BROADCAST_SETTINGS = {
+    "checkpoint_path": "broadcast_checkpoint.json",
+    "workers": 20,
+    "max_retries": 3,
+    "progress_interval": 3.0,
+}
+
+# Окончание подписок VPN: напоминания за 3 дня и за 1 день, затем отключение доступа
+VPN_EXPIRY_SETTINGS = {
+    "reminders": (3 * 24 * 3600, 24 * 3600),
+    "batch_size": 50,
+    "max_sleep": 60.0,
+}
+# В многопроцессном режиме сроки меняют и другие процессы: раз в N секунд
+# планировщик перечитывает подписки, истекающие в ближайшее время
+VPN_EXPIRY_RESYNC_INTERVAL = 300.0
+
+# VPN (WireGuard): сервер, к которому подключаются выданные конфиги.
+# Если бот запущен на самом VPN-сервере, укажите интерфейс ("wg0"): бот сам
+# добавляет и удаляет пиров через `wg set` (нужны права на это). Без него
+# пиров из vpn_users.json нужно добавлять на сервер вручную.
+VPN_SERVER_SETTINGS = {
+    "endpoint": "vpn.example.com:51820",
+    "public_key": "SERVER_PUBLIC_KEY",
+    "dns": "1.1.1.1",
+    "allowed_ips": "0.0.0.0/0, ::/0",
+    "keepalive": 25,
+    "interface": None,
+}
+# Заранее сгенерированные ключи и адреса клиентов: выдача доступа берёт готовый
+VPN_POOL_SETTINGS = {
+    "path": "vpn_pool.json",
+    "network": "10.8.0.0/16",
+    "server_address": "10.8.0.1",
+    "size": 50,
+    "low_watermark": 20,
+    "batch_size": 10,
+}
+
+# Заказы VPN: очередь заявок в SQLite, одобрение пачкой из админ-меню
+ORDERS_DB_FILE = "orders.db"
+VPN_ORDER_CONCURRENCY = 10  # одновременных выдач при одобрении пачкой
+ORDER_SUMMARY_LINES = 30  # строк по заявкам в итоговом сообщении
+
+# Уведомления админам: запросы доступа к GPT за окно собираются в одну сводку,
+# оплаты VPN отправляются сразу. Содержимое сводок хранится в SQLite, чтобы
+# «Одобрить всех» работало в любом процессе и после перезапуска.
+ADMIN_DIGESTS_DB_FILE = "admin_digests.db"
+ADMIN_NOTIFY_SETTINGS = {
+    "digest_window": 30.0,  # секунды
+    "digest_max": 50,
+    "keep_digests": 100,
+}
+GPT_DIGEST_LINES = 30  # строк с пользователями в сводке
+
+# Обновление сообщения с ответом GPT во время стриминга (секунды)
+STREAM_EDIT_SETTINGS = {
+    "animation_interval": 0.6,  # кадры анимации "..." до первого токена
+    "first_edit_gap": 0.3,
+    "min_interval": 1.0,
+    "max_interval": 8.0,
+    "latency_factor": 3.0,
+}
+
 # --- State Classes ---
 class BroadcastState(StatesGroup):
     waiting_for_message = State()
 
+class AdminSearchState(StatesGroup):
+    waiting_for_query = State()
+
 class BuyVPNState(StatesGroup):
     select_period = State()
     wait_payment = State()
-    admin_grant = State()
+
+# --- Callback Data ---
+# Данные inline-кнопок. Классы без полей упаковываются в голый префикс.
+class AdminMenuCallback(CallbackData, prefix="admin_menu"):
+    pass
+
+class UserListCallback(CallbackData, prefix="admin_list"):
+    menu: str  # ключ ADMIN_USER_MENUS
+    after: int | None = None
+    before: int | None = None
+
+class AdminSearchCallback(CallbackData, prefix="admin_search"):
+    pass
+
+class AdminSearchCancelCallback(CallbackData, prefix="admin_search_cancel"):
+    pass
+
+class UserCardCallback(CallbackData, prefix="admin_user"):
+    user_id: int
+
+class GptRequestCallback(CallbackData, prefix="request_gpt_access"):
+    pass
+
+class GptApproveCallback(CallbackData, prefix="gpt_approve"):
+    user_id: int
+
+class GptDeclineCallback(CallbackData, prefix="gpt_decline"):
+    user_id: int
+
+class GptDigestApproveCallback(CallbackData, prefix="gpt_digest_ok"):
+    digest_id: str
+
+# anchor — откуда нажата кнопка: курсор страницы списка, "" (первая страница) или "card"
+class GptGrantCallback(CallbackData, prefix="gpt_grant"):
+    user_id: int
+    anchor: str = ""
+
+class GptRevokeCallback(CallbackData, prefix="gpt_revoke"):
+    user_id: int
+    anchor: str = ""
+
+class BlockUserCallback(CallbackData, prefix="block_user"):
+    user_id: int
+    anchor: str = ""
+
+class UnblockUserCallback(CallbackData, prefix="unblock_user"):
+    user_id: int
+    anchor: str = ""
+
+class AdminBroadcastCallback(CallbackData, prefix="admin_broadcast"):
+    pass
+
+class CancelBroadcastCallback(CallbackData, prefix="cancel_broadcast"):
+    pass
+
+class StopBroadcastCallback(CallbackData, prefix=BROADCAST_STOP_CALLBACK):
+    pass
+
+class AdminStatsCallback(CallbackData, prefix="admin_stats"):
+    page: str = ""  # "" — обзор, иначе ключ ADMIN_STATS_PAGES
+
+class VpnPeriodCallback(CallbackData, prefix="vpn_period"):
+    period: str  # 1m, 3m, 6m, 1y
+
+class VpnPaidCallback(CallbackData, prefix="vpn_paid"):
+    pass
+
+class VpnCancelCallback(CallbackData, prefix="vpn_cancel"):
+    pass
+
+class VpnGrantCallback(CallbackData, prefix="vpn_order_grant"):
+    order_id: int
+
+class VpnRejectCallback(CallbackData, prefix="vpn_order_reject"):
+    order_id: int
+
+class VpnOrderCancelCallback(CallbackData, prefix="vpn_order_cancel"):
+    order_id: int
+
+class OrdersCallback(CallbackData, prefix="vpn_orders"):
+    after: int | None = None
+    before: int | None = None
+
+class OrderSelectCallback(CallbackData, prefix="vpn_order_pick"):
+    order_id: int
+    anchor: str = ""  # курсор страницы для повторной отрисовки
+
+class OrdersBulkCallback(CallbackData, prefix="vpn_orders_bulk"):
+    action: str  # approve, reject
+    anchor: str = ""
 
 # --- Клавиатура пользователя (ReplyKeyboardMarkup) ---
 def get_user_keyboard(user_id=None):
@@ -74,42 +401,85 @@ logging.basicConfig(
     ]
 )
 
+# Метрики (обновляются всегда, наружу отдаются при METRICS_ENABLED)
+metrics = MetricsRegistry()
+metrics_server = MetricsServer(metrics, **METRICS_SETTINGS)
+store_latency = metrics.histogram("store_seconds", "Storage operation latency", ("store", "operation"))
+openrouter_responses = metrics.counter("openrouter_responses_total", "OpenRouter responses by status", ("model", "status"))
+openrouter_ttft = metrics.histogram("openrouter_ttft_seconds", "Time to first token", ("model",))
+openrouter_stream_seconds = metrics.histogram("openrouter_stream_seconds", "Duration of successful streams", ("model",))
+openrouter_tokens_per_second = metrics.histogram(
+    "openrouter_tokens_per_second", "Streamed chunks per second after the first token", ("model",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+openrouter_bytes = metrics.counter("openrouter_stream_bytes_total", "Bytes of streamed responses", ("model",))
+reply_edits = metrics.histogram("reply_edits", "Message edits per streamed reply", buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55))
+
+def store_timer(store: str):
+    """on_timing callback of a store feeding the store_seconds histogram."""
+    return lambda operation, seconds: store_latency.observe(seconds, store, operation)
+
 # Инициализация бота
-storage = MemoryStorage()
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
+storage = SQLiteStorage(FSM_DB_FILE, on_timing=store_timer("fsm"), **FSM_STORAGE_SETTINGS)
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN,
+    session=MeteredSession(
+        metrics, api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else PRODUCTION
+    ),
+)
 dp = Dispatcher(storage=storage)
 
-# Загрузка данных о пользователях
-async def load_users():
-    """
-    Load user data from JSON file. Creates default structure if file doesn't exist.
-    
-    Returns:
-        dict: User data containing 'users' and 'blocked' lists
-    """
-    try:
-        if not os.path.exists(USERS_DB_FILE):
-            with open(USERS_DB_FILE, "w", encoding='utf-8') as f:
-                json.dump({"users": {}, "blocked": []}, f)
-        with open(USERS_DB_FILE, "r", encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Error loading users: {e}")
-        return {"users": {}, "blocked": []}
+# Хранилище пользователей (загружается один раз в main())
+user_store = create_user_store(
+    USERS_STORE_BACKEND, on_timing=store_timer("users"), **USERS_STORE_OPTIONS[USERS_STORE_BACKEND]
+)
 
-# Сохранение данных о пользователях
-def save_users(data):
-    """
-    Save user data to JSON file.
-    
-    Args:
-        data (dict): User data to save
-    """
-    try:
-        with open(USERS_DB_FILE, "w", encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Error saving users: {e}")
+# Общий HTTP-клиент для OpenRouter (сессия создаётся в main())
+http_client = HttpClient(**OPENROUTER_HTTP_SETTINGS)
+
+# Ограничитель исходящих сообщений и движок рассылок
+send_limiter = TokenBucket(rate=TELEGRAM_SEND_RATE)
+broadcast_engine = BroadcastEngine(bot, send_limiter, **BROADCAST_SETTINGS)
+
+# Напоминания о продлении и отключение истёкших подписок VPN
+# release_vpn_config определена ниже, поэтому хук вызывается через lambda
+vpn_expiry = ExpiryScheduler(
+    user_store, bot, send_limiter, on_expired=lambda user_id: release_vpn_config(user_id), **VPN_EXPIRY_SETTINGS
+)
+
+# Выдача VPN: пул готовых ключей и реестр выданных конфигов (загружается в start_services)
+vpn_pool = CredentialPool(**VPN_POOL_SETTINGS)
+vpn_users = {}
+vpn_users_lock = asyncio.Lock()
+vpn_users_saves = {"requested": 0, "written": 0}
+
+# Уведомления админам (сводки регистрируются в register_handlers)
+admin_notifier = AdminNotifier(
+    bot, ADMIN_IDS, send_limiter,
+    store=DigestStore(
+        ADMIN_DIGESTS_DB_FILE, keep=ADMIN_NOTIFY_SETTINGS["keep_digests"], on_timing=store_timer("digests")
+    ),
+    **ADMIN_NOTIFY_SETTINGS
+)
+
+# Заказы VPN (открываются в start_services)
+order_store = OrderStore(ORDERS_DB_FILE, on_timing=store_timer("orders"))
+
+# Кэш ответов GPT
+response_cache = ResponseCache(**RESPONSE_CACHE_SETTINGS)
+
+# Подготовка изображений
+image_pipeline = ImagePipeline(bot, **IMAGE_PIPELINE_SETTINGS)
+
+# Выбор модели OpenRouter
+model_router = ModelRouter(OPENROUTER_MODELS, **MODEL_ROUTER_SETTINGS)
+hedge_policy = HedgePolicy(**HEDGE_SETTINGS)
+
+# Приём обновлений через webhook (UPDATE_MODE = "webhook")
+webhook_server = WebhookServer(bot, dp, **WEBHOOK_SETTINGS)
+
+# Маршрутизация inline-кнопок (маршруты добавляются в register_handlers)
+callback_router = CallbackRouter(unknown_text=CALLBACK_OUTDATED_TEXT)
 
 # Проверка, является ли пользователь администратором
 def is_admin(user_id: int) -> bool:
@@ -124,70 +494,213 @@ def is_admin(user_id: int) -> bool:
     """
     return user_id in ADMIN_IDS
 
-# Проверка, заблокирован ли пользователь
-def is_blocked(user_id: int, users_data: dict) -> bool:
-    """
-    Check if a user is blocked.
-    
-    Args:
-        user_id (int): Telegram user ID
-        users_data (dict): User database
-        
-    Returns:
-        bool: True if user is blocked, False otherwise
-    """
-    return user_id in users_data.get("blocked", [])
-
 # Функция для создания клавиатуры администратора
 def get_admin_keyboard(cancel_button=False):
     keyboard = []
 
     # Основные кнопки администратора
     keyboard.append([
-        types.InlineKeyboardButton(text="👥Пользователи", callback_data="admin_view_users"),
-        types.InlineKeyboardButton(text="✅GPT", callback_data="admin_open_gpt_access"),
-        types.InlineKeyboardButton(text="🚫GPT", callback_data="admin_close_gpt_access"),
+        types.InlineKeyboardButton(text="👥Пользователи", callback_data=UserListCallback(menu="view").pack()),
+        types.InlineKeyboardButton(text="✅GPT", callback_data=UserListCallback(menu="grant").pack()),
+        types.InlineKeyboardButton(text="🚫GPT", callback_data=UserListCallback(menu="revoke").pack()),
+    ])
+    keyboard.append([
+        types.InlineKeyboardButton(text="🔒Блокировка", callback_data=UserListCallback(menu="lock").pack()),
+        types.InlineKeyboardButton(text="🔍Поиск", callback_data=AdminSearchCallback().pack()),
+        types.InlineKeyboardButton(text="🧾Заявки VPN", callback_data=OrdersCallback().pack()),
     ])
     keyboard.append([
-        types.InlineKeyboardButton(text="✉️Рассылка", callback_data="admin_broadcast"),
+        types.InlineKeyboardButton(text="✉️Рассылка", callback_data=AdminBroadcastCallback().pack()),
+        types.InlineKeyboardButton(text="📊Статистика", callback_data=AdminStatsCallback().pack()),
     ])
 
     # Добавляем кнопку "Отмена", если она нужна
     if cancel_button:
         keyboard.append([
-            types.InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_broadcast")
+            types.InlineKeyboardButton(text="❌ Отмена", callback_data=CancelBroadcastCallback().pack())
         ])
 
     return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-# Обработка кнопки меню блокировки/разблокировки
-@dp.callback_query(lambda c: c.data == "admin_lock_menu")
-async def show_lock_menu(callback: types.CallbackQuery):
-    users_data = await load_users()
+# Постраничные списки пользователей в админ-меню:
+# меню -> (список в хранилище, заголовок, текст для пустого списка)
+ADMIN_USER_MENUS = {
+    "view": ("all", "Пользователи:", "Нет пользователей."),
+    "lock": ("all", "Список пользователей для блокировки/разблокировки:", "Нет пользователей"),
+    "grant": ("gpt_off", "Выберите пользователя для ОТКРЫТИЯ доступа к GPT:", "Нет пользователей без доступа"),
+    "revoke": ("gpt_on", "Выберите пользователя для ЗАКРЫТИЯ доступа к GPT:", "Нет пользователей с доступом"),
+}
+
+async def render_user_menu(menu: str, after: int = None, before: int = None):
+    """
+    Render one page of an admin user list.
+
+    Args:
+        menu (str): Key of ADMIN_USER_MENUS
+        after (int, optional): Show users with IDs greater than this cursor
+        before (int, optional): Show the page right before this cursor
+
+    Returns:
+        tuple: (text, InlineKeyboardMarkup)
+    """
+    view, title, empty_text = ADMIN_USER_MENUS[menu]
+    items, has_prev, has_next = await user_store.page_users(view, after=after, before=before, limit=ADMIN_PAGE_SIZE)
+    if not items and after is not None:
+        # Последний пользователь на странице пропал из списка — показываем предыдущую
+        items, has_prev, has_next = await user_store.page_users(view, before=after + 1, limit=ADMIN_PAGE_SIZE)
+    # Курсор, по которому эта же страница отрисуется после действия с пользователем
+    anchor = str(int(items[0][0]) - 1) if items and has_prev else ""
+
     buttons = []
-    for uid, user in users_data["users"].items():
-        username = user.get("username", "Без имени")
-        if int(uid) in users_data.get("blocked", []):
-            btn = types.InlineKeyboardButton(
-                text=f"{username} ({uid}) ✅",
-                callback_data=f"unblock_user_{uid}"
-            )
+    lines = []
+    for uid, info in items:
+        username = info.get("username", "Unknown")
+        if menu == "view":
+            lines.append(f"{uid} ({username}) | GPT: {'✅' if info.get('gpt_access', False) else '❌'}")
+        elif menu == "lock":
+            if await user_store.is_blocked(uid):
+                btn = types.InlineKeyboardButton(
+                    text=f"{username} ({uid}) ✅",
+                    callback_data=UnblockUserCallback(user_id=uid, anchor=anchor).pack()
+                )
+            else:
+                btn = types.InlineKeyboardButton(
+                    text=f"{username} ({uid}) ❌",
+                    callback_data=BlockUserCallback(user_id=uid, anchor=anchor).pack()
+                )
+            buttons.append([btn])
         else:
-            btn = types.InlineKeyboardButton(
-                text=f"{username} ({uid}) ❌",
-                callback_data=f"block_user_{uid}"
-            )
-        buttons.append([btn])
-    if not buttons:
-        buttons = [[types.InlineKeyboardButton(text="Нет пользователей", callback_data="admin_menu")]]
-    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
+            action = GptGrantCallback if menu == "grant" else GptRevokeCallback
+            buttons.append([
+                types.InlineKeyboardButton(
+                    text=f"{username} ({uid})",
+                    callback_data=action(user_id=uid, anchor=anchor).pack()
+                )
+            ])
+
+    if not items:
+        if menu == "view":
+            lines.append(empty_text)
+        else:
+            buttons.append([types.InlineKeyboardButton(text=empty_text, callback_data=AdminMenuCallback().pack())])
+    nav = []
+    if has_prev:
+        nav.append(types.InlineKeyboardButton(
+            text="◀️", callback_data=UserListCallback(menu=menu, before=items[0][0]).pack()
+        ))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(
+            text="▶️", callback_data=UserListCallback(menu=menu, after=items[-1][0]).pack()
+        ))
+    if nav:
+        buttons.append(nav)
+    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminMenuCallback().pack())])
+
+    text = title if menu != "view" else f"{title}\n" + "\n".join(lines)
+    return text, types.InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def parse_anchor(anchor: str):
+    """Cursor of the page to re-render after an action ("" — first page)."""
+    return int(anchor) if anchor.isdigit() else None
+
+# Карточка пользователя (из поиска)
+async def render_user_card(user_id: int):
+    info = await user_store.get_user(user_id)
+    if info is None:
+        return "Пользователь не найден.", types.InlineKeyboardMarkup(
+            inline_keyboard=[[types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminMenuCallback().pack())]]
+        )
+    blocked = await user_store.is_blocked(user_id)
+    gpt_access = info.get("gpt_access", False)
+    text = (
+        f"👤 {info.get('username', 'Unknown')} (ID: {user_id})\n"
+        f"GPT: {'✅' if gpt_access else '❌'}\n"
+        f"VPN: {'до ' + info['vpn_expires'][:10] if info.get('vpn_access') and info.get('vpn_expires') else '❌'}\n"
+        f"Заблокирован: {'да' if blocked else 'нет'}"
+    )
+    buttons = [
+        [types.InlineKeyboardButton(
+            text="🚫 Закрыть GPT" if gpt_access else "✅ Открыть GPT",
+            callback_data=(GptRevokeCallback if gpt_access else GptGrantCallback)(user_id=user_id, anchor="card").pack()
+        )],
+        [types.InlineKeyboardButton(
+            text="🔓 Разблокировать" if blocked else "🔒 Заблокировать",
+            callback_data=(UnblockUserCallback if blocked else BlockUserCallback)(user_id=user_id, anchor="card").pack()
+        )],
+        [types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminMenuCallback().pack())],
+    ]
+    return text, types.InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def refresh_after_action(callback: CallbackQuery, menu: str, user_id: int, anchor: str):
+    """Re-render the list page or the user card the action was taken from."""
+    if anchor == "card":
+        text, markup = await render_user_card(user_id)
+    else:
+        text, markup = await render_user_menu(menu, after=parse_anchor(anchor))
+    try:
+        await callback.message.edit_text(text, reply_markup=markup)
+    except Exception as e:
+        logging.error(f"Ошибка при обновлении списка пользователей: {e}")
+
+# Списки пользователей: открытие и листание
+async def user_list_callback(callback: CallbackQuery, callback_data: UserListCallback):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    if callback_data.menu not in ADMIN_USER_MENUS:
+        await callback.answer("Некорректная страница.", show_alert=True)
+        return
+    text, markup = await render_user_menu(callback_data.menu, after=callback_data.after, before=callback_data.before)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+# Поиск пользователя по username или началу ID
+async def admin_search_callback(callback: CallbackQuery, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    await state.set_state(AdminSearchState.waiting_for_query)
     await callback.message.edit_text(
-        "Список пользователей для блокировки/разблокировки:",
+        "Введите username или начало ID пользователя:",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminSearchCancelCallback().pack())]
+        ])
+    )
+    await callback.answer()
+
+async def admin_search_cancel(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Админ-меню:", reply_markup=get_admin_keyboard())
+    await callback.answer()
+
+async def process_admin_search(message: Message, state: FSMContext):
+    if not is_admin(message.from_user.id):
+        await state.clear()
+        return
+    results = await user_store.search_users(message.text or "", limit=ADMIN_PAGE_SIZE)
+    buttons = [
+        [types.InlineKeyboardButton(
+            text=f"{info.get('username', 'Unknown')} ({uid})",
+            callback_data=UserCardCallback(user_id=uid).pack()
+        )]
+        for uid, info in results
+    ]
+    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminSearchCancelCallback().pack())])
+    await message.answer(
+        "Найденные пользователи (можно ввести новый запрос):" if results else "Никого не найдено. Попробуйте другой запрос:",
         reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
     )
 
+async def admin_user_card(callback: CallbackQuery, callback_data: UserCardCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    await state.clear()
+    text, markup = await render_user_card(callback_data.user_id)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
 # Обработка команды /admin
-@dp.message(lambda msg: msg.text is not None and msg.text.startswith("Админ-меню"))
 async def admin_command(message: Message):
     user_id = message.from_user.id
 
@@ -200,39 +713,14 @@ async def admin_command(message: Message):
     await message.answer("Выберите действие:", reply_markup=get_admin_keyboard())
 
 # Обработка callback-кнопки запроса доступа к GPT
-@dp.callback_query(lambda c: c.data == "request_gpt_access")
 async def process_gpt_access_request(callback: CallbackQuery):
     user_id = callback.from_user.id
     username = callback.from_user.username or "Unknown"
-    users_data = await load_users()
     # Добавляем пользователя в базу, если его нет
-    if str(user_id) not in users_data["users"]:
-        users_data["users"][str(user_id)] = {"username": username, "gpt_access": False}
-        save_users(users_data)
+    await user_store.ensure_user(user_id, username)
 
-    # Оповещаем всех админов о запросе
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                f"Пользователь @{username} (ID: {user_id}) запросил доступ к GPT.",
-                reply_markup=types.InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [
-                            types.InlineKeyboardButton(
-                                text="✅",
-                                callback_data=f"admin_approve_gpt_{user_id}"
-                            ),
-                            types.InlineKeyboardButton(
-                                text="❌",
-                                callback_data=f"admin_decline_gpt_{user_id}"
-                            )
-                        ]
-                    ]
-                )
-            )
-        except Exception as e:
-            logging.error(f"Ошибка при отправке уведомления админу {admin_id}: {e}")
+    # Запросы за окно уходят админам одной сводкой
+    admin_notifier.add("gpt_request", user_id, (user_id, username))
 
     await callback.message.edit_text(
         "Запрос на доступ отправлен. Ожидайте решения."
@@ -240,18 +728,14 @@ async def process_gpt_access_request(callback: CallbackQuery):
     await callback.answer()
 
 # === ДОБАВЛЕНО: обработчик одобрения запроса на доступ ===
-@dp.callback_query(lambda c: c.data and c.data.startswith("admin_approve_gpt_"))
-async def admin_approve_gpt(callback: CallbackQuery):
+async def admin_approve_gpt(callback: CallbackQuery, callback_data: GptApproveCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("admin_approve_gpt_")[1]
-    users_data = await load_users()
-    if user_id in users_data["users"]:
-        users_data["users"][user_id]["gpt_access"] = True
-        save_users(users_data)
+    user_id = callback_data.user_id
+    if await user_store.update_user(user_id, gpt_access=True):
         try:
-            await bot.send_message(int(user_id), "✅ Вам открыт доступ к GPT", reply_markup=get_user_keyboard())
+            await bot.send_message(user_id, "✅ Вам открыт доступ к GPT", reply_markup=get_user_keyboard())
         except Exception as e:
             logging.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
         await callback.message.edit_text("Доступ пользователю открыт.")
@@ -259,253 +743,175 @@ async def admin_approve_gpt(callback: CallbackQuery):
         await callback.answer("Пользователь не найден.", show_alert=True)
 
 # === ДОБАВЛЕНО: обработчик отклонения запроса на доступ ===
-@dp.callback_query(lambda c: c.data and c.data.startswith("admin_decline_gpt_"))
-async def admin_decline_gpt(callback: CallbackQuery):
+async def admin_decline_gpt(callback: CallbackQuery, callback_data: GptDeclineCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("admin_decline_gpt_")[1]
+    user_id = callback_data.user_id
     try:
-        await bot.send_message(int(user_id), "🚫 Ваш запрос на доступ к GPT был отклонён.", reply_markup=get_user_keyboard())
+        await bot.send_message(user_id, "🚫 Ваш запрос на доступ к GPT был отклонён.", reply_markup=get_user_keyboard())
     except Exception as e:
         logging.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
     await callback.message.edit_text("Запрос отклонён.")
 
+# Сводка запросов доступа к GPT для админов
+def render_gpt_digest(digest_id: str, items: list):
+    """
+    Render the admin notification for GPT access requests.
+
+    Args:
+        digest_id (str): ID of the digest (for the "approve all" button)
+        items (list): (user_id, username) of the users who requested access
+
+    Returns:
+        tuple: (text, InlineKeyboardMarkup)
+    """
+    if len(items) == 1:
+        user_id, username = items[0]
+        return f"Пользователь @{username} (ID: {user_id}) запросил доступ к GPT.", types.InlineKeyboardMarkup(
+            inline_keyboard=[[
+                types.InlineKeyboardButton(text="✅", callback_data=GptApproveCallback(user_id=user_id).pack()),
+                types.InlineKeyboardButton(text="❌", callback_data=GptDeclineCallback(user_id=user_id).pack()),
+            ]]
+        )
+    lines = [f"🔔 Запросили доступ к GPT: {len(items)}"]
+    lines += [f"• @{username} (ID: {user_id})" for user_id, username in items[:GPT_DIGEST_LINES]]
+    if len(items) > GPT_DIGEST_LINES:
+        lines.append(f"… и ещё {len(items) - GPT_DIGEST_LINES}")
+    return "\n".join(lines), types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(
+            text=f"✅ Одобрить всех ({len(items)})", callback_data=GptDigestApproveCallback(digest_id=digest_id).pack()
+        )],
+        # Список пользователей без доступа — работает и для сводок, которых уже нет в памяти
+        [types.InlineKeyboardButton(text="👀 Просмотреть", callback_data=UserListCallback(menu="grant").pack())],
+    ])
+
+async def gpt_digest_approve_callback(callback: CallbackQuery, callback_data: GptDigestApproveCallback):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    items = await admin_notifier.digest(callback_data.digest_id)
+    if items is None:
+        await callback.answer("Сводка устарела. Откройте «Просмотреть», чтобы выдать доступ вручную.", show_alert=True)
+        return
+    await callback.answer("Открываю доступ…")
+    granted = []
+    skipped = 0
+    for user_id, _ in items:
+        info = await user_store.get_user(user_id)
+        if info is None or info.get("gpt_access") or await user_store.is_blocked(user_id):
+            skipped += 1
+            continue
+        await user_store.update_user(user_id, gpt_access=True)
+        granted.append(user_id)
+
+    async def notify_user(user_id):
+        try:
+            await send_limiter.acquire()
+            await bot.send_message(user_id, "✅ Вам открыт доступ к GPT", reply_markup=get_user_keyboard())
+        except Exception as e:
+            logging.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
+
+    await asyncio.gather(*(notify_user(user_id) for user_id in granted))
+    text = f"{callback.message.text}\n\n✅ Доступ открыт: {len(granted)}"
+    if skipped:
+        text += f", пропущено (уже с доступом или заблокированы): {skipped}"
+    await callback.message.edit_text(text)
+
 # Обработка открытия доступа через список
-@dp.callback_query(lambda c: c.data and c.data.startswith("admin_grant_gpt_"))
-async def admin_grant_gpt(callback: CallbackQuery):
+async def admin_grant_gpt(callback: CallbackQuery, callback_data: GptGrantCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("admin_grant_gpt_")[1]
-    users_data = await load_users()
-    if user_id in users_data["users"]:
-        users_data["users"][user_id]["gpt_access"] = True
-        save_users(users_data)
+    user_id, anchor = callback_data.user_id, callback_data.anchor
+    if await user_store.update_user(user_id, gpt_access=True):
         logging.info(f"Админ {callback.from_user.id} выдал доступ к GPT пользователю {user_id}")
         try:
-            await bot.send_message(int(user_id), "✅ Вам открыт доступ к GPT!", reply_markup=get_user_keyboard())
+            await bot.send_message(user_id, "✅ Вам открыт доступ к GPT!", reply_markup=get_user_keyboard())
         except Exception as e:
             logging.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
         await callback.answer("Доступ открыт.", show_alert=True)
         # Обновить список
-        users_data = await load_users()
-        buttons = []
-        for uid, info in users_data["users"].items():
-            if not info.get("gpt_access", False):
-                username = info.get("username", "Unknown")
-                buttons.append([
-                    types.InlineKeyboardButton(
-                        text=f"{username} ({uid})",
-                        callback_data=f"admin_grant_gpt_{uid}"
-                    )
-                ])
-        if not buttons:
-            buttons = [[types.InlineKeyboardButton(text="Нет пользователей без доступа", callback_data="admin_menu")]]
-        buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
-        await callback.message.edit_text(
-            "Выберите пользователя для ОТКРЫТИЯ доступа к GPT:",
-            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+        await refresh_after_action(callback, "grant", user_id, anchor)
     else:
         await callback.answer("Пользователь не найден.", show_alert=True)
 
 # Обработка закрытия доступа через список
-@dp.callback_query(lambda c: c.data and c.data.startswith("admin_revoke_gpt_"))
-async def admin_revoke_gpt(callback: CallbackQuery):
+async def admin_revoke_gpt(callback: CallbackQuery, callback_data: GptRevokeCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("admin_revoke_gpt_")[1]
-    users_data = await load_users()
-    if user_id in users_data["users"]:
-        users_data["users"][user_id]["gpt_access"] = False
-        save_users(users_data)
+    user_id, anchor = callback_data.user_id, callback_data.anchor
+    if await user_store.update_user(user_id, gpt_access=False):
         logging.info(f"Админ {callback.from_user.id} закрыл доступ к GPT пользователю {user_id}")
         try:
-            await bot.send_message(int(user_id), "🚫 Ваш доступ к GPT был закрыт.", reply_markup=get_user_keyboard())
+            await bot.send_message(user_id, "🚫 Ваш доступ к GPT был закрыт.", reply_markup=get_user_keyboard())
         except Exception as e:
             logging.error(f"Ошибка при уведомлении пользователя {user_id}: {e}")
         await callback.answer("Доступ закрыт.", show_alert=True)
         # Обновить список
-        users_data = await load_users()
-        buttons = []
-        for uid, info in users_data["users"].items():
-            if info.get("gpt_access", False):
-                username = info.get("username", "Unknown")
-                buttons.append([
-                    types.InlineKeyboardButton(
-                        text=f"{username} ({uid})",
-                        callback_data=f"admin_revoke_gpt_{uid}"
-                    )
-                ])
-        if not buttons:
-            buttons = [[types.InlineKeyboardButton(text="Нет пользователей с доступом", callback_data="admin_menu")]]
-        buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
-        await callback.message.edit_text(
-            "Выберите пользователя для ЗАКРЫТИЯ доступа к GPT:",
-            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
+        await refresh_after_action(callback, "revoke", user_id, anchor)
     else:
         await callback.answer("Пользователь не найден.", show_alert=True)
 
-# Обработчик открытия меню выдачи доступа к GPT
-@dp.callback_query(lambda c: c.data == "admin_open_gpt_access")
-async def open_gpt_access_menu(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer("Нет прав.", show_alert=True)
-        return
-    users_data = await load_users()
-    buttons = []
-    for uid, info in users_data["users"].items():
-        if not info.get("gpt_access", False):
-            username = info.get("username", "Unknown")
-            buttons.append([
-                types.InlineKeyboardButton(
-                    text=f"{username} ({uid})",
-                    callback_data=f"admin_grant_gpt_{uid}"
-                )
-            ])
-    if not buttons:
-        buttons = [[types.InlineKeyboardButton(text="Нет пользователей без доступа", callback_data="admin_menu")]]
-    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
-    await callback.message.edit_text(
-        "Выберите пользователя для ОТКРЫТИЯ доступа к GPT:",
-        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
-    )
-    await callback.answer()
-
-# Обработчик открытия меню отзыва доступа к GPT
-@dp.callback_query(lambda c: c.data == "admin_close_gpt_access")
-async def close_gpt_access_menu(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer("Нет прав.", show_alert=True)
-        return
-    users_data = await load_users()
-    buttons = []
-    for uid, info in users_data["users"].items():
-        if info.get("gpt_access", False):
-            username = info.get("username", "Unknown")
-            buttons.append([
-                types.InlineKeyboardButton(
-                    text=f"{username} ({uid})",
-                    callback_data=f"admin_revoke_gpt_{uid}"
-                )
-            ])
-    if not buttons:
-        buttons = [[types.InlineKeyboardButton(text="Нет пользователей с доступом", callback_data="admin_menu")]]
-    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
-    await callback.message.edit_text(
-        "Выберите пользователя для ЗАКРЫТИЯ доступа к GPT:",
-        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
-    )
-    await callback.answer()
-
-@dp.callback_query()
-async def handle_admin_buttons(callback: CallbackQuery, state: FSMContext):
-    user_id = callback.from_user.id
-
-    # Проверяем, является ли пользователь администратором
-    if not is_admin(user_id):
-        await callback.answer("У вас нет прав для выполнения этой команды.")
-        return
-
-    # Обработка кнопок
-    if callback.data == "admin_view_users":
-        users_data = await load_users()
-        users_list = []
-        for user_id, user_info in users_data["users"].items():
-            username = user_info.get("username", "Unknown")
-            gpt_access = user_info.get("gpt_access", False)
-            users_list.append(f"{user_id} ({username}) | GPT: {'✅' if gpt_access else '❌'}")
-        users_text = "\n".join(users_list) or "Нет пользователей."
-        await callback.message.edit_text(
-            f"Пользователи:\n{users_text}",
-            reply_markup=get_admin_keyboard()
-        )
-    elif callback.data == "admin_block_user":
-        users_data = await load_users()
-        buttons = []
-        for uid, info in users_data["users"].items():
-            username = info.get("username", "Unknown")
-            if int(uid) in users_data.get("blocked", []):
-                btn = types.InlineKeyboardButton(
-                    text=f"{username} ({uid}) ✅",
-                    callback_data=f"unblock_user_{uid}"
-                )
-            else:
-                btn = types.InlineKeyboardButton(
-                    text=f"{username} ({uid}) ❌",
-                    callback_data=f"block_user_{uid}"
-                )
-            buttons.append([btn])
-        if not buttons:
-            buttons = [[types.InlineKeyboardButton(text="Нет пользователей", callback_data="admin_menu")]]
-        buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")])
-        await callback.message.edit_text(
-            "Список пользователей для блокировки/разблокировки:",
-            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
-        )
-    elif callback.data == "admin_menu":
-        try:
-            await callback.message.edit_text(
-                "Админ-меню:",
-                reply_markup=get_admin_keyboard()
-            )
-        except Exception:
-            try:
-                await callback.message.edit_reply_markup(reply_markup=get_admin_keyboard())
-            except Exception as e2:
-                await callback.answer("Ошибка: " + str(e2), show_alert=True)
-                return
-        await callback.answer()
-
 # Обработчик кнопки блокировки пользователя
-@dp.callback_query(lambda c: c.data and c.data.startswith("block_user_"))
-async def block_user_callback(callback: CallbackQuery):
-    print(f"block_user_callback: {callback.data}")
+async def block_user_callback(callback: CallbackQuery, callback_data: BlockUserCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("block_user_")[1]
-    users_data = await load_users()
-    try:
-        user_id_int = int(user_id)
-    except Exception:
-        await callback.answer("Ошибка ID пользователя.", show_alert=True)
-        return
-    if user_id_int not in [int(uid) for uid in users_data.get("users", {}).keys()]:
+    user_id, anchor = callback_data.user_id, callback_data.anchor
+    if await user_store.get_user(user_id) is None:
         await callback.answer("Пользователь не найден.", show_alert=True)
         return
-    if user_id_int not in users_data.get("blocked", []):
-        users_data["blocked"].append(user_id_int)
-        save_users(users_data)
+    if await user_store.block_user(user_id):
         await callback.answer("Пользователь заблокирован.", show_alert=True)
     else:
         await callback.answer("Пользователь уже заблокирован.", show_alert=True)
-    await show_lock_menu(callback)
-    return
+    await refresh_after_action(callback, "lock", user_id, anchor)
 
 # Обработчик кнопки разблокировки пользователя
-@dp.callback_query(lambda c: c.data and c.data.startswith("unblock_user_"))
-async def unblock_user_callback(callback: CallbackQuery):
+async def unblock_user_callback(callback: CallbackQuery, callback_data: UnblockUserCallback):
     if not is_admin(callback.from_user.id):
         await callback.answer("Нет прав.", show_alert=True)
         return
-    user_id = callback.data.split("unblock_user_")[1]
-    users_data = await load_users()
-    if int(user_id) in users_data.get("blocked", []):
-        users_data["blocked"].remove(int(user_id))
-        save_users(users_data)
+    user_id, anchor = callback_data.user_id, callback_data.anchor
+    if await user_store.unblock_user(user_id):
         await callback.answer("Пользователь разблокирован.", show_alert=True)
     else:
         await callback.answer("Пользователь не был заблокирован.", show_alert=True)
     # Обновить список
-    await show_lock_menu(callback)
-    return
+    await refresh_after_action(callback, "lock", user_id, anchor)
+
+# Обработка кнопки остановки рассылки
+async def stop_broadcast_callback(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    if broadcast_engine.running:
+        await broadcast_engine.cancel()
+        await callback.answer("Рассылка остановлена.")
+    else:
+        await callback.answer("Рассылка уже завершена.", show_alert=True)
+
+# Обработка кнопки "Назад" в админ-меню
+async def admin_menu_callback(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("У вас нет прав для выполнения этой команды.")
+        return
+    try:
+        await callback.message.edit_text(
+            "Админ-меню:",
+            reply_markup=get_admin_keyboard()
+        )
+    except Exception:
+        try:
+            await callback.message.edit_reply_markup(reply_markup=get_admin_keyboard())
+        except Exception as e2:
+            await callback.answer("Ошибка: " + str(e2), show_alert=True)
+            return
+    await callback.answer()
 
 # Обработка кнопки "Рассылка"
-@dp.callback_query(lambda c: c.data == "admin_broadcast")
 async def admin_broadcast_callback(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     if not is_admin(user_id):
@@ -525,28 +931,182 @@ async def admin_broadcast_callback(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-# Обработка кнопки "Статистика"
-@dp.callback_query(lambda c: c.data == "admin_stats")
-async def admin_stats_callback(callback: types.CallbackQuery):
-    users_data = await load_users()
-    total_users = len(users_data["users"])
-    blocked_users = len(users_data["blocked"])
-    stats_text = (
+# Страницы статистики: ключ AdminStatsCallback.page -> текст кнопки.
+# Здесь только сводка; подробные счётчики отдаёт /metrics (METRICS_ENABLED)
+ADMIN_STATS_PAGES = {
+    "pool": "🔌 Соединения",
+    "gpt": "🧠 GPT",
+    "storage": "💾 Хранилища",
+    "vpn": "🔑 VPN",
+}
+
+def shorten(text: str, limit: int) -> str:
+    """Cut text to ``limit`` characters, marking the cut with an ellipsis."""
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+async def render_stats_overview() -> str:
+    total_users = await user_store.count_users()
+    blocked_users = await user_store.count_blocked()
+    gpt = gpt_scheduler.stats()
+    order_counts = await order_store.count_by_status()
+    models = model_router.stats()
+    open_models = sum(1 for m in models if m["breaker"] != "closed")
+    text = (
         f"📊 Статистика использования бота:\n"
         f"• Всего пользователей: {total_users}\n"
         f"• Заблокировано: {blocked_users}\n"
+        f"• Запросов к GPT: выполняется {gpt['in_flight']}, в очереди {gpt['queued']}\n"
+        f"• Моделей недоступно: {open_models} из {len(models)}\n"
+        f"• Заявок VPN ожидает: {order_counts['pending']}\n\n"
+        f"Подробности — на страницах ниже."
     )
-    await callback.message.edit_text(
-        stats_text,
-        reply_markup=types.InlineKeyboardMarkup(
-            inline_keyboard=[[types.InlineKeyboardButton(text="🔙 Назад", callback_data="admin_menu")]]
+    if METRICS_ENABLED:
+        text += f"\nВсе счётчики: http://{metrics_server.host}:{metrics_server.port}/metrics"
+    return text
+
+async def render_stats_pool() -> str:
+    pool = http_client.stats()
+    avg_wait = pool["wait_time_total"] / pool["requests"] if pool["requests"] else 0.0
+    buttons = callback_router.stats()
+    notices = admin_notifier.stats()
+    text = (
+        f"🔌 Пул соединений OpenRouter:\n"
+        f"• Открыто: {pool['open']} (занято {pool['acquired']}, свободно {pool['idle']})\n"
+        f"• Ожидают соединения: {pool['waiting']}\n"
+        f"• Запросов: {pool['requests']}, ошибок: {pool['request_errors']}\n"
+        f"• Новых соединений: {pool['connections_created']}, переиспользовано: {pool['connections_reused']}\n"
+        f"• Ожидание в очереди пула: среднее {avg_wait * 1000:.1f} мс, макс. {pool['wait_time_max'] * 1000:.1f} мс\n\n"
+    )
+    if UPDATE_MODE == "webhook":
+        wh = webhook_server.stats()
+        text += (
+            f"📥 Webhook:\n"
+            f"• Принято: {wh['received']}, обработано: {wh['processed']}, ошибок: {wh['errors']}, в очереди: {wh['queued']}\n"
+            f"• Отклонено: {wh['rejected_full']} (очередь полна), {wh['unauthorized']} (неверный секрет)\n"
+            f"• Среднее время обработки: {wh['processing_avg'] * 1000:.1f} мс\n\n"
+        )
+    if WORKER_PROCESSES > 0:
+        status = await asyncio.to_thread(read_status, WORKER_SETTINGS["status_path"])
+        text += f"⚙️ Рабочие процессы ({WORKER_PROCESSES}):\n"
+        if status is None:
+            text += "• Нет данных\n\n"
+        else:
+            workers = status["workers"]
+            for w in workers[:ADMIN_STATS_LIST_LIMIT]:
+                text += (
+                    f"• #{w['index']}: {'🟢' if w['alive'] else '🔴'} pid {w['pid']}, "
+                    f"в очереди: {w['queue_depth']}, обработано: {w['processed']}, перезапусков: {w['restarts']}\n"
+                )
+            if len(workers) > ADMIN_STATS_LIST_LIMIT:
+                rest = workers[ADMIN_STATS_LIST_LIMIT:]
+                text += f"• … и ещё {len(rest)}, из них не работают: {sum(1 for w in rest if not w['alive'])}\n"
+            text += f"• Обновлено {int(time.time() - status['updated_at'])} с назад\n\n"
+    text += (
+        f"🔔 Уведомления админам: отправлено {notices['sent']}, ошибок {notices['failed']}, "
+        f"сводок {notices['digests']} (запросов в них {notices['digested_items']}, ждут {notices['pending']})\n"
+        f"🔘 Кнопки: обработано {buttons['dispatched']}, устаревших {buttons['unknown'] + buttons['invalid']}, "
+        f"не на своём шаге {buttons['wrong_state']}"
+    )
+    return text
+
+async def render_stats_gpt() -> str:
+    gpt = gpt_scheduler.stats()
+    hedge = hedge_policy.stats()
+    hedge_delay = f"{hedge['delay']:.2f} с" if hedge["delay"] is not None else "мало данных"
+    models = model_router.stats()
+    text = (
+        f"🧠 Очередь запросов к GPT:\n"
+        f"• Выполняется: {gpt['in_flight']}, в очереди: {gpt['queued']} (пользователей: {gpt['users_waiting']})\n"
+        f"• Принято: {gpt['submitted']}, отклонено: {gpt['rejected']}, объединено: {gpt['merged']}\n"
+        f"• Ожидание: среднее {gpt['wait_avg']:.2f} с, макс. {gpt['wait_max']:.2f} с\n\n"
+        f"🪁 Хеджирование{'' if hedge['enabled'] else ' (выключено)'}:\n"
+        f"• Порог: {hedge_delay}, запросов: {hedge['requests']}, хеджей: {hedge['fired']} ({hedge['fire_rate']:.1%})\n"
+        f"• Хедж победил: {hedge['won']}, проиграл: {hedge['lost']}, без ответа: {hedge['no_token']}, отказано по бюджету: {hedge['budget_denied']}\n\n"
+        f"🤖 Модели:\n"
+    )
+    breaker_icons = {"closed": "🟢", "half-open": "🟡", "open": "🔴"}
+    for m in models[:ADMIN_STATS_LIST_LIMIT]:
+        ttft = f"{m['ewma_ttft']:.2f} с" if m["ewma_ttft"] is not None else "—"
+        text += (
+            f"{breaker_icons[m['breaker']]} {m['name']}{' 🖼' if m['vision'] else ''}\n"
+            f"   TTFT: {ttft}, ошибки: {m['error_rate']:.0%} ({m['errors']}/{m['requests']})\n"
         )
+        if m["breaker"] == "open":
+            last_error = shorten(str(m["last_error"] or "таймаут"), ADMIN_STATS_ERROR_CHARS)
+            text += f"   отключена ещё на {m['open_for']:.0f} с (последняя ошибка: {last_error})\n"
+    if len(models) > ADMIN_STATS_LIST_LIMIT:
+        text += f"… и ещё {len(models) - ADMIN_STATS_LIST_LIMIT}\n"
+    return text
+
+async def render_stats_storage() -> str:
+    hist = conversation_history.stats()
+    cache = response_cache.stats()
+    images = image_pipeline.stats()
+    return (
+        f"📝 История диалогов:\n"
+        f"• В памяти: {hist['users']} из {hist['max_resident']}, сообщений: {hist['messages']}, ~{hist['tokens']} токенов\n"
+        f"• Выгружено на диск: {hist['spilled']}, загружено с диска: {hist['disk_loads']}, ожидают записи: {hist['pending_writes']}\n"
+        f"• Вытеснено сообщений: {hist['evicted_messages']}, кратких содержаний: {hist['summaries_made']} (ошибок: {hist['summary_errors']}, отброшено сообщений: {hist['summary_dropped']})\n\n"
+        f"💾 Кэш ответов (сброс: /flush_cache):\n"
+        f"• Записей: {cache['entries']}, попаданий: {cache['hits']}, промахов: {cache['misses']} ({cache['hit_ratio']:.0%})\n"
+        f"• Сэкономлено: {cache['bytes_saved'] / 1024:.1f} КБ ответов, вытеснено: {cache['evictions']}\n\n"
+        f"🖼 Изображения{'' if images['pillow'] else ' (без Pillow, без уменьшения)'}:\n"
+        f"• В кэше: {images['cached']} ({images['cached_bytes'] / 1024 / 1024:.1f} МБ), попаданий: {images['hits']}, обработано: {images['misses']}\n"
+        f"• Скачано: {images['bytes_downloaded'] / 1024:.0f} КБ, отправлено: {images['bytes_encoded'] / 1024:.0f} КБ, "
+        f"среднее время: {images['prepare_avg'] * 1000:.0f} мс"
     )
 
-# Обработка кнопки "Главное меню"
+async def render_stats_vpn() -> str:
+    order_counts = await order_store.count_by_status()
+    text = (
+        f"🧾 Заявки VPN: ожидают {order_counts['pending']}, в обработке {order_counts['processing']}, "
+        f"одобрено {order_counts['approved']}, отклонено {order_counts['rejected']}, отменено {order_counts['cancelled']}\n"
+    )
+    if not vpn_expiry.running:
+        return text + "🔑 Подписки VPN: выдача и планировщик работают в другом процессе"
+    expiry = vpn_expiry.stats()
+    keys = vpn_pool.stats()
+    return text + (
+        f"🔑 Подписки VPN: отслеживается {expiry['tracked']}, напоминаний отправлено {expiry['reminded']}, "
+        f"отключено {expiry['revoked']}, ошибок {expiry['failed']}\n"
+        f"🗝 Пул ключей VPN: готово {keys['ready']} из {keys['size']}, выдано {keys['taken']} "
+        f"(сгенерировано на лету {keys['generated_on_demand']}), адресов занято {keys['addresses_in_use']} "
+        f"из {keys['addresses_total']}"
+    )
+
+ADMIN_STATS_RENDERERS = {
+    "": render_stats_overview,
+    "pool": render_stats_pool,
+    "gpt": render_stats_gpt,
+    "storage": render_stats_storage,
+    "vpn": render_stats_vpn,
+}
+
+def get_stats_keyboard(page: str) -> types.InlineKeyboardMarkup:
+    buttons = [
+        types.InlineKeyboardButton(text=title, callback_data=AdminStatsCallback(page=key).pack())
+        for key, title in ADMIN_STATS_PAGES.items() if key != page
+    ]
+    if page:
+        buttons.insert(0, types.InlineKeyboardButton(text="📊 Обзор", callback_data=AdminStatsCallback().pack()))
+    keyboard = [buttons[:2], buttons[2:]]
+    keyboard.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminMenuCallback().pack())])
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+# Обработка кнопки "Статистика" и её страниц
+async def admin_stats_callback(callback: types.CallbackQuery, callback_data: AdminStatsCallback):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    render = ADMIN_STATS_RENDERERS.get(callback_data.page, render_stats_overview)
+    text = await render()
+    await callback.message.edit_text(
+        shorten(text, MAX_MESSAGE_LENGTH),
+        reply_markup=get_stats_keyboard(callback_data.page)
+    )
+    await callback.answer()
 
 # Обработка кнопки "Отмена" для рассылки
-@dp.callback_query(lambda callback: callback.data == "cancel_broadcast", BroadcastState.waiting_for_message)
 async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     # Очищаем состояние
     await state.clear()
@@ -559,7 +1119,6 @@ async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # Обработка текста для рассылки
-@dp.message(BroadcastState.waiting_for_message)
 async def process_broadcast(message: Message, state: FSMContext):
     user_id = message.from_user.id
     if not is_admin(user_id):
@@ -568,28 +1127,32 @@ async def process_broadcast(message: Message, state: FSMContext):
         return
 
     broadcast_text = message.text
-    users_data = await load_users()
-    count = 0
+    if not broadcast_text:
+        await message.answer("Отправьте текст для рассылки.")
+        return
 
-    blocked_ids = set(str(uid) for uid in users_data.get("blocked", []))
-    for uid, user_info in users_data.get("users", {}).items():
-        if uid not in blocked_ids:
-            try:
-                await bot.send_message(chat_id=int(uid), text=broadcast_text)
-                count += 1
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logging.error(f"Ошибка при отправке сообщения пользователю {uid}: {e}")
+    blocked_ids = await user_store.blocked_ids()
+    recipients = [int(uid) for uid, _ in await user_store.list_users() if int(uid) not in blocked_ids]
 
-    await message.answer(f"Рассылка завершена! Отправлено {count} пользователям.")
+    # Рассылка идёт в фоне, состояние администратора сразу освобождается
     await state.clear()
+    if not await broadcast_engine.start(broadcast_text, recipients, message.chat.id):
+        await message.answer("Предыдущая рассылка ещё не завершена.")
     await message.answer(
         "Админ-меню:",
         reply_markup=get_admin_keyboard()
     )
 
+# Сброс кэша ответов GPT
+async def flush_cache_command(message: Message):
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+    count = response_cache.clear()
+    logging.info(f"Админ {message.from_user.id} сбросил кэш ответов ({count} записей)")
+    await message.answer(f"Кэш ответов очищен: удалено записей — {count}.")
+
 # Обработка команды /start
-@dp.message(lambda msg: msg.text is not None and msg.text.startswith("/start"))
 async def send_welcome(message: types.Message):
     """
     Handle the /start command.
@@ -608,7 +1171,6 @@ async def send_welcome(message: types.Message):
         await message.answer("Произошла ошибка при запуске бота. Попробуйте позже.")
 
 # Обработка команды /help
-@dp.message(lambda msg: msg.text is not None and msg.text.startswith("ℹ️ Помощь"))
 async def help_command(message: types.Message):
     """
     Handle the help command.
@@ -633,7 +1195,7 @@ async def help_command(message: types.Message):
 def get_gpt_request_keyboard():
     return InlineKeyboardMarkup(
         inline_keyboard=[
-            [InlineKeyboardButton(text="🔓 Запросить доступ к GPT", callback_data="request_gpt_access")]
+            [InlineKeyboardButton(text="🔓 Запросить доступ к GPT", callback_data=GptRequestCallback().pack())]
         ]
     )
 
@@ -641,7 +1203,6 @@ def get_gpt_request_keyboard():
 from aiogram.filters import Command, CommandStart, CommandObject, StateFilter
 
 # Обработка изображений (будет вызван только если доступ есть)
-@dp.message(lambda msg: msg.photo is not None)
 async def handle_image_message(message: types.Message):
     """
     Handle image messages from users.
@@ -653,19 +1214,11 @@ async def handle_image_message(message: types.Message):
     username = message.from_user.username or "Unknown"
 
     try:
-        # Load user data
-        users_data = await load_users()
-
         # Add user to database if not exists
-        if str(user_id) not in users_data["users"]:
-            users_data["users"][str(user_id)] = {
-                "username": username,
-                "gpt_access": False
-            }
-            save_users(users_data)
+        user_info = await user_store.ensure_user(user_id, username)
 
         # Check if user is blocked
-        if is_blocked(user_id, users_data):
+        if await user_store.is_blocked(user_id):
             await message.answer(
                 "Вы были заблокированы.",
                 reply_markup=get_user_keyboard()
@@ -673,31 +1226,24 @@ async def handle_image_message(message: types.Message):
             return
 
         # Check GPT access
-        if not users_data["users"][str(user_id)].get("gpt_access", False):
+        if not user_info.get("gpt_access", False):
             await message.answer(
                 "Доступ к GPT пока не открыт. Запросите доступ.",
                 reply_markup=get_gpt_request_keyboard()
             )
             return
 
-        # Get image URL
-        photo = message.photo[-1]
-        file_info = await bot.get_file(photo.file_id)
-        image_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_info.file_path}"
+        # Download (or take from cache) a downscaled copy and send it inline
+        image_url = await image_pipeline.prepare(message.photo)
 
         # Get caption or default text
         caption = message.caption or "Что на этом изображении?"
 
         logging.info(f"Received image from user {user_id} with caption: {caption}")
 
-        # Add message to history
-        user_histories.setdefault(user_id, [])
-        user_histories[user_id].append({"role": "user", "content": caption})
-        if len(user_histories[user_id]) > HISTORY_LIMIT:
-            user_histories[user_id] = user_histories[user_id][-HISTORY_LIMIT:]
-
-        # Process with OpenRouter
-        await query_openrouter_stream(caption, message, image_url=image_url)
+        # Queue for OpenRouter; images are never merged with other messages
+        if not gpt_scheduler.submit(user_id, (caption, message, image_url), mergeable=False):
+            await message.answer(GPT_BUSY_TEXT, reply_markup=get_user_keyboard())
 
     except Exception as e:
         logging.error(f"Error in handle_image_message: {e}")
@@ -707,7 +1253,6 @@ async def handle_image_message(message: types.Message):
         )
 
 # Обработка текстовых сообщений (будет вызван только если доступ есть)
-@dp.message(StateFilter(None), lambda msg: msg.text)
 async def handle_text_message(message: Message, state: FSMContext):
     """
     Handle text messages from users.
@@ -722,7 +1267,7 @@ async def handle_text_message(message: Message, state: FSMContext):
 
     # --- Обработка кнопки очистки истории ---
     if user_input.strip() == "🧹 Очистить историю":
-        user_histories[user_id] = []
+        await conversation_history.clear(user_id)
         await message.answer("История диалога очищена!", reply_markup=get_user_keyboard())
         return
 
@@ -735,21 +1280,16 @@ async def handle_text_message(message: Message, state: FSMContext):
     if user_input.strip() == "Купить VPN":
         return
 
-    # Загружаем данные о пользователях
-    users_data = await load_users()
-
     # Добавляем пользователя в базу данных, если его еще нет
-    if str(user_id) not in users_data["users"]:
-        users_data["users"][str(user_id)] = {"username": username, "gpt_access": False}
-        save_users(users_data)
+    user_info = await user_store.ensure_user(user_id, username)
 
     # Проверяем, заблокирован ли пользователь
-    if is_blocked(user_id, users_data):
+    if await user_store.is_blocked(user_id):
         await message.answer("Вы были заблокированы.", reply_markup=get_user_keyboard())
         return
 
     # Проверяем доступ к GPT только для чата с GPT
-    if not users_data["users"][str(user_id)].get("gpt_access", False):
+    if not user_info.get("gpt_access", False):
         await message.answer(
             "Доступ к GPT пока не открыт. Запросите доступ.",
             reply_markup=get_gpt_request_keyboard()
@@ -758,17 +1298,9 @@ async def handle_text_message(message: Message, state: FSMContext):
 
     logging.info(f"Получено сообщение от пользователя {username}: {user_input}")
 
-    # --- Добавляем сообщение пользователя в историю ---
-    user_histories.setdefault(user_id, [])
-    user_histories[user_id].append({"role": "user", "content": user_input})
-    if len(user_histories[user_id]) > HISTORY_LIMIT:
-        user_histories[user_id] = user_histories[user_id][-HISTORY_LIMIT:]
-
-    try:
-        await query_openrouter_stream(user_input, message)
-    except Exception as e:
-        logging.error(f"Ошибка при обращении к ИИ: {e}")
-        await message.answer("Извините, произошла ошибка. Попробуйте позже.", reply_markup=get_user_keyboard())
+    # --- Ставим запрос в очередь; история пополняется при его выполнении ---
+    if not gpt_scheduler.submit(user_id, (user_input, message, None)):
+        await message.answer(GPT_BUSY_TEXT, reply_markup=get_user_keyboard())
 
 # --- Клавиатура для выбора периода VPN ---
 def get_vpn_inline_keyboard() -> InlineKeyboardMarkup:
@@ -781,12 +1313,12 @@ def get_vpn_inline_keyboard() -> InlineKeyboardMarkup:
     try:
         keyboard = [
             [
-                types.InlineKeyboardButton(text="1 месяц", callback_data="vpn_period_1m"),
-                types.InlineKeyboardButton(text="3 месяца", callback_data="vpn_period_3m")
+                types.InlineKeyboardButton(text="1 месяц", callback_data=VpnPeriodCallback(period="1m").pack()),
+                types.InlineKeyboardButton(text="3 месяца", callback_data=VpnPeriodCallback(period="3m").pack())
             ],
             [
-                types.InlineKeyboardButton(text="6 месяцев", callback_data="vpn_period_6m"),
-                types.InlineKeyboardButton(text="1 год", callback_data="vpn_period_1y")
+                types.InlineKeyboardButton(text="6 месяцев", callback_data=VpnPeriodCallback(period="6m").pack()),
+                types.InlineKeyboardButton(text="1 год", callback_data=VpnPeriodCallback(period="1y").pack())
             ]
         ]
         return types.InlineKeyboardMarkup(inline_keyboard=keyboard)
@@ -796,32 +1328,50 @@ def get_vpn_inline_keyboard() -> InlineKeyboardMarkup:
 
 # Регистрация обработчиков
 def register_handlers():
-    """Register all message and callback handlers."""
+    """
+    Register all message and callback handlers, once per process.
+
+    Message handlers are checked in registration order. Callback queries go
+    through callback_router, which picks the handler by the callback data
+    prefix.
+    """
     # VPN handlers
     dp.message.register(handle_buy_vpn, lambda msg: msg.text and msg.text.strip() == "Купить VPN")
-    dp.callback_query.register(select_period_inline, StateFilter(BuyVPNState.select_period), lambda c: c.data.startswith("vpn_period_"))
-    dp.callback_query.register(paid_inline, StateFilter(BuyVPNState.wait_payment), lambda c: c.data == "vpn_paid")
-    dp.callback_query.register(cancel_vpn_purchase, lambda c: c.data == "vpn_cancel")
-    dp.callback_query.register(reject_vpn_access, lambda c: c.data and c.data.startswith("vpn_reject_"))
-    
+    callback_router.add(VpnPeriodCallback, select_period_inline, state=BuyVPNState.select_period)
+    callback_router.add(VpnPaidCallback, paid_inline, state=BuyVPNState.wait_payment)
+    callback_router.add(VpnCancelCallback, cancel_vpn_purchase)
+    callback_router.add(VpnGrantCallback, grant_vpn_access)
+    callback_router.add(VpnRejectCallback, reject_vpn_access)
+    callback_router.add(VpnOrderCancelCallback, cancel_vpn_order)
+    callback_router.add(OrdersCallback, orders_callback)
+    callback_router.add(OrderSelectCallback, order_select_callback)
+    callback_router.add(OrdersBulkCallback, orders_bulk_callback)
+
     # Admin handlers
     dp.message.register(admin_command, lambda msg: msg.text is not None and msg.text.startswith("Админ-меню"))
-    dp.callback_query.register(show_lock_menu, lambda c: c.data == "admin_lock_menu")
-    dp.callback_query.register(process_gpt_access_request, lambda c: c.data == "request_gpt_access")
-    dp.callback_query.register(admin_approve_gpt, lambda c: c.data and c.data.startswith("admin_approve_gpt_"))
-    dp.callback_query.register(admin_decline_gpt, lambda c: c.data and c.data.startswith("admin_decline_gpt_"))
-    dp.callback_query.register(admin_grant_gpt, lambda c: c.data and c.data.startswith("admin_grant_gpt_"))
-    dp.callback_query.register(admin_revoke_gpt, lambda c: c.data and c.data.startswith("admin_revoke_gpt_"))
-    dp.callback_query.register(open_gpt_access_menu, lambda c: c.data == "admin_open_gpt_access")
-    dp.callback_query.register(close_gpt_access_menu, lambda c: c.data == "admin_close_gpt_access")
-    dp.callback_query.register(handle_admin_buttons)
-    dp.callback_query.register(block_user_callback, lambda c: c.data and c.data.startswith("block_user_"))
-    dp.callback_query.register(unblock_user_callback, lambda c: c.data and c.data.startswith("unblock_user_"))
-    dp.callback_query.register(admin_broadcast_callback, lambda c: c.data == "admin_broadcast")
-    dp.callback_query.register(admin_stats_callback, lambda c: c.data == "admin_stats")
-    dp.callback_query.register(cancel_broadcast, lambda callback: callback.data == "cancel_broadcast", BroadcastState.waiting_for_message)
-    
+    dp.message.register(process_admin_search, AdminSearchState.waiting_for_query)
+    callback_router.add(AdminMenuCallback, admin_menu_callback)
+    callback_router.add(UserListCallback, user_list_callback)
+    callback_router.add(AdminSearchCallback, admin_search_callback)
+    callback_router.add(AdminSearchCancelCallback, admin_search_cancel)
+    callback_router.add(UserCardCallback, admin_user_card)
+    callback_router.add(GptRequestCallback, process_gpt_access_request)
+    callback_router.add(GptApproveCallback, admin_approve_gpt)
+    callback_router.add(GptDeclineCallback, admin_decline_gpt)
+    callback_router.add(GptDigestApproveCallback, gpt_digest_approve_callback)
+    admin_notifier.register_digest("gpt_request", render_gpt_digest)
+    callback_router.add(GptGrantCallback, admin_grant_gpt)
+    callback_router.add(GptRevokeCallback, admin_revoke_gpt)
+    callback_router.add(BlockUserCallback, block_user_callback)
+    callback_router.add(UnblockUserCallback, unblock_user_callback)
+    callback_router.add(AdminBroadcastCallback, admin_broadcast_callback)
+    callback_router.add(AdminStatsCallback, admin_stats_callback)
+    callback_router.add(CancelBroadcastCallback, cancel_broadcast, state=BroadcastState.waiting_for_message)
+    callback_router.add(StopBroadcastCallback, stop_broadcast_callback)
+    dp.callback_query.register(callback_router.dispatch)
+
     # Message handlers
+    dp.message.register(flush_cache_command, Command("flush_cache"))
     dp.message.register(send_welcome, lambda msg: msg.text is not None and msg.text.startswith("/start"))
     dp.message.register(help_command, lambda msg: msg.text is not None and msg.text.startswith("ℹ️ Помощь"))
     dp.message.register(handle_image_message, lambda msg: msg.photo is not None)
@@ -831,7 +1381,39 @@ def register_handlers():
     # Chat member handler
     dp.chat_member.register(handle_new_chat_members)
 
-@dp.message(lambda msg: msg.text and msg.text.strip() == "Купить VPN")
+    # Время и ошибки обработчиков; кнопки подписываются по обработчику маршрута
+    handler_metrics = HandlerMetricsMiddleware(metrics, label=handler_metrics_label)
+    for observer in (dp.message, dp.callback_query, dp.chat_member):
+        observer.middleware(handler_metrics)
+
+def handler_metrics_label(event, data) -> str:
+    if isinstance(event, CallbackQuery):
+        return callback_router.route_name(event.data)
+    return data["handler"].callback.__name__
+
+def register_metrics(worker_index: int | None = None):
+    """Publish the stats() of the bot components as gauges and pick the /metrics port of this process."""
+    metrics.register_stats("openrouter_pool", http_client.stats)
+    metrics.register_stats("gpt_scheduler", gpt_scheduler.stats)
+    metrics.register_stats("history", conversation_history.stats)
+    metrics.register_stats("response_cache", response_cache.stats)
+    metrics.register_stats("image_pipeline", image_pipeline.stats)
+    metrics.register_stats("hedging", hedge_policy.stats)
+    metrics.register_stats("fsm_storage", storage.stats)
+    metrics.register_stats("callbacks", callback_router.stats)
+    metrics.register_stats("broadcast", broadcast_engine.stats)
+    metrics.register_stats("orders", order_store.stats)
+    metrics.register_stats("admin_notify", admin_notifier.stats)
+    if vpn_expiry.running:
+        metrics.register_stats("vpn_expiry", vpn_expiry.stats)
+        metrics.register_stats("vpn_pool", vpn_pool.stats)
+    if hasattr(user_store, "stats"):
+        metrics.register_stats("user_store", user_store.stats)
+    if UPDATE_MODE == "webhook" and worker_index is None:
+        metrics.register_stats("webhook", webhook_server.stats)
+    if worker_index is not None:
+        metrics_server.port = METRICS_SETTINGS["port"] + 1 + worker_index
+
 async def handle_buy_vpn(message: Message, state: FSMContext):
     """
     Handle the initial VPN purchase request.
@@ -844,8 +1426,7 @@ async def handle_buy_vpn(message: Message, state: FSMContext):
         logging.info(f"VPN purchase request from user {message.from_user.id}")
         
         # Проверяем, не заблокирован ли пользователь
-        users_data = await load_users()
-        if is_blocked(message.from_user.id, users_data):
+        if await user_store.is_blocked(message.from_user.id):
             await message.answer(
                 "Вы были заблокированы.",
                 reply_markup=get_user_keyboard()
@@ -879,31 +1460,31 @@ async def handle_buy_vpn(message: Message, state: FSMContext):
             reply_markup=get_user_keyboard()
         )
 
-@dp.callback_query(StateFilter(BuyVPNState.select_period), lambda c: c.data.startswith("vpn_period_"))
-async def select_period_inline(callback: CallbackQuery, state: FSMContext):
+async def select_period_inline(callback: CallbackQuery, callback_data: VpnPeriodCallback, state: FSMContext):
     """
     Handle VPN period selection.
     
     Args:
         callback (CallbackQuery): Callback query
+        callback_data (VpnPeriodCallback): Selected period
         state (FSMContext): FSM context
     """
     try:
         logging.info(f"VPN period selection from user {callback.from_user.id}: {callback.data}")
         
         period_map = {
-            "vpn_period_1m": {"period": "1 месяц", "price": 599, "days": 30},
-            "vpn_period_3m": {"period": "3 месяца", "price": 1797, "days": 90},
-            "vpn_period_6m": {"period": "6 месяцев", "price": 3594, "days": 180},
-            "vpn_period_1y": {"period": "1 год", "price": 7188, "days": 365},
+            "1m": {"period": "1 месяц", "price": 599, "days": 30},
+            "3m": {"period": "3 месяца", "price": 1797, "days": 90},
+            "6m": {"period": "6 месяцев", "price": 3594, "days": 180},
+            "1y": {"period": "1 год", "price": 7188, "days": 365},
         }
         
-        if callback.data not in period_map:
+        if callback_data.period not in period_map:
             logging.error(f"Invalid period selected: {callback.data}")
             await callback.answer("Неверный период. Попробуйте снова.", show_alert=True)
             return
             
-        selected = period_map[callback.data]
+        selected = period_map[callback_data.period]
         await state.update_data(
             period=selected["period"],
             price=selected["price"],
@@ -911,8 +1492,6 @@ async def select_period_inline(callback: CallbackQuery, state: FSMContext):
             username=callback.from_user.username or "Unknown"
         )
         
-        pending_vpn_requests[callback.from_user.id] = await state.get_data()
-        
         payment_text = (
             f"Вы выбрали: {selected['period']}\n"
             f"Стоимость: {selected['price']} рублей.\n\n"
@@ -924,8 +1503,8 @@ async def select_period_inline(callback: CallbackQuery, state: FSMContext):
         await callback.message.edit_text(
             payment_text,
             reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="Оплачено", callback_data="vpn_paid")],
-                [types.InlineKeyboardButton(text="Отмена", callback_data="vpn_cancel")]
+                [types.InlineKeyboardButton(text="Оплачено", callback_data=VpnPaidCallback().pack())],
+                [types.InlineKeyboardButton(text="Отмена", callback_data=VpnCancelCallback().pack())]
             ])
         )
         await state.set_state(BuyVPNState.wait_payment)
@@ -937,9 +1516,8 @@ async def select_period_inline(callback: CallbackQuery, state: FSMContext):
             "Произошла ошибка при выборе периода. Попробуйте позже.",
             reply_markup=get_user_keyboard()
         )
-        await state.finish()
+        await state.clear()
 
-@dp.callback_query(lambda c: c.data == "vpn_cancel")
 async def cancel_vpn_purchase(callback: CallbackQuery, state: FSMContext):
     """
     Handle VPN purchase cancellation.
@@ -949,10 +1527,7 @@ async def cancel_vpn_purchase(callback: CallbackQuery, state: FSMContext):
         state (FSMContext): FSM context
     """
     try:
-        user_id = callback.from_user.id
-        if user_id in pending_vpn_requests:
-            del pending_vpn_requests[user_id]
-        await state.finish()
+        await state.clear()
         await callback.message.edit_text(
             "Покупка VPN отменена.",
             reply_markup=get_user_keyboard()
@@ -962,10 +1537,9 @@ async def cancel_vpn_purchase(callback: CallbackQuery, state: FSMContext):
         logging.error(f"Error in cancel_vpn_purchase: {e}")
         await callback.answer("Ошибка при отмене. Попробуйте позже.", show_alert=True)
 
-@dp.callback_query(StateFilter(BuyVPNState.wait_payment), lambda c: c.data == "vpn_paid")
 async def paid_inline(callback: CallbackQuery, state: FSMContext):
     """
-    Handle VPN payment confirmation.
+    Handle VPN payment confirmation: create the order and notify admins.
     
     Args:
         callback (CallbackQuery): Callback query
@@ -975,9 +1549,17 @@ async def paid_inline(callback: CallbackQuery, state: FSMContext):
         data = await state.get_data()
         user_id = callback.from_user.id
         username = callback.from_user.username or "Unknown"
+        order = await order_store.create(
+            user_id, username, data.get("period", "N/A"), data.get("days", 30), data.get("price")
+        )
         
         await callback.message.edit_text(
-            "Ваша заявка принята. Ожидайте подтверждение оплаты от администратора."
+            f"Ваша заявка №{order['id']} принята. Ожидайте подтверждение оплаты от администратора.",
+            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(
+                    text="Отменить заявку", callback_data=VpnOrderCancelCallback(order_id=order["id"]).pack()
+                )]
+            ])
         )
         
         # Notify admins
@@ -985,33 +1567,27 @@ async def paid_inline(callback: CallbackQuery, state: FSMContext):
             [
                 types.InlineKeyboardButton(
                     text="✅ Подтвердить",
-                    callback_data=f"vpn_grant_{user_id}"
+                    callback_data=VpnGrantCallback(order_id=order["id"]).pack()
                 ),
                 types.InlineKeyboardButton(
                     text="❌ Отклонить",
-                    callback_data=f"vpn_reject_{user_id}"
+                    callback_data=VpnRejectCallback(order_id=order["id"]).pack()
                 )
-            ]
+            ],
+            [types.InlineKeyboardButton(text="🧾 Все заявки", callback_data=OrdersCallback().pack())]
         ])
         
         admin_message = (
-            f"Новая заявка на VPN!\n"
+            f"Новая заявка на VPN №{order['id']}!\n"
             f"От: @{username} (ID: {user_id})\n"
-            f"Период: {data.get('period', 'N/A')}\n"
-            f"Сумма: {data.get('price', 'N/A')} рублей"
+            f"Период: {order['period']}\n"
+            f"Сумма: {order['price'] if order['price'] is not None else 'N/A'} рублей"
         )
+        # Оплата — срочное событие: сразу всем админам, без сводки
+        await admin_notifier.notify(admin_message, admin_keyboard)
         
-        for admin_id in ADMIN_IDS:
-            try:
-                await bot.send_message(
-                    chat_id=admin_id,
-                    text=admin_message,
-                    reply_markup=admin_keyboard
-                )
-            except Exception as e:
-                logging.error(f"Failed to notify admin {admin_id}: {e}")
-        
-        await state.set_state(BuyVPNState.admin_grant)
+        # Заявка хранится в очереди заказов, диалог покупки закончен
+        await state.clear()
         await callback.answer()
         
     except Exception as e:
@@ -1020,60 +1596,518 @@ async def paid_inline(callback: CallbackQuery, state: FSMContext):
             "Произошла ошибка при обработке оплаты. Пожалуйста, свяжитесь с администратором.",
             reply_markup=get_user_keyboard()
         )
-        await state.finish()
+        await state.clear()
+
+async def cancel_vpn_order(callback: CallbackQuery, callback_data: VpnOrderCancelCallback):
+    """
+    Handle cancellation of a VPN order by its buyer before an admin resolves it.
+    
+    Args:
+        callback (CallbackQuery): Callback query
+        callback_data (VpnOrderCancelCallback): Order to cancel
+    """
+    try:
+        if await order_store.cancel(callback_data.order_id, callback.from_user.id):
+            await callback.message.edit_text(f"Заявка №{callback_data.order_id} отменена.")
+            await callback.answer()
+        else:
+            await callback.answer("Заявку уже нельзя отменить: она обработана администратором или заменена новой.", show_alert=True)
+    except Exception as e:
+        logging.error(f"Error in cancel_vpn_order: {e}")
+        await callback.answer("Ошибка при отмене. Попробуйте позже.", show_alert=True)
+
+async def save_vpn_registry(attempts: int = 3) -> bool:
+    """
+    Save vpn_users.
+
+    Saves are serialized so an older snapshot never overwrites a newer one.
+    Calls that wait for a running save share the next one: its snapshot
+    already contains their changes, so a bulk approval writes the file a
+    few times rather than once per order. A failed write is retried with
+    a growing pause.
+
+    Returns:
+        bool: Whether a snapshot with the caller's changes is on disk
+    """
+    vpn_users_saves["requested"] += 1
+    ticket = vpn_users_saves["requested"]
+    for attempt in range(attempts):
+        async with vpn_users_lock:
+            if vpn_users_saves["written"] >= ticket:
+                return True
+            target = vpn_users_saves["requested"]
+            try:
+                await asyncio.to_thread(save_vpn_users, dict(vpn_users), VPN_USERS_FILE)
+                vpn_users_saves["written"] = target
+                return True
+            except Exception as e:
+                logging.error(f"Failed to save VPN users (attempt {attempt + 1} of {attempts}): {e}")
+        if attempt + 1 < attempts:
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+async def sync_vpn_peers():
+    """Add the peers of all issued configs to the WireGuard interface (after a server restart)."""
+    interface = VPN_SERVER_SETTINGS.get("interface")
+    if not interface:
+        logging.warning("VPN_SERVER_SETTINGS has no interface: add the peers of issued configs to the server manually")
+        return
+    for uid, entry in list(vpn_users.items()):
+        try:
+            await add_peer(interface, entry)
+        except Exception as e:
+            logging.error(f"Failed to add WireGuard peer of user {uid}: {e}")
+
+async def remove_vpn_peer(entry: dict):
+    interface = VPN_SERVER_SETTINGS.get("interface")
+    if not interface:
+        return
+    try:
+        await remove_peer(interface, entry["public_key"])
+    except Exception as e:
+        logging.error(f"Failed to remove WireGuard peer {entry['address']}: {e}")
+
+async def issue_vpn(order: dict) -> dict:
+    """
+    Issue or extend VPN access for a claimed order and send the config.
+
+    A new config is added to the WireGuard server (if it is local) and
+    saved in the registry before the pool forgets its credential and
+    before the config is sent, so a crash at any point neither loses nor
+    reissues an address. If the registry can't be saved, the grant is
+    rolled back and the order fails.
+
+    Returns:
+        dict: {"ok", "expires", "delivered", "error"}
+    """
+    user_id = order["user_id"]
+    uid = str(user_id)
+    previous = vpn_users.get(uid)
+    entry = None
+    credential = None
+    peer_added = False
+    registry_saved = False
+    try:
+        if previous is None:
+            credential = await vpn_pool.take()
+            if VPN_SERVER_SETTINGS.get("interface"):
+                await add_peer(VPN_SERVER_SETTINGS["interface"], credential)
+                peer_added = True
+        # Продление считается от текущей даты окончания, если подписка ещё действует
+        info = await user_store.get_user(user_id) or {}
+        start = datetime.now()
+        if info.get("vpn_access") and info.get("vpn_expires"):
+            start = max(start, datetime.fromisoformat(info["vpn_expires"]))
+        expires_at = start + timedelta(days=order["days"])
+        entry = dict(previous or credential)
+        entry.update(expires=expires_at.isoformat(), granted_at=datetime.now().isoformat(), username=order["username"])
+        vpn_users[uid] = entry
+        # Адрес считается выданным только после записи в реестр
+        if not await save_vpn_registry():
+            raise RuntimeError("не удалось сохранить реестр vpn_users.json")
+        registry_saved = True
+        expires = await vpn_expiry.set_expiry(user_id, expires_at)
+    except Exception as e:
+        logging.error(f"Failed to issue VPN for order {order['id']} (user {user_id}): {e}")
+        if entry is not None and vpn_users.get(uid) is entry:
+            if previous is None:
+                vpn_users.pop(uid)
+            else:
+                vpn_users[uid] = previous
+            if registry_saved:
+                await save_vpn_registry()
+        if peer_added:
+            await remove_vpn_peer(credential)
+        if credential is not None:
+            vpn_pool.release(credential["address"])
+        return {"ok": False, "expires": None, "delivered": False, "error": str(e) or type(e).__name__}
+
+    if credential is not None:
+        await vpn_pool.commit(credential["address"])
+    delivered = True
+    try:
+        await send_limiter.acquire()
+        await bot.send_document(
+            chat_id=user_id,
+            document=BufferedInputFile(render_config(entry, VPN_SERVER_SETTINGS).encode(), filename=f"vpn_{user_id}.conf"),
+            caption=(
+                f"✅ Оплата подтверждена! VPN активен до {expires[:10]}.\n"
+                "Импортируйте файл в приложение WireGuard."
+            ),
+            reply_markup=get_user_keyboard()
+        )
+    except Exception as e:
+        delivered = False
+        logging.error(f"Failed to send VPN config to user {user_id}: {e}")
+    return {"ok": True, "expires": expires, "delivered": delivered, "error": None}
+
+async def reject_order(order: dict) -> dict:
+    """Reject a claimed order and notify the buyer."""
+    user_id = order["user_id"]
+    try:
+        await send_limiter.acquire()
+        await bot.send_message(
+            chat_id=user_id,
+            text="❌ Ваша оплата не подтверждена. Пожалуйста, свяжитесь с администратором.",
+            reply_markup=get_user_keyboard()
+        )
+    except Exception as e:
+        logging.error(f"Failed to notify user {user_id} about rejection: {e}")
+    return {"ok": True, "expires": None, "delivered": True, "error": None}
+
+async def resolve_orders(order_ids: list, approve: bool, admin_id: int) -> str:
+    """
+    Approve or reject VPN orders in one action.
+
+    Orders still pending are claimed at once (another admin can't take them
+    too), handled concurrently and recorded in one transaction. Orders whose
+    grant failed go back to the queue.
+
+    Args:
+        order_ids (list): IDs of the orders to resolve
+        approve (bool): Approve (issue VPN) or reject
+        admin_id (int): Admin who resolves them
+
+    Returns:
+        str: Summary for the admin
+    """
+    claimed = await order_store.claim(order_ids, admin_id)
+    skipped = len(set(order_ids)) - len(claimed)
+    semaphore = asyncio.Semaphore(VPN_ORDER_CONCURRENCY)
+
+    async def resolve(order):
+        async with semaphore:
+            return await (issue_vpn(order) if approve else reject_order(order))
+
+    results = await asyncio.gather(*(resolve(order) for order in claimed))
+    done_status = APPROVED if approve else REJECTED
+    await order_store.finish([
+        (order["id"], done_status if result["ok"] else PENDING, result["error"])
+        for order, result in zip(claimed, results)
+    ])
+
+    ok = sum(1 for result in results if result["ok"])
+    lines = [f"{'✅ Одобрено' if approve else '❌ Отклонено'}: {ok} из {len(claimed)}"] if claimed else []
+    if skipped:
+        lines.append(f"⏭ Пропущено (уже обработаны, отменены или покупатель ждёт выдачи по другой заявке): {skipped}")
+    for order, result in zip(claimed[:ORDER_SUMMARY_LINES], results):
+        who = f"№{order['id']} @{order['username']} ({order['user_id']})"
+        if not result["ok"]:
+            lines.append(f"⚠️ {who}: ошибка, заявка возвращена в очередь ({result['error']})")
+        elif approve:
+            lines.append(
+                f"• {who}: до {result['expires'][:10]}" + ("" if result["delivered"] else ", конфиг не доставлен")
+            )
+        else:
+            lines.append(f"• {who}")
+    if len(claimed) > ORDER_SUMMARY_LINES:
+        lines.append(f"… и ещё {len(claimed) - ORDER_SUMMARY_LINES}")
+    return "\n".join(lines)
+
+async def grant_vpn_access(callback: CallbackQuery, callback_data: VpnGrantCallback):
+    """
+    Handle VPN payment approval by admin from the order notification.
+    
+    Args:
+        callback (CallbackQuery): Callback query
+        callback_data (VpnGrantCallback): Order to approve
+    """
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Недостаточно прав.", show_alert=True)
+        return
+    if not vpn_pool.running:
+        await callback.answer(VPN_UNAVAILABLE_TEXT, show_alert=True)
+        return
+    try:
+        summary = await resolve_orders([callback_data.order_id], True, callback.from_user.id)
+        await callback.message.edit_text(f"{callback.message.text}\n\n{summary}")
+        await callback.answer()
+    except Exception as e:
+        logging.error(f"Error in grant_vpn_access: {e}")
+        await callback.answer("Ошибка при выдаче доступа. Попробуйте ещё раз.", show_alert=True)
 
-@dp.callback_query(lambda c: c.data and c.data.startswith("vpn_reject_"))
-async def reject_vpn_access(callback: CallbackQuery):
+async def release_vpn_config(user_id: int):
+    """Forget the config of an expired subscription and free its address (ExpiryScheduler hook)."""
+    entry = vpn_users.pop(str(user_id), None)
+    if entry is None:
+        return
+    await remove_vpn_peer(entry)
+    vpn_pool.release(entry["address"])
+    await save_vpn_registry()
+
+async def reject_vpn_access(callback: CallbackQuery, callback_data: VpnRejectCallback):
     """
-    Handle VPN access rejection by admin.
+    Handle VPN access rejection by admin from the order notification.
     
     Args:
         callback (CallbackQuery): Callback query
+        callback_data (VpnRejectCallback): Order to reject
     """
     if not is_admin(callback.from_user.id):
         await callback.answer("Недостаточно прав.", show_alert=True)
         return
         
     try:
-        user_id = int(callback.data.split("_")[-1])
-        if user_id in pending_vpn_requests:
-            del pending_vpn_requests[user_id]
-            
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text="❌ Ваша оплата не подтверждена. Пожалуйста, свяжитесь с администратором.",
-                reply_markup=get_user_keyboard()
-            )
-        except Exception as e:
-            logging.error(f"Failed to notify user {user_id} about rejection: {e}")
-            
-        await callback.message.edit_text("Доступ отклонен.")
-        await callback.answer("Пользователь уведомлен об отказе.", show_alert=True)
+        summary = await resolve_orders([callback_data.order_id], False, callback.from_user.id)
+        await callback.message.edit_text(f"{callback.message.text}\n\n{summary}")
+        await callback.answer()
         
     except Exception as e:
         logging.error(f"Error in reject_vpn_access: {e}")
         await callback.answer("Ошибка при отклонении доступа.", show_alert=True)
 
+# Очередь заявок на VPN в админ-меню
+async def render_orders_page(selected: set, after: int = None, before: int = None):
+    """
+    Render one page of the pending VPN orders.
+
+    Args:
+        selected (set): IDs of the orders the admin has ticked
+        after (int, optional): Show orders with IDs greater than this cursor
+        before (int, optional): Show the page right before this cursor
+
+    Returns:
+        tuple: (text, InlineKeyboardMarkup)
+    """
+    orders, has_prev, has_next = await order_store.page(PENDING, after=after, before=before, limit=ADMIN_PAGE_SIZE)
+    if not orders and after is not None:
+        # Заявки с этой страницы обработаны — показываем предыдущую
+        orders, has_prev, has_next = await order_store.page(PENDING, before=after + 1, limit=ADMIN_PAGE_SIZE)
+    anchor = str(orders[0]["id"] - 1) if orders and has_prev else ""
+    counts = await order_store.count_by_status()
+
+    buttons = []
+    for order in orders:
+        mark = "☑️" if order["id"] in selected else "⬜"
+        price = f", {order['price']} ₽" if order["price"] is not None else ""
+        buttons.append([types.InlineKeyboardButton(
+            text=f"{mark} №{order['id']} @{order['username']} — {order['period']}{price}",
+            callback_data=OrderSelectCallback(order_id=order["id"], anchor=anchor).pack()
+        )])
+    if orders:
+        scope = f"отмеченные ({len(selected)})" if selected else "страницу"
+        buttons.append([
+            types.InlineKeyboardButton(
+                text=f"✅ Одобрить {scope}", callback_data=OrdersBulkCallback(action="approve", anchor=anchor).pack()
+            ),
+            types.InlineKeyboardButton(
+                text=f"❌ Отклонить {scope}", callback_data=OrdersBulkCallback(action="reject", anchor=anchor).pack()
+            ),
+        ])
+    nav = []
+    if has_prev:
+        nav.append(types.InlineKeyboardButton(text="◀️", callback_data=OrdersCallback(before=orders[0]["id"]).pack()))
+    if has_next:
+        nav.append(types.InlineKeyboardButton(text="▶️", callback_data=OrdersCallback(after=orders[-1]["id"]).pack()))
+    if nav:
+        buttons.append(nav)
+    buttons.append([types.InlineKeyboardButton(text="🔙 Назад", callback_data=AdminMenuCallback().pack())])
+
+    if orders:
+        text = (
+            f"🧾 Заявки на VPN: ожидают {counts[PENDING]}.\n"
+            "Отметьте заявки и выберите действие; без отметок оно применяется ко всей странице."
+        )
+    else:
+        text = "🧾 Нет заявок, ожидающих подтверждения."
+    return text, types.InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def orders_callback(callback: CallbackQuery, callback_data: OrdersCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    selected = set((await state.get_data()).get("selected_orders", []))
+    text, markup = await render_orders_page(selected, after=callback_data.after, before=callback_data.before)
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+async def order_select_callback(callback: CallbackQuery, callback_data: OrderSelectCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    selected = set((await state.get_data()).get("selected_orders", []))
+    selected ^= {callback_data.order_id}
+    await state.update_data(selected_orders=sorted(selected))
+    text, markup = await render_orders_page(selected, after=parse_anchor(callback_data.anchor))
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+async def orders_bulk_callback(callback: CallbackQuery, callback_data: OrdersBulkCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("Нет прав.", show_alert=True)
+        return
+    approve = callback_data.action == "approve"
+    if approve and not vpn_pool.running:
+        await callback.answer(VPN_UNAVAILABLE_TEXT, show_alert=True)
+        return
+    after = parse_anchor(callback_data.anchor)
+    order_ids = (await state.get_data()).get("selected_orders", [])
+    if not order_ids:
+        orders, _, _ = await order_store.page(PENDING, after=after, limit=ADMIN_PAGE_SIZE)
+        order_ids = [order["id"] for order in orders]
+    await callback.answer("Обрабатываю заявки…")
+    try:
+        summary = await resolve_orders(order_ids, approve, callback.from_user.id)
+    except Exception as e:
+        logging.error(f"Error in orders_bulk_callback: {e}")
+        summary = "Ошибка при обработке заявок. Попробуйте ещё раз."
+    await state.update_data(selected_orders=[])
+    await callback.message.answer(summary)
+    text, markup = await render_orders_page(set(), after=after)
+    await callback.message.edit_text(text, reply_markup=markup)
+
 # Функция для отправки запроса к OpenRouter с потоковой передачей
+def get_openrouter_headers() -> dict:
+    return {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+        "HTTP-Referer": "https://yourwebsite.com",
+        "X-Title": "Telegram Bot",
+    }
+
+async def summarize_history(summary: str, messages: list) -> str:
+    """
+    Fold evicted history messages into the rolling summary.
+
+    Called by HistoryManager in the background, never on the reply path.
+
+    Args:
+        summary (str): Previous summary, may be empty
+        messages (list): Evicted messages, oldest first
+
+    Returns:
+        str: Updated summary
+    """
+    dialog = "\n".join(
+        f"{'Пользователь' if m['role'] == 'user' else 'Ассистент'}: {m['content']}" for m in messages
+    )
+    if summary:
+        dialog = f"Предыдущее краткое содержание: {summary}\n\n{dialog}"
+    model = model_router.choose(vision=False)
+    if model is None:
+        raise RuntimeError("No model available")
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": HISTORY_SUMMARY_PROMPT},
+            {"role": "user", "content": dialog},
+        ],
+        "temperature": 0.2,
+        "max_tokens": HISTORY_SETTINGS["summary_max_tokens"],
+        "stream": False,
+    }
+    # choose() мог отдать этот запрос как пробный для полуоткрытой модели,
+    # поэтому исход сообщается роутеру в любом случае
+    try:
+        async with http_client.request("POST", OPENROUTER_API_URL, headers=get_openrouter_headers(), json=payload) as response:
+            status = response.status
+            if status == 200:
+                data = await response.json()
+                content = data["choices"][0]["message"]["content"]
+    except Exception:
+        model_router.record_failure(model)
+        raise
+    if status != 200:
+        model_router.record_failure(model, status)
+        raise RuntimeError(f"OpenRouter error {status}")
+    # Время ответа без стриминга не сравнимо с TTFT, поэтому задержку не учитываем
+    model_router.record_success(model)
+    return content
+
+conversation_history = HistoryManager(
+    summarize_history, store=HistoryDiskStore(HISTORY_DB_FILE, on_timing=store_timer("history")), **HISTORY_SETTINGS
+)
+
+async def stream_from_model(model: str, payload: dict, push) -> str | None:
+    """
+    Stream a reply of one model and report the outcome to the router.
+
+    Args:
+        model (str): OpenRouter model name
+        payload (dict): Request payload without the model
+        push: Callable receiving each content fragment
+
+    Returns:
+        str | None: None on success, otherwise an error text for the user
+    """
+    started = time.monotonic()
+    ttft = None
+    chunks = 0
+    received = 0
+
+    async def count_bytes(body):
+        nonlocal received
+        async for data in body:
+            received += len(data)
+            yield data
+
+    try:
+        async with http_client.request(
+            "POST", OPENROUTER_API_URL, headers=get_openrouter_headers(), json={**payload, "model": model}
+        ) as response:
+            if response.status != 200:
+                openrouter_responses.inc(model, str(response.status))
+                model_router.record_failure(model, response.status)
+                try:
+                    error_data = await response.json()
+                    error_message = error_data.get("error", {}).get("message", "Unknown error")
+                    logging.error(f"OpenRouter error ({model}): {response.status}, {error_message}")
+                    return f"Error {response.status}: {error_message}"
+                except Exception as e:
+                    logging.error(f"Error response processing error: {e}")
+                    return f"Error {response.status}: Failed to process error message"
+            try:
+                async for delta in iter_openrouter_deltas(count_bytes(response.content.iter_any())):
+                    content = delta.get("content")
+                    if content:
+                        chunks += 1
+                        if ttft is None:
+                            ttft = time.monotonic() - started
+                    push(content)
+            except asyncio.CancelledError:
+                # Lost a hedged race: drop the connection instead of draining it
+                response.close()
+                openrouter_responses.inc(model, "cancelled")
+                raise
+            finally:
+                openrouter_bytes.inc(model, amount=received)
+    except asyncio.TimeoutError:
+        openrouter_responses.inc(model, "timeout")
+        model_router.record_failure(model)
+        return "Request timed out. Please try again."
+    except Exception as e:
+        logging.error(f"Request error ({model}): {e}")
+        openrouter_responses.inc(model, "error")
+        model_router.record_failure(model)
+        return "An error occurred. Please try again later."
+    if ttft is None:
+        openrouter_responses.inc(model, "empty")
+        model_router.record_failure(model)
+        return "Не удалось получить ответ. Попробуйте ещё раз."
+    duration = time.monotonic() - started
+    openrouter_responses.inc(model, "200")
+    openrouter_ttft.observe(ttft, model)
+    openrouter_stream_seconds.observe(duration, model)
+    if duration > ttft:
+        openrouter_tokens_per_second.observe(chunks / (duration - ttft), model)
+    model_router.record_success(model, ttft)
+    hedge_policy.observe(ttft)
+    return None
+
 async def query_openrouter_stream(prompt: str, message: Message, image_url: str = None):
     """
     Send a streaming request to OpenRouter API and handle the response.
+
+    The model is picked by the router; if it fails before the first token,
+    the next healthiest capable model is tried.
     
     Args:
         prompt (str): User's input prompt
         message (Message): Original Telegram message
         image_url (str, optional): URL of the image if present
     """
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://yourwebsite.com",
-        "X-Title": "Telegram Bot",
-    }
-
     user_id = message.from_user.id
-    messages = user_histories.get(user_id, [])[:]
+    messages = await conversation_history.build_messages(user_id)
     
     if image_url and messages and messages[-1]["role"] == "user":
         messages[-1]["content"] = [
@@ -1081,147 +2115,92 @@ async def query_openrouter_stream(prompt: str, message: Message, image_url: str
             {"type": "image_url", "image_url": {"url": image_url}}
         ]
 
+    vision = image_url is not None
     payload = {
-        "model": "qwen/qwen2.5-vl-3b-instruct:free",
         "messages": messages if messages else [{"role": "user", "content": prompt}],
         "temperature": BOT_SETTINGS["temperature"],
         "max_tokens": BOT_SETTINGS["max_tokens"],
         "stream": BOT_SETTINGS["stream"],
     }
 
-    sent_message = await message.answer(".")
-    buffer = ""
-    last_sent_text = ""
-    last_update_time = asyncio.get_event_loop().time()
-    wave_states = [".", "..", "...", ".."]
-    wave_index = 0
-    wave_task_running = True
-    last_wave_text = ""
-
-    async def animate_wave():
-        nonlocal wave_index, wave_task_running, last_wave_text
-        try:
-            while wave_task_running:
-                await asyncio.sleep(0.6)
-                if not wave_task_running:
-                    break
-                new_text = wave_states[wave_index]
-                if new_text != last_wave_text:
-                    try:
-                        await bot.edit_message_text(
-                            chat_id=sent_message.chat.id,
-                            message_id=sent_message.message_id,
-                            text=new_text
-                        )
-                        last_wave_text = new_text
-                    except Exception as e:
-                        if "message is not modified" not in str(e):
-                            logging.error(f"Animation error: {e}")
-                wave_index = (wave_index + 1) % len(wave_states)
-        except Exception as e:
-            logging.error(f"Animation error: {e}")
+    # Модель выбирается роутером, поэтому ключ кэша зависит только от типа запроса
+    cache_key = response_cache.make_key(
+        "vision" if vision else "text", payload["messages"], payload["temperature"], payload["max_tokens"]
+    )
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        # Готовый ответ отправляем сразу, без анимации и стриминга
+        for start in range(0, len(cached), MAX_MESSAGE_LENGTH):
+            await message.answer(cached[start:start + MAX_MESSAGE_LENGTH])
+        await conversation_history.append(user_id, "assistant", cached)
+        return
 
-    wave_task = asyncio.create_task(animate_wave())
+    sent_message = await message.answer(".")
+    editor = StreamingMessageEditor(
+        bot, sent_message.chat.id, sent_message.message_id, **STREAM_EDIT_SETTINGS
+    )
+    editor.start()
+    final_text = None
+    tried = []
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(OPENROUTER_API_URL, headers=headers, json=payload, timeout=30) as response:
-                if response.status == 200:
-                    async for chunk in response.content.iter_any():
-                        if not wave_task_running:
-                            break
-                        try:
-                            chunk_text = chunk.decode("utf-8")
-                            for line in chunk_text.split("\n"):
-                                if not line.strip():
-                                    continue
-                                if line.startswith("data: "):
-                                    line_data = line[6:].strip()
-                                    if line_data == "[DONE]":
-                                        break
-                                    try:
-                                        json_data = json.loads(line_data)
-                                        content = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                                        if content:
-                                            buffer += content
-
-                                            current_time = asyncio.get_event_loop().time()
-                                            if len(buffer) > 40 and current_time - last_update_time >= 4:
-                                                new_text = buffer + "..."
-                                                if new_text != last_sent_text:
-                                                    try:
-                                                        await bot.edit_message_text(
-                                                            chat_id=sent_message.chat.id,
-                                                            message_id=sent_message.message_id,
-                                                            text=new_text
-                                                        )
-                                                        last_sent_text = new_text
-                                                        last_update_time = current_time
-                                                    except Exception as e:
-                                                        if "message is not modified" not in str(e):
-                                                            logging.error(f"Message update error: {e}")
-                                    except json.JSONDecodeError:
-                                        logging.error(f"JSON decode error in line: {line}")
-                                    except Exception as e:
-                                        logging.error(f"Content processing error: {e}")
-                        except Exception as e:
-                            logging.error(f"Chunk processing error: {e}")
-                    
-                    if buffer and buffer != last_sent_text:
-                        try:
-                            await bot.edit_message_text(
-                                chat_id=sent_message.chat.id,
-                                message_id=sent_message.message_id,
-                                text=buffer
-                            )
-                        except Exception as e:
-                            if "message is not modified" not in str(e):
-                                logging.error(f"Final message update error: {e}")
-                else:
-                    try:
-                        error_data = await response.json()
-                        error_message = error_data.get("error", {}).get("message", "Unknown error")
-                        logging.error(f"OpenRouter error: {response.status}, {error_message}")
-                        await bot.edit_message_text(
-                            chat_id=sent_message.chat.id,
-                            message_id=sent_message.message_id,
-                            text=f"Error {response.status}: {error_message}"
-                        )
-                    except Exception as e:
-                        logging.error(f"Error response processing error: {e}")
-                        await bot.edit_message_text(
-                            chat_id=sent_message.chat.id,
-                            message_id=sent_message.message_id,
-                            text=f"Error {response.status}: Failed to process error message"
-                        )
-    except asyncio.TimeoutError:
-        await bot.edit_message_text(
-            chat_id=sent_message.chat.id,
-            message_id=sent_message.message_id,
-            text="Request timed out. Please try again."
-        )
-    except Exception as e:
-        logging.error(f"Request error: {e}")
-        await bot.edit_message_text(
-            chat_id=sent_message.chat.id,
-            message_id=sent_message.message_id,
-            text="An error occurred. Please try again later."
-        )
+        while len(tried) < model_router.max_attempts:
+            model = model_router.choose(vision, exclude=tried)
+            if model is None:
+                if not tried:
+                    final_text = "Все модели сейчас недоступны. Попробуйте позже."
+                break
+            tried.append(model)
+
+            def start_hedge(push, model=model):
+                # Запасная модель, если есть, иначе повтор запроса к той же
+                hedge_model = model_router.choose(vision, exclude=tried) or model
+                if hedge_model != model:
+                    tried.append(hedge_model)
+                return stream_from_model(hedge_model, payload, push)
+
+            final_text = await hedge_policy.run(
+                lambda push, model=model: stream_from_model(model, payload, push), start_hedge, editor.append
+            )
+            # После первых токенов переключаться на другую модель уже поздно
+            if final_text is None or editor.text:
+                break
     finally:
-        wave_task_running = False
-        try:
-            await wave_task
-        except Exception as e:
-            logging.error(f"Wave task cleanup error: {e}")
+        await editor.finish(final_text)
+        reply_edits.observe(editor.edits)
 
+    buffer = editor.text
     if buffer:
-        user_histories.setdefault(user_id, [])
-        user_histories[user_id].append({"role": "assistant", "content": buffer})
-        if len(user_histories[user_id]) > HISTORY_LIMIT:
-            user_histories[user_id] = user_histories[user_id][-HISTORY_LIMIT:]
+        await conversation_history.append(user_id, "assistant", buffer)
+        if final_text is None:
+            response_cache.put(cache_key, buffer)
+
+async def run_gpt_batch(user_id: int, items: list):
+    """
+    Execute a batch of queued GPT requests of one user.
+
+    Messages that arrived while the previous reply was being generated are
+    merged into a single user turn and answered with one reply.
+
+    Args:
+        user_id (int): Telegram user ID
+        items (list): (prompt, message, image_url) tuples in arrival order
+    """
+    prompt = "\n\n".join(item[0] for item in items)
+    _, message, image_url = items[-1]
+
+    # --- Добавляем сообщение пользователя в историю ---
+    await conversation_history.append(user_id, "user", prompt)
+
+    try:
+        await query_openrouter_stream(prompt, message, image_url=image_url)
+    except Exception as e:
+        logging.error(f"Ошибка при обращении к ИИ: {e}")
+        await message.answer("Извините, произошла ошибка. Попробуйте позже.", reply_markup=get_user_keyboard())
+
+gpt_scheduler = GptScheduler(run_gpt_batch, **GPT_SCHEDULER_SETTINGS)
 
 # Автоотправка /start при входе пользователя в чат
-@dp.chat_member()
 async def handle_new_chat_members(event: types.ChatMemberUpdated):
     if event.new_chat_member.status == "member":
         try:
@@ -1233,22 +2212,155 @@ async def handle_new_chat_members(event: types.ChatMemberUpdated):
             pass
 
 # Запуск бота
+async def start_services(worker_index: int | None = None):
+    """
+    Open stores and start background services of a bot process.
+
+    Args:
+        worker_index (int, optional): Index of the worker process in worker mode
+    """
+    await storage.start()
+    await user_store.start()
+    await order_store.start()
+    await admin_notifier.start()
+    await http_client.start()
+    await conversation_history.start()
+    if worker_index is None:
+        await broadcast_engine.resume()
+    else:
+        # Рассылку продолжает процесс, который обслуживает запустившего её админа
+        await broadcast_engine.resume(owns_admin=lambda admin_id: worker_of(admin_id) == worker_index)
+    # Выдача и окончание VPN работают в одном процессе: в многопроцессном режиме
+    # в том, что обслуживает админов, чтобы выданные ими подписки сразу попадали в очередь
+    if worker_index is None or worker_index == worker_of(ADMIN_IDS[0]):
+        if worker_index is not None:
+            vpn_expiry.resync_interval = VPN_EXPIRY_RESYNC_INTERVAL
+        # Заявки берёт в обработку только этот процесс, так что незавершённые
+        # остались от его прежнего запуска и их можно вернуть в очередь
+        await order_store.recover()
+        vpn_users.update(await asyncio.to_thread(load_vpn_users, VPN_USERS_FILE))
+        await vpn_pool.start(entry["address"] for entry in vpn_users.values())
+        await sync_vpn_peers()
+        await vpn_expiry.start()
+    register_handlers()  # Register all handlers
+    register_metrics(worker_index)
+    if METRICS_ENABLED:
+        await metrics_server.start()
+
+async def stop_services():
+    await admin_notifier.close()  # отправляет накопленные сводки, пока сессия бота открыта
+    await metrics_server.close()
+    await broadcast_engine.close()
+    await vpn_expiry.close()
+    await vpn_pool.close()
+    await gpt_scheduler.close()
+    await conversation_history.close()
+    await image_pipeline.close()
+    await storage.close()
+    await order_store.close()
+    await http_client.close()
+    await user_store.close()
+
 async def main():
     """
     Main function to start the bot.
     """
     try:
         logging.info("Starting bot...")
-        register_handlers()  # Register all handlers
-        await dp.start_polling(bot)
+        await start_services()
+        if UPDATE_MODE == "webhook":
+            await webhook_server.start(WEBHOOK_URL)
+            await asyncio.Event().wait()  # работаем до остановки процесса
+        else:
+            await bot.delete_webhook()  # иначе Telegram не отдаёт обновления через getUpdates
+            await dp.start_polling(bot)
     except Exception as e:
         logging.error(f"Error in main: {e}")
     finally:
+        if UPDATE_MODE == "webhook":
+            await webhook_server.close()
+        await stop_services()
         logging.info("Bot stopped")
 
+async def run_worker(index: int, queue, processed):
+    """
+    Handle the updates of one shard of users (worker mode).
+
+    Args:
+        index (int): Worker index
+        queue: Queue the supervisor puts updates on
+        processed: Shared counter of processed updates
+    """
+    # Общий лимит Bot API делится между процессами
+    send_limiter.rate = TELEGRAM_SEND_RATE / WORKER_PROCESSES
+    send_limiter.capacity = send_limiter.rate
+    try:
+        logging.info(f"Starting worker {index}...")
+        await start_services(worker_index=index)
+        await worker_loop(bot, dp, queue, processed)
+    except Exception as e:
+        logging.error(f"Error in worker {index}: {e}")
+    finally:
+        await stop_services()
+        await bot.session.close()
+        logging.info(f"Worker {index} stopped")
+
+def worker_main(index: int, queue, processed):
+    """Entry point of a worker process."""
+    try:
+        asyncio.run(run_worker(index, queue, processed))
+    except KeyboardInterrupt:
+        pass
+
+def worker_of(user_id: int) -> int:
+    """Index of the worker process handling a user; all admins share one worker."""
+    if is_admin(user_id):
+        user_id = ADMIN_IDS[0]
+    return shard_of(user_id, WORKER_PROCESSES)
+
+def worker_config_error() -> str | None:
+    """Reason why the configured worker mode can't run, or None if it can."""
+    if WORKER_PROCESSES > 0 and USERS_STORE_BACKEND != "sqlite":
+        return 'Worker mode needs USERS_STORE_BACKEND = "sqlite": other backends are not shared between processes'
+    return None
+
+async def run_supervisor():
+    """
+    Receive updates and distribute them to the worker processes (worker mode).
+    """
+    supervisor = WorkerSupervisor(
+        worker_main, workers=WORKER_PROCESSES, pinned={admin_id: worker_of(admin_id) for admin_id in ADMIN_IDS},
+        **WORKER_SETTINGS
+    )
+    ingest_dp = Dispatcher()
+    ingest_dp.update.outer_middleware(supervisor.middleware)
+    ingest_webhook = WebhookServer(bot, ingest_dp, **WEBHOOK_SETTINGS)
+    try:
+        logging.info(f"Starting supervisor with {WORKER_PROCESSES} workers...")
+        register_handlers()  # only to know which update types to request
+        await supervisor.start()
+        if UPDATE_MODE == "webhook":
+            await ingest_webhook.start(WEBHOOK_URL)
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook()
+            await ingest_dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    except Exception as e:
+        logging.error(f"Error in supervisor: {e}")
+    finally:
+        if UPDATE_MODE == "webhook":
+            await ingest_webhook.close()
+        await supervisor.close()
+        await bot.session.close()
+        logging.info("Supervisor stopped")
+
 if __name__ == '__main__':
+    config_error = worker_config_error()
+    if config_error:
+        logging.critical(config_error)
+        sys.exit(1)
     try:
-        asyncio.run(main())
+        asyncio.run(run_supervisor() if WORKER_PROCESSES > 0 else main())
     except (KeyboardInterrupt, SystemExit):
         logging.info("Bot stopped manually")
     except Exception as e:
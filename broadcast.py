@@ -0,0 +1,331 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from file_utils import atomic_write_json
+from rate_limit import TokenBucket
+
+STOP_CALLBACK = "broadcast_stop"
+
+
+def _load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class BroadcastEngine:
+    """
+    Background broadcast of a text message to many users.
+
+    Recipients are processed by a bounded pool of workers; every send takes
+    a token from the shared TokenBucket so the bot stays under Telegram's
+    global limit. TelegramRetryAfter pauses the whole bucket, network and
+    server errors are retried with backoff, and users who blocked the bot
+    are counted as failed without retries.
+
+    Progress is checkpointed to disk (recipient list once, then the
+    position reached), so a broadcast interrupted by a restart resumes
+    where it stopped. Live progress and throughput are shown in a message
+    to the admin who started it. Only one broadcast runs at a time.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        limiter: TokenBucket,
+        checkpoint_path: str,
+        workers: int = 20,
+        max_retries: int = 3,
+        progress_interval: float = 3.0,
+        checkpoint_interval: float = 2.0,
+    ):
+        """
+        Args:
+            bot (Bot): Bot instance used for sending
+            limiter (TokenBucket): Shared limiter for outgoing messages
+            checkpoint_path (str): Path of the checkpoint file
+            workers (int): Number of concurrent senders
+            max_retries (int): Retries for transient errors per recipient
+            progress_interval (float): Seconds between progress message updates
+            checkpoint_interval (float): Seconds between checkpoint writes
+        """
+        self.bot = bot
+        self.limiter = limiter
+        self.checkpoint_path = checkpoint_path
+        self.recipients_path = f"{checkpoint_path}.recipients"
+        self.workers = workers
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = checkpoint_interval
+        self._job = None
+        self._recipients = []
+        self._done_ahead = set()
+        self._task = None
+        self._cancelled = False
+        self._last_progress_text = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- Public API ---
+    async def start(self, text: str, recipients: list, admin_chat_id: int) -> bool:
+        """
+        Start a new broadcast in the background.
+
+        Returns:
+            bool: False if another broadcast is still running
+        """
+        if self.running:
+            return False
+        self._recipients = [int(uid) for uid in recipients]
+        self._done_ahead = set()
+        self._cancelled = False
+        progress = await self.bot.send_message(
+            admin_chat_id,
+            f"📣 Рассылка запущена: {len(self._recipients)} получателей.",
+            reply_markup=self._stop_keyboard()
+        )
+        self._job = {
+            "text": text,
+            "admin_chat_id": admin_chat_id,
+            "progress_message_id": progress.message_id,
+            "total": len(self._recipients),
+            "position": 0,
+            "done_ahead": [],
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "elapsed": 0.0,
+        }
+        await asyncio.to_thread(atomic_write_json, self.recipients_path, self._recipients)
+        await self._save_checkpoint()
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def resume(self, owns_admin=None) -> bool:
+        """
+        Resume a broadcast left unfinished by a previous run.
+
+        Args:
+            owns_admin (callable, optional): ``owns_admin(admin_chat_id) -> bool``;
+                with several worker processes only the one owning the admin who
+                started the broadcast resumes it
+
+        Returns:
+            bool: True if a broadcast was resumed
+        """
+        if self.running or not os.path.exists(self.checkpoint_path):
+            return False
+        try:
+            job = await asyncio.to_thread(_load_json, self.checkpoint_path)
+            if owns_admin is not None and not owns_admin(job["admin_chat_id"]):
+                return False
+            self._job = job
+            self._recipients = await asyncio.to_thread(_load_json, self.recipients_path)
+        except Exception as e:
+            logging.error(f"Failed to load broadcast checkpoint: {e}")
+            await self._remove_checkpoint()
+            return False
+        self._done_ahead = set(self._job.get("done_ahead", []))
+        self._cancelled = False
+        logging.info(
+            f"Resuming broadcast at {self._job['position']}/{self._job['total']} "
+            f"({self._job['sent']} sent, {self._job['failed']} failed)"
+        )
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def cancel(self):
+        """Stop the running broadcast; it will not be resumed."""
+        self._cancelled = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def close(self):
+        """Stop on shutdown, keeping the checkpoint so the broadcast resumes on next start."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    # --- Checkpoint ---
+    async def _save_checkpoint(self):
+        self._job["done_ahead"] = sorted(self._done_ahead)
+        try:
+            await asyncio.to_thread(atomic_write_json, self.checkpoint_path, dict(self._job))
+        except Exception as e:
+            logging.error(f"Failed to save broadcast checkpoint: {e}")
+
+    async def _remove_checkpoint(self):
+        for path in (self.checkpoint_path, self.recipients_path):
+            try:
+                await asyncio.to_thread(os.remove, path)
+            except FileNotFoundError:
+                pass
+
+    def _mark_done(self, index: int):
+        job = self._job
+        if index != job["position"]:
+            self._done_ahead.add(index)
+            return
+        job["position"] += 1
+        while job["position"] in self._done_ahead:
+            self._done_ahead.discard(job["position"])
+            job["position"] += 1
+
+    # --- Sending ---
+    async def _send(self, chat_id: int) -> bool:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=self._job["text"])
+                return True
+            except TelegramRetryAfter as e:
+                self._job["retries"] += 1
+                self.limiter.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Bot blocked by the user, chat not found, ... — retrying won't help
+                logging.info(f"Broadcast to {chat_id} failed: {e}")
+                return False
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logging.error(f"Broadcast to {chat_id} failed after {attempt} attempts: {e}")
+                    return False
+                self._job["retries"] += 1
+                await asyncio.sleep(min(30, 2 ** attempt))
+            except Exception as e:
+                logging.error(f"Ошибка при отправке сообщения пользователю {chat_id}: {e}")
+                return False
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            index = await queue.get()
+            try:
+                if await self._send(self._recipients[index]):
+                    self._job["sent"] += 1
+                else:
+                    self._job["failed"] += 1
+                self._mark_done(index)
+            finally:
+                queue.task_done()
+
+    async def _producer(self, queue: asyncio.Queue):
+        for index in range(self._job["position"], len(self._recipients)):
+            if index not in self._done_ahead:
+                await queue.put(index)
+
+    async def _reporter(self, started_at: float, elapsed_before: float):
+        last_checkpoint = time.monotonic()
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self._job["elapsed"] = elapsed_before + time.monotonic() - started_at
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                await self._save_checkpoint()
+                last_checkpoint = time.monotonic()
+            await self._update_progress(final=False)
+
+    async def _run(self):
+        queue = asyncio.Queue(maxsize=self.workers * 2)
+        started_at = time.monotonic()
+        elapsed_before = self._job.get("elapsed", 0.0)
+        sent_before = self._job["sent"] + self._job["failed"]
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        reporter = asyncio.create_task(self._reporter(started_at, elapsed_before))
+        try:
+            await self._producer(queue)
+            await queue.join()
+        except asyncio.CancelledError:
+            if not self._cancelled:
+                # Shutdown: keep the checkpoint for resume
+                await self._save_checkpoint()
+                raise
+        finally:
+            for task in workers + [reporter]:
+                task.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+
+        self._job["elapsed"] = elapsed_before + time.monotonic() - started_at
+        processed = self._job["sent"] + self._job["failed"] - sent_before
+        logging.info(
+            f"Broadcast finished: {self._job['sent']} sent, {self._job['failed']} failed, "
+            f"{processed / max(time.monotonic() - started_at, 1e-6):.1f} msg/s"
+        )
+        await self._update_progress(final=True)
+        await self._remove_checkpoint()
+
+    # --- Progress message ---
+    def _stop_keyboard(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⛔ Остановить рассылку", callback_data=STOP_CALLBACK)]
+        ])
+
+    def _progress_text(self, final: bool) -> str:
+        job = self._job
+        processed = job["sent"] + job["failed"]
+        rate = processed / job["elapsed"] if job["elapsed"] else 0.0
+        if final:
+            header = "⛔ Рассылка остановлена." if self._cancelled else "✅ Рассылка завершена!"
+        else:
+            header = "📣 Идёт рассылка..."
+        lines = [
+            header,
+            f"Обработано: {processed}/{job['total']}",
+            f"Отправлено: {job['sent']}, ошибок: {job['failed']}, повторов: {job['retries']}",
+            f"Скорость: {rate:.1f} сообщ./с",
+        ]
+        if not final and rate > 0:
+            lines.append(f"Осталось примерно: {int((job['total'] - processed) / rate)} с")
+        return "\n".join(lines)
+
+    def stats(self) -> dict:
+        job = self._job or {}
+        processed = job.get("sent", 0) + job.get("failed", 0)
+        elapsed = job.get("elapsed", 0.0)
+        return {
+            "running": self.running,
+            "total": job.get("total", 0),
+            "sent": job.get("sent", 0),
+            "failed": job.get("failed", 0),
+            "retries": job.get("retries", 0),
+            "rate": processed / elapsed if elapsed else 0.0,
+        }
+
+    async def _update_progress(self, final: bool):
+        text = self._progress_text(final)
+        if text == self._last_progress_text:
+            return
+        try:
+            await self.limiter.acquire()
+            await self.bot.edit_message_text(
+                chat_id=self._job["admin_chat_id"],
+                message_id=self._job["progress_message_id"],
+                text=text,
+                reply_markup=None if final else self._stop_keyboard()
+            )
+            self._last_progress_text = text
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+        except Exception as e:
+            logging.error(f"Failed to update broadcast progress: {e}")
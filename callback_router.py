@@ -0,0 +1,112 @@
+import logging
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+
+class _Route:
+    __slots__ = ("data_cls", "handler", "state", "name")
+
+    def __init__(self, data_cls: type, handler, state: str | None):
+        self.data_cls = data_cls
+        self.handler = CallableObject(handler)
+        self.state = state
+        self.name = getattr(handler, "__name__", repr(handler))
+
+
+class CallbackRouter:
+    """
+    Routes callback queries by the prefix of their callback data.
+
+    Each route binds an aiogram ``CallbackData`` class to one handler. The
+    router is registered on the dispatcher as the only callback query
+    handler; the prefix (the part before the first separator) is looked up
+    in a dict, so the cost does not depend on the number of routes, and the
+    data is unpacked into the typed class, which the handler receives as
+    ``callback_data``. Handlers get the same keyword arguments as regular
+    aiogram handlers (``state``, ``bot``, ...).
+
+    A class without fields packs to its bare prefix, which keeps plain
+    string callback data like ``"admin_menu"`` routable.
+    """
+
+    def __init__(self, separator: str = ":", unknown_text: str | None = None):
+        """
+        Args:
+            separator (str): Separator used by every routed CallbackData class
+            unknown_text (str, optional): Answer to callbacks no route accepts
+                (e.g. buttons of an old keyboard)
+        """
+        self.separator = separator
+        self.unknown_text = unknown_text
+        self._routes = {}  # prefix -> _Route
+        self._dispatched = 0
+        self._unknown = 0
+        self._invalid = 0
+        self._wrong_state = 0
+
+    def add(self, data_cls: type, handler, state: State | None = None):
+        """
+        Add a route.
+
+        Args:
+            data_cls (type): CallbackData subclass handled by the route
+            handler: ``handler(callback, callback_data, ...)``
+            state (State, optional): Only route when the user is in this FSM state
+
+        Raises:
+            ValueError: If the prefix is already routed or the class uses another separator
+        """
+        if not issubclass(data_cls, CallbackData):
+            raise TypeError(f"{data_cls!r} is not a CallbackData subclass")
+        if data_cls.__separator__ != self.separator:
+            raise ValueError(f"{data_cls.__name__} uses separator {data_cls.__separator__!r}, expected {self.separator!r}")
+        prefix = data_cls.__prefix__
+        if prefix in self._routes:
+            raise ValueError(f"Callback prefix {prefix!r} is already routed to {self._routes[prefix].name}")
+        self._routes[prefix] = _Route(data_cls, handler, state.state if state is not None else None)
+
+    async def dispatch(self, callback: CallbackQuery, **kwargs):
+        """Handle a callback query; register this as the dispatcher's callback handler."""
+        data = callback.data or ""
+        route = self._routes.get(data.partition(self.separator)[0])
+        if route is None:
+            self._unknown += 1
+            await callback.answer(self.unknown_text)
+            return
+        if route.state is not None:
+            if "raw_state" in kwargs:
+                current = kwargs["raw_state"]
+            else:
+                state = kwargs.get("state")
+                current = await state.get_state() if state is not None else None
+            if current != route.state:
+                # A button of a dialog step the user has already left
+                self._wrong_state += 1
+                await callback.answer()
+                return
+        try:
+            callback_data = route.data_cls.unpack(data)
+        except (TypeError, ValueError) as e:
+            self._invalid += 1
+            logging.warning(f"Invalid callback data {data!r}: {e}")
+            await callback.answer(self.unknown_text)
+            return
+        self._dispatched += 1
+        return await route.handler.call(callback, callback_data=callback_data, **kwargs)
+
+    def route_name(self, data: str | None) -> str:
+        """Name of the handler routed for callback data ("unknown" if none), e.g. for metrics."""
+        route = self._routes.get((data or "").partition(self.separator)[0])
+        return route.name if route is not None else "unknown"
+
+    def stats(self) -> dict:
+        return {
+            "routes": len(self._routes),
+            "dispatched": self._dispatched,
+            "unknown": self._unknown,
+            "invalid": self._invalid,
+            "wrong_state": self._wrong_state,
+        }
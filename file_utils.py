@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+
+
+def atomic_write_json(path: str, data, **json_kwargs):
+    """
+    Write JSON to a file atomically (temp file in the same directory + rename).
+
+    Readers see either the old or the new content, never a partially written
+    file. Blocking: call it through asyncio.to_thread from async code.
+
+    Args:
+        path (str): Destination file
+        data: JSON-serializable object
+        **json_kwargs: Extra arguments for json.dump (indent, ensure_ascii, ...)
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, **json_kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_expires_at ON fsm (expires_at);
+"""
+
+
+def _key(key: StorageKey) -> str:
+    return ":".join(
+        str(part) if part is not None else ""
+        for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    )
+
+
+def _state_name(state: StateType) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Durable aiogram FSM storage backed by SQLite.
+
+    States and data survive restarts and are shared by every process that
+    opens the same database file (WAL mode, one connection per process on
+    a single-thread executor). A state that was not touched for
+    ``state_ttl`` seconds is treated as abandoned: it reads as empty and is
+    purged in the background.
+
+    Reads go through an in-process LRU cache whose entries are trusted for
+    ``cache_ttl`` seconds; writes go to the database and the cache. The
+    cache is safe when all updates of a user are handled by the same
+    process (see workers.py); set ``cache_ttl`` to 0 otherwise.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        state_ttl: float = 24 * 3600,
+        cache_ttl: float = 30.0,
+        cache_size: int = 10000,
+        purge_interval: float = 600.0,
+        on_timing=None,
+    ):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            state_ttl (float): Seconds after the last change when a state expires
+            cache_ttl (float): Seconds a cached state is trusted without a database read
+            cache_size (int): Maximum number of cached states
+            purge_interval (float): Seconds between purges of expired states
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every database call, e.g. to feed metrics
+        """
+        self.path = path
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+        self.on_timing = on_timing
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._cache = OrderedDict()  # key -> (state, data, expires_at, cached_until)
+        self._purge_task = None
+        self._hits = 0
+        self._misses = 0
+        self._purged = 0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_timing is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    # --- Lifecycle ---
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    async def start(self):
+        await self._run(self._open)
+        self._purge_task = asyncio.create_task(self._purge_loop())
+        logging.info(f"FSM storage opened: {self.path}")
+
+    async def close(self):
+        # Called by the dispatcher on shutdown and again from main(); must be idempotent
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+            self._executor.shutdown(wait=True)
+
+    # --- Cache ---
+    def _cache_get(self, key: str):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        state, data, expires_at, cached_until = entry
+        now = time.time()
+        if cached_until <= now or expires_at <= now:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return state, data
+
+    def _cache_put(self, key: str, state: str | None, data: dict, expires_at: float):
+        if self.cache_ttl <= 0:
+            return
+        self._cache[key] = (state, data, expires_at, time.time() + self.cache_ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key: str) -> tuple:
+        cached = self._cache_get(key)
+        if cached is not None:
+            self._hits += 1
+            return cached
+        self._misses += 1
+        row = await self._run(self._read, key, time.time())
+        state, data, expires_at = row if row is not None else (None, {}, time.time() + self.state_ttl)
+        self._cache_put(key, state, data, expires_at)
+        return state, data
+
+    # --- Database ---
+    def _read(self, key: str, now: float):
+        row = self._conn.execute(
+            "SELECT state, data, expires_at FROM fsm WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _write_state(self, key: str, state: str | None, expires_at: float):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+                (key, state, expires_at)
+            )
+
+    def _write_data(self, key: str, data: str, expires_at: float):
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO fsm (key, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (key, data, expires_at)
+            )
+
+    def _purge(self, now: float) -> int:
+        with self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM fsm WHERE expires_at <= ? OR (state IS NULL AND data = '{}')", (now,)
+            )
+        return cursor.rowcount
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                purged = await self._run(self._purge, time.time())
+                self._purged += purged
+                if purged:
+                    logging.info(f"FSM storage: purged {purged} expired states")
+            except Exception as e:
+                logging.error(f"Error purging FSM storage: {e}")
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey = _key(key)
+        name = _state_name(state)
+        _, data = await self._load(skey)
+        expires_at = time.time() + self.state_ttl
+        await self._run(self._write_state, skey, name, expires_at)
+        self._cache_put(skey, name, data, expires_at)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._load(_key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, not {type(data).__name__}")
+        skey = _key(key)
+        state, _ = await self._load(skey)
+        data = dict(data)
+        expires_at = time.time() + self.state_ttl
+        await self._run(self._write_data, skey, json.dumps(data, ensure_ascii=False), expires_at)
+        self._cache_put(skey, state, data, expires_at)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._load(_key(key))
+        return dict(data)
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "cached": len(self._cache),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": self._hits / lookups if lookups else 0.0,
+            "purged": self._purged,
+        }
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class GptScheduler:
+    """
+    Fair scheduler for GPT requests.
+
+    Every user has their own FIFO of pending requests and at most one
+    request in flight, so replies and history updates for one user never
+    interleave. Users with pending work wait in a round-robin ring: when a
+    global slot frees up the next user in the ring is served and, if they
+    still have work, goes back to the end of the ring. A user sending many
+    messages therefore cannot starve others.
+
+    Consecutive mergeable requests of the same user that piled up while
+    the previous one was running are handed to the runner as one batch.
+    """
+
+    def __init__(
+        self,
+        runner,
+        max_concurrent: int = 8,
+        max_pending_per_user: int = 3,
+        max_pending_total: int = 200,
+    ):
+        """
+        Args:
+            runner: Coroutine function ``runner(user_id, items)`` executing a batch
+            max_concurrent (int): Global limit of requests in flight
+            max_pending_per_user (int): Queued requests allowed per user
+            max_pending_total (int): Queued requests allowed in total
+        """
+        self.runner = runner
+        self.max_concurrent = max_concurrent
+        self.max_pending_per_user = max_pending_per_user
+        self.max_pending_total = max_pending_total
+        self._queues = {}  # user_id -> deque of (item, mergeable, submitted_at)
+        self._ring = deque()  # users with queued work and nothing in flight
+        self._in_flight = {}  # user_id -> task
+        self._pending = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._merged = 0
+        self._completed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._dispatched = 0
+
+    # --- Public API ---
+    def submit(self, user_id: int, item, mergeable: bool = True) -> bool:
+        """
+        Queue a request of a user.
+
+        Args:
+            user_id (int): Telegram user ID
+            item: Request passed to the runner as part of a batch
+            mergeable (bool): Whether the request may be batched with neighbours
+
+        Returns:
+            bool: False if the queues are full and the request was rejected
+        """
+        queue = self._queues.get(user_id)
+        if (
+            (queue is not None and len(queue) >= self.max_pending_per_user)
+            or self._pending >= self.max_pending_total
+        ):
+            self._rejected += 1
+            return False
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+        queue.append((item, mergeable, time.monotonic()))
+        self._pending += 1
+        self._submitted += 1
+        if user_id not in self._in_flight and len(queue) == 1:
+            self._ring.append(user_id)
+        self._pump()
+        return True
+
+    def pending_for(self, user_id: int) -> int:
+        """Number of requests of a user queued or in flight."""
+        return len(self._queues.get(user_id, ())) + (user_id in self._in_flight)
+
+    async def close(self):
+        """Drop queued requests and cancel the ones in flight."""
+        self._queues.clear()
+        self._ring.clear()
+        self._pending = 0
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._in_flight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._in_flight),
+            "queued": self._pending,
+            "users_waiting": len(self._ring),
+            "submitted": self._submitted,
+            "rejected": self._rejected,
+            "merged": self._merged,
+            "completed": self._completed,
+            "failed": self._failed,
+            "wait_avg": self._wait_total / self._dispatched if self._dispatched else 0.0,
+            "wait_max": self._wait_max,
+        }
+
+    # --- Dispatching ---
+    def _take_batch(self, queue: deque) -> list:
+        now = time.monotonic()
+        batch = []
+        while queue:
+            item, mergeable, submitted_at = queue[0]
+            if batch and not mergeable:
+                break
+            queue.popleft()
+            batch.append(item)
+            wait = now - submitted_at
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            self._dispatched += 1
+            if not mergeable:
+                break
+        self._pending -= len(batch)
+        self._merged += len(batch) - 1
+        return batch
+
+    def _pump(self):
+        while self._ring and len(self._in_flight) < self.max_concurrent:
+            user_id = self._ring.popleft()
+            queue = self._queues[user_id]
+            batch = self._take_batch(queue)
+            if not queue:
+                del self._queues[user_id]
+            self._in_flight[user_id] = asyncio.create_task(self._run(user_id, batch))
+
+    async def _run(self, user_id: int, batch: list):
+        try:
+            await self.runner(user_id, batch)
+            self._completed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failed += 1
+            logging.error(f"GPT request of user {user_id} failed: {e}")
+        finally:
+            if self._in_flight.get(user_id) is asyncio.current_task():
+                del self._in_flight[user_id]
+                if user_id in self._queues:
+                    self._ring.append(user_id)
+                self._pump()
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from collections import deque
+
+
+class _Attempt:
+    """One upstream request of a hedged race; buffers tokens until it wins."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.buffer = []
+        self.sink = None
+        self.first_token = asyncio.Event()
+        self.task = None
+
+    def push(self, content):
+        if not content:
+            return
+        if self.sink is not None:
+            self.sink(content)
+        else:
+            self.buffer.append(content)
+            self.first_token.set()
+
+    def attach(self, sink):
+        """Route buffered and future tokens to the sink."""
+        for content in self.buffer:
+            sink(content)
+        self.buffer.clear()
+        self.sink = sink
+
+
+async def _cancel(attempt: _Attempt):
+    attempt.task.cancel()
+    try:
+        await attempt.task
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logging.error(f"Hedged attempt {attempt.name} failed while cancelling: {e}")
+
+
+async def _wait_first_token(attempts: list, timeout: float | None) -> _Attempt | None:
+    """
+    Wait until one of the attempts produced a token.
+
+    Returns:
+        _Attempt | None: The first attempt with a token; None on timeout or
+            when every attempt finished without producing one
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    waiters = [asyncio.ensure_future(attempt.first_token.wait()) for attempt in attempts]
+    try:
+        while True:
+            for attempt in attempts:
+                if attempt.first_token.is_set():
+                    return attempt
+            running = [attempt.task for attempt in attempts if not attempt.task.done()]
+            if not running:
+                return None
+            remaining = deadline - loop.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return None
+            done, _ = await asyncio.wait(
+                waiters + running, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                return None
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+class HedgePolicy:
+    """
+    Request hedging for streamed GPT replies.
+
+    Keeps a window of recently observed times to first token. When the
+    first token of a request is later than the configured percentile of
+    that window, a second request is fired and whichever produces a token
+    first is streamed; the other one is cancelled, which closes its
+    connection. Hedges are paid from a budget that grows by
+    ``budget_ratio`` per request, capping the extra upstream traffic.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        percentile: float = 0.95,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay: float = 0.5,
+        max_delay: float = 15.0,
+        budget_ratio: float = 0.1,
+        budget_burst: float = 5.0,
+    ):
+        """
+        Args:
+            enabled (bool): Whether hedging is used at all
+            percentile (float): TTFT percentile after which a hedge is fired
+            window (int): Number of recent TTFT samples kept
+            min_samples (int): Samples needed before hedging starts
+            min_delay (float): Lower bound of the hedge delay in seconds
+            max_delay (float): Upper bound of the hedge delay in seconds
+            budget_ratio (float): Hedges allowed per request on average
+            budget_burst (float): Maximum accumulated hedge budget
+        """
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget_ratio = budget_ratio
+        self.budget_burst = budget_burst
+        self._samples = deque(maxlen=window)
+        self._budget = budget_burst
+        self._requests = 0
+        self._fired = 0
+        self._won = 0
+        self._lost = 0
+        self._no_token = 0
+        self._budget_denied = 0
+
+    def observe(self, ttft: float):
+        self._samples.append(ttft)
+
+    def delay(self) -> float | None:
+        """Seconds to wait for the first token before hedging, or None to not hedge."""
+        if not self.enabled or len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def _take_budget(self) -> bool:
+        if self._budget >= 1:
+            self._budget -= 1
+            return True
+        self._budget_denied += 1
+        return False
+
+    async def run(self, start_primary, start_hedge, sink):
+        """
+        Run a request, hedging it if its first token is late.
+
+        Args:
+            start_primary: ``start_primary(push)`` returns the coroutine of the
+                primary request; it reports each token with ``push(content)``
+            start_hedge: ``start_hedge(push)`` returns the coroutine of the hedge
+                request, or None if no hedge can be sent
+            sink: Callable receiving the tokens of the winning request
+
+        Returns:
+            The result of the request whose tokens were streamed
+        """
+        self._requests += 1
+        self._budget = min(self.budget_burst, self._budget + self.budget_ratio)
+        delay = self.delay()
+        primary = _Attempt("primary")
+        if delay is None:
+            primary.attach(sink)
+            return await start_primary(primary.push)
+
+        primary.task = asyncio.create_task(start_primary(primary.push))
+        hedge = None
+        try:
+            winner = await _wait_first_token([primary], delay)
+            if winner is None and not primary.task.done() and self._take_budget():
+                hedge = _Attempt("hedge")
+                coro = start_hedge(hedge.push)
+                if coro is None:
+                    hedge = None
+                else:
+                    hedge.task = asyncio.create_task(coro)
+                    self._fired += 1
+                    winner = await _wait_first_token([primary, hedge], None)
+            raced = winner is not None
+            if winner is None:
+                # Nobody produced a token: report the primary's outcome
+                winner = primary
+            if hedge is not None:
+                loser = primary if winner is hedge else hedge
+                if not raced:
+                    self._no_token += 1
+                elif winner is hedge:
+                    self._won += 1
+                else:
+                    self._lost += 1
+                if not loser.task.done():
+                    await _cancel(loser)
+            winner.attach(sink)
+            return await winner.task
+        except asyncio.CancelledError:
+            for attempt in (primary, hedge):
+                if attempt is not None and not attempt.task.done():
+                    await _cancel(attempt)
+            raise
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "delay": self.delay(),
+            "samples": len(self._samples),
+            "requests": self._requests,
+            "fired": self._fired,
+            "won": self._won,
+            "lost": self._lost,
+            "no_token": self._no_token,
+            "budget_denied": self._budget_denied,
+            "fire_rate": self._fired / self._requests if self._requests else 0.0,
+        }
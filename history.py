@@ -0,0 +1,361 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+# Грубая оценка: ~4 символа на токен плюс служебные токены на сообщение
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(content) -> int:
+    """
+    Estimate the number of tokens of a chat message content.
+
+    Args:
+        content: Message content, a string or a list of content parts
+
+    Returns:
+        int: Estimated token count
+    """
+    if isinstance(content, list):
+        text = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    else:
+        text = content or ""
+    return MESSAGE_OVERHEAD_TOKENS + (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class _Conversation:
+    __slots__ = ("messages", "tokens", "summary", "summary_tokens", "evicted", "generation", "task")
+
+    def __init__(self):
+        self.messages = deque()  # (message, tokens)
+        self.tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.evicted = []
+        self.generation = 0
+        self.task = None
+
+
+class HistoryManager:
+    """
+    Per-user conversation history kept under a token budget.
+
+    Each message is stored with its estimated token count, so the budget
+    check is O(1) per append. When the recent messages plus the summary
+    exceed the budget the oldest turns are evicted; they are folded into a
+    rolling summary by a background task so summarization never delays a
+    reply. Requests are built from the summary and the recent messages.
+
+    Conversations are tiered: at most ``max_resident`` of them are kept in
+    memory in LRU order, colder ones are spilled to the disk store and
+    loaded back on the user's next message. Changed conversations are
+    written to disk in batches by a background flusher, so history
+    survives restarts.
+    """
+
+    def __init__(
+        self,
+        summarizer=None,
+        token_budget: int = 3000,
+        max_messages: int = 50,
+        summary_max_tokens: int = 400,
+        store=None,
+        max_resident: int = 1000,
+        flush_interval: float = 2.0,
+        summary_retries: int = 3,
+        summary_retry_delay: float = 2.0,
+    ):
+        """
+        Args:
+            summarizer: Coroutine function ``summarizer(summary, messages) -> str``;
+                without it evicted turns are simply dropped
+            token_budget (int): Token budget of the history sent with a request
+            max_messages (int): Hard limit of recent messages per user
+            summary_max_tokens (int): Summaries longer than this are cut
+            store (HistoryDiskStore, optional): Disk tier; without it cold
+                conversations are dropped
+            max_resident (int): Conversations kept in memory
+            flush_interval (float): Seconds between coalesced disk writes
+            summary_retries (int): Retries of a failed summarization before the
+                evicted turns are dropped
+            summary_retry_delay (float): Pause before the first retry, doubled
+                for every next one
+        """
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.summary_max_tokens = summary_max_tokens
+        self.store = store
+        self.max_resident = max_resident
+        self.flush_interval = flush_interval
+        self.summary_retries = summary_retries
+        self.summary_retry_delay = summary_retry_delay
+        self._conversations = OrderedDict()  # LRU: least recently used first
+        self._dirty = set()  # resident conversations changed since the last flush
+        self._pending_writes = {}  # spilled or cleared: user_id -> snapshot or None
+        self._flushing = []  # per flush in progress: users cleared while it is written
+        self._flush_event = asyncio.Event()
+        self._flush_task = None
+        self._summaries_made = 0
+        self._summary_errors = 0
+        self._summary_dropped = 0
+        self._evicted_messages = 0
+        self._spilled = 0
+        self._disk_loads = 0
+        self._disk_misses = 0
+
+    # --- Lifecycle ---
+    async def start(self):
+        if self.store is not None:
+            await self.store.start()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop background tasks and write every conversation to disk."""
+        tasks = [conv.task for conv in self._conversations.values() if conv.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self.store is not None:
+            self._dirty.update(self._conversations)
+            await self.flush()
+            await self.store.close()
+
+    # --- Public API ---
+    async def append(self, user_id: int, role: str, content: str):
+        """Add a message and evict the oldest ones that no longer fit the budget."""
+        conv = await self._get(user_id)
+        tokens = estimate_tokens(content)
+        conv.messages.append(({"role": role, "content": content}, tokens))
+        conv.tokens += tokens
+        self._evict(user_id, conv)
+        self._mark_dirty(user_id)
+
+    async def build_messages(self, user_id: int) -> list:
+        """
+        Build the message list for a request.
+
+        Returns:
+            list: Copies of the messages, preceded by the summary if there is one
+        """
+        conv = await self._get(user_id)
+        messages = []
+        if conv.summary:
+            messages.append({
+                "role": "system",
+                "content": f"Краткое содержание предыдущей части диалога: {conv.summary}",
+            })
+        messages.extend(dict(message) for message, _ in conv.messages)
+        return messages
+
+    async def clear(self, user_id: int):
+        """Forget the history and summary of a user in memory and on disk."""
+        conv = self._conversations.pop(user_id, None)
+        if conv is not None:
+            conv.generation += 1
+            if conv.task is not None:
+                conv.task.cancel()
+        self._dirty.discard(user_id)
+        self._pending_writes.pop(user_id, None)
+        for cleared in self._flushing:
+            cleared.add(user_id)
+        if self.store is not None:
+            await self.store.delete(user_id)
+
+    async def flush(self):
+        """Write changed and spilled conversations to disk."""
+        if self.store is None:
+            return
+        self._flush_event.clear()
+        snapshots, self._pending_writes = self._pending_writes, {}
+        for user_id in self._dirty:
+            conv = self._conversations.get(user_id)
+            if conv is not None:
+                snapshots[user_id] = self._snapshot(conv)
+        self._dirty = set()
+        cleared = set()
+        self._flushing.append(cleared)
+        try:
+            await self.store.save_many(snapshots)
+        except Exception as e:
+            logging.error(f"Error saving conversation history: {e}")
+            # Keep the data for the next attempt unless it was changed again
+            # or cleared meanwhile (a cleared snapshot must not be written back)
+            for user_id, snapshot in snapshots.items():
+                if user_id in self._conversations:
+                    self._dirty.add(user_id)
+                elif user_id not in cleared:
+                    self._pending_writes.setdefault(user_id, snapshot)
+            self._flush_event.set()
+        finally:
+            self._flushing.remove(cleared)
+
+    def stats(self) -> dict:
+        convs = self._conversations.values()
+        return {
+            "users": len(self._conversations),
+            "max_resident": self.max_resident,
+            "spilled": self._spilled,
+            "disk_loads": self._disk_loads,
+            "disk_misses": self._disk_misses,
+            "pending_writes": len(self._pending_writes) + len(self._dirty),
+            "messages": sum(len(conv.messages) for conv in convs),
+            "tokens": sum(conv.tokens + conv.summary_tokens for conv in convs),
+            "evicted_messages": self._evicted_messages,
+            "summaries_made": self._summaries_made,
+            "summary_errors": self._summary_errors,
+            "summary_dropped": self._summary_dropped,
+            "summarizing": sum(1 for conv in convs if conv.task is not None and not conv.task.done()),
+        }
+
+    # --- Tiers ---
+    async def _get(self, user_id: int) -> _Conversation:
+        """Return the resident conversation of a user, loading it from disk if needed."""
+        conv = self._conversations.get(user_id)
+        if conv is not None:
+            self._conversations.move_to_end(user_id)
+            return conv
+        if user_id in self._pending_writes:
+            # Spilled but not written yet
+            snapshot = self._pending_writes.pop(user_id)
+            if snapshot is not None:
+                self._dirty.add(user_id)
+        elif self.store is not None:
+            try:
+                snapshot = await self.store.load(user_id)
+            except Exception as e:
+                logging.error(f"Error loading conversation history of user {user_id}: {e}")
+                snapshot = None
+            if snapshot is not None:
+                self._disk_loads += 1
+            else:
+                self._disk_misses += 1
+            # Someone else may have loaded it while we were waiting
+            conv = self._conversations.get(user_id)
+            if conv is not None:
+                self._conversations.move_to_end(user_id)
+                return conv
+        else:
+            snapshot = None
+        conv = self._restore(snapshot) if snapshot is not None else _Conversation()
+        self._conversations[user_id] = conv
+        self._spill_cold()
+        return conv
+
+    def _snapshot(self, conv: _Conversation) -> dict:
+        # Turns still waiting for summarization are kept as messages,
+        # so nothing is lost if the process stops before the summary is ready
+        return {
+            "summary": conv.summary,
+            "messages": list(conv.evicted) + [message for message, _ in conv.messages],
+        }
+
+    def _restore(self, snapshot: dict) -> _Conversation:
+        conv = _Conversation()
+        conv.summary = snapshot.get("summary") or ""
+        conv.summary_tokens = estimate_tokens(conv.summary) if conv.summary else 0
+        for message in snapshot.get("messages", []):
+            tokens = estimate_tokens(message.get("content"))
+            conv.messages.append((message, tokens))
+            conv.tokens += tokens
+        return conv
+
+    def _spill_cold(self):
+        # Conversations being summarized stay resident until the summary is
+        # in, so the cap may be exceeded by the number of running summaries
+        for _ in range(len(self._conversations)):
+            if len(self._conversations) <= self.max_resident:
+                return
+            user_id, conv = next(iter(self._conversations.items()))
+            if conv.task is not None and not conv.task.done():
+                self._conversations.move_to_end(user_id)
+                continue
+            del self._conversations[user_id]
+            self._dirty.discard(user_id)
+            self._spilled += 1
+            if self.store is not None:
+                self._pending_writes[user_id] = self._snapshot(conv)
+                self._flush_event.set()
+
+    def _mark_dirty(self, user_id: int):
+        if self.store is not None:
+            self._dirty.add(user_id)
+            self._flush_event.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._flush_event.wait()
+            # Give other changes a chance to pile up into the same write
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # --- Eviction and summarization ---
+    def _trim(self, conv: _Conversation):
+        # The newest message is always kept, even if it alone exceeds the budget
+        while len(conv.messages) > 1 and (
+            conv.tokens + conv.summary_tokens > self.token_budget
+            or len(conv.messages) > self.max_messages
+        ):
+            message, tokens = conv.messages.popleft()
+            conv.tokens -= tokens
+            conv.evicted.append(message)
+            self._evicted_messages += 1
+
+    def _evict(self, user_id: int, conv: _Conversation):
+        self._trim(conv)
+        if not conv.evicted:
+            return
+        if self.summarizer is None:
+            conv.evicted.clear()
+        elif conv.task is None or conv.task.done():
+            conv.task = asyncio.create_task(self._summarize(user_id, conv))
+
+    async def _summarize(self, user_id: int, conv: _Conversation):
+        failures = 0
+        while conv.evicted:
+            # The batch stays in conv.evicted until it is folded into the
+            # summary, so snapshots and retries still have it
+            batch = list(conv.evicted)
+            generation = conv.generation
+            try:
+                summary = await self.summarizer(conv.summary, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._summary_errors += 1
+                failures += 1
+                if failures <= self.summary_retries:
+                    logging.error(f"History summarization for user {user_id} failed (attempt {failures}): {e}")
+                    await asyncio.sleep(self.summary_retry_delay * 2 ** (failures - 1))
+                    continue
+                logging.error(
+                    f"History summarization for user {user_id} failed {failures} times, "
+                    f"dropping {len(batch)} old messages: {e}"
+                )
+                del conv.evicted[:len(batch)]
+                self._summary_dropped += len(batch)
+                failures = 0
+                self._mark_dirty(user_id)
+                continue
+            if generation != conv.generation:
+                return
+            failures = 0
+            del conv.evicted[:len(batch)]
+            summary = (summary or "").strip()
+            max_chars = self.summary_max_tokens * CHARS_PER_TOKEN
+            if len(summary) > max_chars:
+                summary = summary[:max_chars]
+            conv.summary = summary
+            conv.summary_tokens = estimate_tokens(summary) if summary else 0
+            self._summaries_made += 1
+            # A longer summary leaves less room for recent messages
+            self._trim(conv)
+            self._mark_dirty(user_id)
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    user_id INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL DEFAULT '',
+    messages TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class HistoryDiskStore:
+    """
+    On-disk tier of the conversation history, backed by SQLite.
+
+    Holds conversations that were evicted from memory or written out by
+    the periodic flush, one row per user. Like SQLiteUserStore, the
+    connection lives on a single-thread executor so queries never block
+    the event loop.
+    """
+
+    def __init__(self, path: str, on_timing=None):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every database call, e.g. to feed metrics
+        """
+        self.path = path
+        self.on_timing = on_timing
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-sqlite")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_timing is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    # --- Lifecycle ---
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    async def start(self):
+        await self._run(self._open)
+        logging.info(f"History store opened: {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    # --- Queries ---
+    def _load(self, user_id: int):
+        row = self._conn.execute(
+            "SELECT summary, messages FROM conversations WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"summary": row[0], "messages": json.loads(row[1])}
+
+    async def load(self, user_id: int) -> dict | None:
+        """Return {"summary", "messages"} of a stored conversation or None."""
+        return await self._run(self._load, int(user_id))
+
+    def _save_many(self, snapshots: dict):
+        now = time.time()
+        with self._conn:
+            for user_id, snapshot in snapshots.items():
+                if snapshot is None:
+                    self._conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO conversations (user_id, summary, messages, updated_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (user_id, snapshot["summary"], json.dumps(snapshot["messages"], ensure_ascii=False), now)
+                    )
+
+    async def save_many(self, snapshots: dict):
+        """
+        Write several conversations in one transaction.
+
+        Args:
+            snapshots (dict): user_id -> {"summary", "messages"}, or None to delete
+        """
+        if snapshots:
+            await self._run(self._save_many, snapshots)
+
+    def _delete(self, user_id: int):
+        with self._conn:
+            self._conn.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+
+    async def delete(self, user_id: int):
+        await self._run(self._delete, int(user_id))
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    async def count(self) -> int:
+        return await self._run(self._count)
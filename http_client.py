@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+
+class HttpClient:
+    """
+    Process-wide pooled HTTP client for upstream APIs (OpenRouter).
+
+    One aiohttp session with a tuned TCPConnector is created on start() and
+    reused by every request, so replies don't pay for a new DNS lookup and
+    TCP+TLS handshake each time. Connection pool activity is tracked through
+    aiohttp tracing and reported by stats().
+    """
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 60,
+        dns_cache_ttl: int = 300,
+        connect_timeout: float = 5,
+        first_byte_timeout: float = 30,
+        read_timeout: float = 30,
+        total_timeout: float = 180,
+    ):
+        """
+        Args:
+            limit (int): Total number of simultaneous connections
+            limit_per_host (int): Simultaneous connections to one host
+            keepalive_timeout (float): Idle time before a pooled connection is closed
+            dns_cache_ttl (int): Seconds to cache resolved host names
+            connect_timeout (float): Timeout for establishing a TCP/TLS connection
+            first_byte_timeout (float): Timeout until response headers are received
+            read_timeout (float): Maximum pause between two chunks of the body
+            total_timeout (float): Upper bound for the whole request including streaming
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.first_byte_timeout = first_byte_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self._session = None
+        self._connector = None
+        self._counters = {
+            "requests": 0,
+            "request_errors": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+            "waiting": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+        }
+
+    # --- Lifecycle ---
+    async def start(self):
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=self.timeout,
+            trace_configs=[self._trace_config()],
+        )
+        logging.info(f"HTTP client started: limit={self.limit}, limit_per_host={self.limit_per_host}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._connector = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            raise RuntimeError("HttpClient is not started")
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        """
+        Send a request through the shared session.
+
+        Waiting for the response headers is bounded by first_byte_timeout
+        (raises asyncio.TimeoutError); the body is then read under the
+        session's read and total timeouts.
+        """
+        response = await asyncio.wait_for(
+            self.session.request(method, url, **kwargs),
+            timeout=self.first_byte_timeout
+        )
+        try:
+            yield response
+        finally:
+            response.release()
+
+    # --- Pool statistics ---
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        counters = self._counters
+        loop_time = asyncio.get_running_loop().time
+
+        async def on_request_start(session, ctx, params):
+            counters["requests"] += 1
+
+        async def on_request_exception(session, ctx, params):
+            counters["request_errors"] += 1
+
+        async def on_queued_start(session, ctx, params):
+            counters["waiting"] += 1
+            ctx.queued_at = loop_time()
+
+        async def on_queued_end(session, ctx, params):
+            counters["waiting"] -= 1
+            waited = loop_time() - ctx.queued_at
+            counters["wait_time_total"] += waited
+            counters["wait_time_max"] = max(counters["wait_time_max"], waited)
+
+        async def on_create_end(session, ctx, params):
+            counters["connections_created"] += 1
+
+        async def on_reuse(session, ctx, params):
+            counters["connections_reused"] += 1
+
+        trace = aiohttp.TraceConfig()
+        trace.on_request_start.append(on_request_start)
+        trace.on_request_exception.append(on_request_exception)
+        trace.on_connection_queued_start.append(on_queued_start)
+        trace.on_connection_queued_end.append(on_queued_end)
+        trace.on_connection_create_end.append(on_create_end)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def stats(self) -> dict:
+        """
+        Return connection pool statistics.
+
+        acquired/idle/open describe the pool right now; the rest are
+        counters since start. wait_time_* is the time requests spent queued
+        for a free connection because the pool limits were reached.
+        """
+        acquired = idle = 0
+        if self._connector is not None:
+            # aiohttp has no public API for pool occupancy
+            acquired = len(getattr(self._connector, "_acquired", ()))
+            idle = sum(len(conns) for conns in getattr(self._connector, "_conns", {}).values())
+        return {
+            "open": acquired + idle,
+            "acquired": acquired,
+            "idle": idle,
+            **self._counters,
+        }
@@ -0,0 +1,164 @@
+import asyncio
+import base64
+import io
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional: without it photos are sent as downloaded
+    Image = None
+
+
+def _encode(data: bytes, max_side: int, quality: int) -> bytes:
+    """Downscale an image so its longer side is at most max_side and re-encode it as JPEG."""
+    if Image is None:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side))
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+    encoded = out.getvalue()
+    return encoded if len(encoded) < len(data) else data
+
+
+class ImagePipeline:
+    """
+    Prepares Telegram photos for the vision model.
+
+    Picks the smallest photo size that still meets ``max_side``, downloads
+    it through the bot's own session, downscales and re-encodes it on a
+    thread pool and returns it as a base64 data URL, so the model never
+    fetches from api.telegram.org (and never sees the bot token). Prepared
+    payloads are cached by ``file_unique_id``: the same picture forwarded by
+    many users is downloaded and encoded once. Concurrent requests for the
+    same picture share one preparation.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        max_side: int = 1024,
+        jpeg_quality: int = 85,
+        cache_entries: int = 256,
+        cache_bytes: int = 32 * 1024 * 1024,
+        workers: int = 2,
+    ):
+        """
+        Args:
+            bot (Bot): Bot instance used for downloads
+            max_side (int): Target size of the longer image side in pixels
+            jpeg_quality (int): JPEG quality of re-encoded images
+            cache_entries (int): Maximum number of cached payloads
+            cache_bytes (int): Maximum total size of cached payloads
+            workers (int): Threads used for re-encoding
+        """
+        self.bot = bot
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="images")
+        self._cache = OrderedDict()  # file_unique_id -> data URL; least recently used first
+        self._cached_bytes = 0
+        self._in_progress = {}  # file_unique_id -> Future
+        self._hits = 0
+        self._misses = 0
+        self._bytes_downloaded = 0
+        self._bytes_encoded = 0
+        self._prepare_time = 0.0
+
+    def pick_size(self, photos: list):
+        """Return the smallest PhotoSize whose longer side reaches max_side, or the largest one."""
+        by_area = sorted(photos, key=lambda p: p.width * p.height)
+        for photo in by_area:
+            if max(photo.width, photo.height) >= self.max_side:
+                return photo
+        return by_area[-1]
+
+    async def prepare(self, photos: list) -> str:
+        """
+        Return a data URL for a photo message.
+
+        Args:
+            photos (list): ``message.photo`` — the available PhotoSize objects
+
+        Returns:
+            str: ``data:image/jpeg;base64,...`` payload
+        """
+        photo = self.pick_size(photos)
+        key = photo.file_unique_id
+        url = self._cache.get(key)
+        if url is not None:
+            self._cache.move_to_end(key)
+            self._hits += 1
+            return url
+        future = self._in_progress.get(key)
+        if future is not None:
+            self._hits += 1
+            return await asyncio.shield(future)
+
+        self._misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_progress[key] = future
+        try:
+            url = await self._prepare(photo)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting on it; don't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(url)
+            self._store(key, url)
+            return url
+        finally:
+            del self._in_progress[key]
+
+    async def _prepare(self, photo) -> str:
+        started = time.perf_counter()
+        buffer = await self.bot.download(photo, destination=io.BytesIO())
+        data = buffer.getvalue()
+        self._bytes_downloaded += len(data)
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(self._executor, _encode, data, self.max_side, self.jpeg_quality)
+        self._bytes_encoded += len(encoded)
+        self._prepare_time += time.perf_counter() - started
+        logging.info(
+            f"Prepared image {photo.file_unique_id}: {photo.width}x{photo.height}, "
+            f"{len(data)} -> {len(encoded)} bytes"
+        )
+        return "data:image/jpeg;base64," + base64.b64encode(encoded).decode("ascii")
+
+    def _store(self, key: str, url: str):
+        if len(url) > self.cache_bytes:
+            return
+        self._cache[key] = url
+        self._cached_bytes += len(url)
+        while len(self._cache) > self.cache_entries or self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._cache),
+            "cached_bytes": self._cached_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "bytes_downloaded": self._bytes_downloaded,
+            "bytes_encoded": self._bytes_encoded,
+            "prepare_avg": self._prepare_time / self._misses if self._misses else 0.0,
+            "pillow": Image is not None,
+        }
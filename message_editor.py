@@ -0,0 +1,220 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+MAX_MESSAGE_LENGTH = 4096
+TYPING_FRAMES = [".", "..", "...", ".."]
+CURSOR = "..."
+
+
+class StreamingMessageEditor:
+    """
+    Single owner of a Telegram message that shows a streamed GPT reply.
+
+    Callers only append text; the editor keeps the latest desired content
+    and decides when to edit the message. Until the first fragment arrives
+    it plays the typing animation, the first content edit goes out as soon
+    as possible, and later edits are spaced by an interval that adapts to
+    the observed edit latency and backs off on RetryAfter. The last sent
+    text is tracked, so identical edits are never sent. finish() always
+    ends with one final edit of the complete text.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        message_id: int,
+        animation_interval: float = 0.6,
+        first_edit_gap: float = 0.3,
+        min_interval: float = 1.0,
+        max_interval: float = 8.0,
+        latency_factor: float = 3.0,
+        initial_text: str = ".",
+    ):
+        """
+        Args:
+            bot (Bot): Bot instance used for edits
+            chat_id (int): Chat of the message
+            message_id (int): Message to edit
+            animation_interval (float): Delay between typing animation frames
+            first_edit_gap (float): Minimal gap between the last animation frame and the first content edit
+            min_interval (float): Minimal delay between content edits
+            max_interval (float): Upper bound for the adaptive delay
+            latency_factor (float): Content edits are spaced at least this many edit latencies apart
+            initial_text (str): Text the message currently has
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.animation_interval = animation_interval
+        self.first_edit_gap = first_edit_gap
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.latency_factor = latency_factor
+
+        self._fragments = []
+        self._joined = ""
+        self._joined_count = 0
+        self._sent_text = initial_text
+        self._frame = 1 if initial_text == TYPING_FRAMES[0] else 0
+        self._interval = min_interval
+        self._last_edit_at = 0.0
+        self._next_edit_at = 0.0
+        self._changed = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+        self.edits = 0
+        self.retry_after_count = 0
+        self.failed_edits = 0
+
+    # --- Public API ---
+    def start(self):
+        """Start the background edit loop (typing animation first)."""
+        loop = asyncio.get_running_loop()
+        self._last_edit_at = loop.time()
+        self._next_edit_at = self._last_edit_at + self.animation_interval
+        self._task = asyncio.create_task(self._run())
+
+    def append(self, fragment: str):
+        """Add a fragment of the streamed reply."""
+        if not fragment:
+            return
+        if not self._fragments:
+            # Early first flush: don't wait for the next animation frame
+            loop = asyncio.get_running_loop()
+            self._next_edit_at = max(loop.time(), self._last_edit_at + self.first_edit_gap)
+        self._fragments.append(fragment)
+        self._changed.set()
+
+    @property
+    def text(self) -> str:
+        """Text received so far."""
+        if self._joined_count != len(self._fragments):
+            self._joined = "".join(self._fragments)
+            self._joined_count = len(self._fragments)
+        return self._joined
+
+    async def finish(self, final_text: str | None = None):
+        """
+        Stop the edit loop and make the final edit.
+
+        Args:
+            final_text (str, optional): Text to show instead of the streamed reply
+                (e.g. an error message). Defaults to the text received so far.
+        """
+        self._closing = True
+        self._changed.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception as e:
+                logging.error(f"Message editor loop error: {e}")
+            self._task = None
+
+        text = final_text if final_text is not None else self.text
+        if not text.strip():
+            return
+        first, rest = text[:MAX_MESSAGE_LENGTH], text[MAX_MESSAGE_LENGTH:]
+        await self._edit_final(first)
+        while rest:
+            part, rest = rest[:MAX_MESSAGE_LENGTH], rest[MAX_MESSAGE_LENGTH:]
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=part)
+            except Exception as e:
+                logging.error(f"Failed to send continuation of a long reply: {e}")
+
+    # --- Edit loop ---
+    def _render(self) -> str | None:
+        """Text the message should show now, or None if nothing changed."""
+        if not self._fragments:
+            text = TYPING_FRAMES[self._frame]
+            self._frame = (self._frame + 1) % len(TYPING_FRAMES)
+            return text
+        text = self.text
+        if len(text) + len(CURSOR) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - len(CURSOR)]
+        text += CURSOR
+        return text if not self._same(text) else None
+
+    def _same(self, text: str) -> bool:
+        # Telegram ignores leading/trailing whitespace when comparing texts
+        return text.strip() == self._sent_text.strip()
+
+    async def _wait(self, timeout: float | None):
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while not self._closing:
+            delay = self._next_edit_at - loop.time()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+            text = self._render()
+            if text is None:
+                await self._wait(None)
+                continue
+            await self._edit(text, animation=not self._fragments)
+
+    async def _edit(self, text: str, animation: bool):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+        except TelegramRetryAfter as e:
+            self.retry_after_count += 1
+            self._interval = min(self.max_interval, self._interval * 2)
+            self._next_edit_at = loop.time() + max(e.retry_after, self._interval)
+            logging.warning(f"Edit flood control in chat {self.chat_id}: retry after {e.retry_after}s")
+            return
+        except TelegramBadRequest as e:
+            self.failed_edits += 1
+            self._next_edit_at = loop.time() + self._interval
+            logging.error(f"Message update error: {e}")
+            return
+        except Exception as e:
+            self.failed_edits += 1
+            self._next_edit_at = loop.time() + self._interval
+            logging.error(f"Message update error: {e}")
+            return
+
+        finished = loop.time()
+        self.edits += 1
+        self._sent_text = text
+        self._last_edit_at = finished
+        if animation:
+            self._next_edit_at = finished + self.animation_interval
+            return
+        # Move towards the smallest interval the chat sustains, but keep at
+        # least latency_factor edit round trips between content edits.
+        latency = finished - started
+        self._interval = min(
+            self.max_interval,
+            max(self.min_interval, self._interval * 0.8, latency * self.latency_factor)
+        )
+        self._next_edit_at = finished + self._interval
+
+    async def _edit_final(self, text: str, attempts: int = 3):
+        if self._same(text):
+            return
+        for _ in range(attempts):
+            try:
+                await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+                self.edits += 1
+                self._sent_text = text
+                return
+            except TelegramRetryAfter as e:
+                self.retry_after_count += 1
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                self.failed_edits += 1
+                logging.error(f"Final message update error: {e}")
+                return
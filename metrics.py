@@ -0,0 +1,269 @@
+import logging
+import time
+from bisect import bisect_left
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiohttp import web
+
+# Seconds; covers fast handlers and Bot API calls as well as long GPT streams
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # label values -> total
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self) -> list:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets.
+
+    observe() is a bisect and two additions; buckets are accumulated only
+    when the metrics are rendered.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [per-bucket counts (last one is +Inf), sum]
+
+    def observe(self, value: float, *labelvalues):
+        series = self._series.get(labelvalues)
+        if series is None:
+            series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self) -> list:
+        lines = []
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class _StatsGauges:
+    """Numeric fields of a component's stats() dict, read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, prefix: str, stats, documentation: str):
+        self.prefix = prefix
+        self.stats = stats
+        self.documentation = documentation
+
+    def collect_families(self) -> list:
+        try:
+            stats = self.stats()
+        except Exception as e:
+            logging.error(f"Failed to collect {self.prefix} stats: {e}")
+            return []
+        families = []
+        for key, value in stats.items():
+            if isinstance(value, (int, float)):
+                name = f"{self.prefix}_{key}"
+                value = int(value) if isinstance(value, bool) else value
+                families.append((name, f"{self.documentation}: {key}", [f"{name} {_format_value(value)}"]))
+        return families
+
+
+class MetricsRegistry:
+    """
+    In-process metrics in the Prometheus text format.
+
+    Counters and histograms are updated on the hot path without locks
+    (everything runs on the event loop) and without allocations once a
+    label combination has been seen. Components that already keep their
+    own numbers expose them through stats(); register_stats() publishes
+    those as gauges that are read only when /metrics is scraped.
+    """
+
+    def __init__(self, namespace: str = "bot"):
+        """
+        Args:
+            namespace (str): Prefix of every metric name
+        """
+        self.namespace = namespace
+        self._metrics = []
+        self._stats = []
+
+    def _name(self, name: str) -> str:
+        return f"{self.namespace}_{name}" if self.namespace else name
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        metric = Counter(self._name(name), documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(self._name(name), documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, name: str, stats, documentation: str | None = None):
+        """
+        Publish the numeric fields of ``stats()`` as gauges ``<namespace>_<name>_<field>``.
+
+        Args:
+            name (str): Component name used in the metric names
+            stats: Callable returning a dict
+            documentation (str, optional): HELP text prefix
+        """
+        self._stats.append(_StatsGauges(self._name(name), stats, documentation or f"{name} stats"))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            samples = metric.collect()
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        for gauges in self._stats:
+            for name, documentation, samples in gauges.collect_families():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner aiogram middleware timing every handler call and counting its exceptions.
+
+    Register it on the observers to measure (``dp.message.middleware(...)``);
+    it only runs for events a handler was found for.
+    """
+
+    def __init__(self, registry: MetricsRegistry, label=None):
+        """
+        Args:
+            registry (MetricsRegistry): Registry receiving the metrics
+            label: Optional ``label(event, data) -> str`` naming the handler;
+                defaults to the name of the handler function
+        """
+        self.label = label
+        self.latency = registry.histogram("handler_seconds", "Handler latency", ("handler",))
+        self.errors = registry.counter("handler_errors_total", "Exceptions raised by handlers", ("handler", "error"))
+
+    async def __call__(self, handler, event, data):
+        if self.label is not None:
+            name = self.label(event, data)
+        else:
+            name = getattr(data["handler"].callback, "__name__", "unknown")
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started, name)
+
+
+class MeteredSession(AiohttpSession):
+    """aiogram session that times every Bot API call and counts the results per method."""
+
+    def __init__(self, registry: MetricsRegistry, **kwargs):
+        """
+        Args:
+            registry (MetricsRegistry): Registry receiving the metrics
+            **kwargs: Passed to AiohttpSession
+        """
+        super().__init__(**kwargs)
+        self.latency = registry.histogram("telegram_api_seconds", "Bot API call latency", ("method",))
+        self.calls = registry.counter("telegram_api_calls_total", "Bot API calls by result", ("method", "result"))
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            result = await super().make_request(bot, method, timeout=timeout)
+        except Exception as e:
+            self.calls.inc(name, type(e).__name__)
+            raise
+        else:
+            self.calls.inc(name, "ok")
+            return result
+        finally:
+            self.latency.observe(time.perf_counter() - started, name)
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` of a registry on a local port."""
+
+    def __init__(self, registry: MetricsRegistry, host: str = "127.0.0.1", port: int = 9100, path: str = "/metrics"):
+        """
+        Args:
+            registry (MetricsRegistry): Registry to expose
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            path (str): URL path of the endpoint
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Metrics available at http://{self.host}:{self.port}{self.path}")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,181 @@
+import logging
+import time
+
+
+class _ModelState:
+    __slots__ = (
+        "name", "vision", "order", "ewma_ttft", "error_rate", "failures", "trips",
+        "open_until", "probing", "requests", "errors", "last_error",
+    )
+
+    def __init__(self, name: str, vision: bool, order: int):
+        self.name = name
+        self.vision = vision
+        self.order = order
+        self.ewma_ttft = None
+        self.error_rate = 0.0
+        self.failures = 0  # consecutive breaker-relevant failures
+        self.trips = 0  # consecutive times the breaker opened
+        self.open_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+        self.last_error = None
+
+
+class ModelRouter:
+    """
+    Routes GPT requests to the healthiest capable model of a pool.
+
+    Every model keeps an EWMA of its time to first token and of its error
+    rate. A request goes to the capable model (vision models for images)
+    with the lowest expected latency, errors making a model look slower;
+    the pool order breaks ties, so the first model is used until it
+    misbehaves. Repeated 429/5xx/timeouts open a circuit breaker: the
+    model is skipped for a while (doubling on every trip), then a single
+    probe request decides whether it is closed again.
+    """
+
+    def __init__(
+        self,
+        models: list,
+        ewma_alpha: float = 0.2,
+        error_penalty: float = 4.0,
+        default_ttft: float = 3.0,
+        failure_threshold: int = 3,
+        open_seconds: float = 30.0,
+        max_open_seconds: float = 600.0,
+        max_attempts: int = 2,
+    ):
+        """
+        Args:
+            models (list): Ordered pool, dicts with "name" and "vision" (bool)
+            ewma_alpha (float): Weight of the newest sample in the averages
+            error_penalty (float): How much the error rate inflates the latency score
+            default_ttft (float): Assumed time to first token of an unmeasured model
+            failure_threshold (int): Consecutive failures that open the breaker
+            open_seconds (float): Breaker open time after the first trip
+            max_open_seconds (float): Upper bound of the breaker open time
+            max_attempts (int): Models tried per request before giving up
+        """
+        self.ewma_alpha = ewma_alpha
+        self.error_penalty = error_penalty
+        self.default_ttft = default_ttft
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.max_attempts = max_attempts
+        self._models = {
+            config["name"]: _ModelState(config["name"], bool(config.get("vision", False)), i)
+            for i, config in enumerate(models)
+        }
+
+    # --- Routing ---
+    def _score(self, state: _ModelState) -> float:
+        ttft = state.ewma_ttft if state.ewma_ttft is not None else self.default_ttft
+        return ttft * (1 + self.error_penalty * state.error_rate)
+
+    def choose(self, vision: bool = False, exclude=()) -> str | None:
+        """
+        Pick a model for a request.
+
+        Args:
+            vision (bool): Whether the request contains an image
+            exclude: Models already tried for this request
+
+        Returns:
+            str | None: Model name, or None if every capable model is excluded
+                or has its breaker open
+        """
+        now = time.monotonic()
+        available = [
+            state for state in self._models.values()
+            if state.name not in exclude and (state.vision or not vision) and state.open_until <= now
+        ]
+        if not available:
+            # Fail fast instead of waiting for a timeout from a broken model
+            return None
+        state = min(available, key=lambda s: (self._score(s), s.order))
+        if state.open_until and state.open_until <= now:
+            # Half-open: let this single request probe the model. Until it
+            # reports back the model stays blocked; if it never does, the
+            # lease expires and another request probes.
+            state.probing = True
+            state.open_until = now + self.open_seconds
+        state.requests += 1
+        return state.name
+
+    # --- Feedback ---
+    def record_success(self, name: str, ttft: float | None = None):
+        """
+        Register a successful request.
+
+        Args:
+            name (str): Model name
+            ttft (float, optional): Time to first token; None for requests whose
+                latency is not comparable (non-streaming), which only count as healthy
+        """
+        state = self._models.get(name)
+        if state is None:
+            return
+        a = self.ewma_alpha
+        if ttft is not None:
+            state.ewma_ttft = ttft if state.ewma_ttft is None else a * ttft + (1 - a) * state.ewma_ttft
+        state.error_rate = (1 - a) * state.error_rate
+        state.failures = 0
+        if state.open_until or state.probing:
+            logging.info(f"Model {name} recovered, closing circuit breaker")
+        state.trips = 0
+        state.open_until = 0.0
+        state.probing = False
+
+    def record_failure(self, name: str, status: int | None = None):
+        """
+        Register a failed request.
+
+        Args:
+            name (str): Model name
+            status (int, optional): HTTP status; None for timeouts and network errors
+        """
+        state = self._models.get(name)
+        if state is None:
+            return
+        a = self.ewma_alpha
+        state.error_rate = a + (1 - a) * state.error_rate
+        state.errors += 1
+        state.last_error = status
+        # Only overload and upstream failures count towards the breaker
+        if status is not None and status != 429 and status < 500:
+            state.probing = False
+            return
+        state.failures += 1
+        if state.probing or state.failures >= self.failure_threshold:
+            state.trips += 1
+            duration = min(self.max_open_seconds, self.open_seconds * 2 ** (state.trips - 1))
+            state.open_until = time.monotonic() + duration
+            state.failures = 0
+            logging.warning(f"Circuit breaker for model {name} opened for {duration:.0f} s (last error: {status})")
+        state.probing = False
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        result = []
+        for state in self._models.values():
+            if state.probing and state.open_until > now:
+                breaker = "half-open"
+            elif state.open_until > now:
+                breaker = "open"
+            else:
+                breaker = "closed"
+            result.append({
+                "name": state.name,
+                "vision": state.vision,
+                "breaker": breaker,
+                "open_for": max(0.0, state.open_until - now),
+                "ewma_ttft": state.ewma_ttft,
+                "error_rate": state.error_rate,
+                "requests": state.requests,
+                "errors": state.errors,
+                "last_error": state.last_error,
+            })
+        return result
@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    period TEXT,
+    days INTEGER NOT NULL,
+    price INTEGER,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    resolved_by INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, id);
+CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id, status);
+"""
+
+# pending -> processing (взят админом) -> approved / rejected; cancelled — отменён покупателем
+# или заменён новым заказом того же пользователя
+PENDING = "pending"
+PROCESSING = "processing"
+APPROVED = "approved"
+REJECTED = "rejected"
+CANCELLED = "cancelled"
+STATUSES = (PENDING, PROCESSING, APPROVED, REJECTED, CANCELLED)
+
+COLUMNS = (
+    "id", "user_id", "username", "period", "days", "price",
+    "status", "created_at", "updated_at", "resolved_by", "error",
+)
+SELECT_ORDER = f"SELECT {', '.join(COLUMNS)} FROM orders"
+
+
+def _row_to_order(row) -> dict:
+    return dict(zip(COLUMNS, row))
+
+
+class OrderStore:
+    """
+    Durable queue of VPN orders, backed by SQLite.
+
+    An order is created when the buyer reports the payment and stays
+    ``pending`` until an admin resolves it. claim() moves orders to
+    ``processing`` in one write transaction, so when several admins (or
+    processes) act on the same orders at once each order is handed to
+    exactly one of them; finish() records the outcome. Orders are indexed
+    by status, so the admin queue pages through pending orders without
+    scanning resolved ones.
+
+    Like the other SQLite stores, the connection lives on a single-thread
+    executor so queries never block the event loop.
+    """
+
+    def __init__(self, path: str, on_timing=None):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every database call, e.g. to feed metrics
+        """
+        self.path = path
+        self.on_timing = on_timing
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders-sqlite")
+        self._created = 0
+        self._approved = 0
+        self._rejected = 0
+        self._failed = 0
+        self._cancelled = 0
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_timing is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    def _write(self, func, *args):
+        # BEGIN IMMEDIATE takes the write lock up front, so a read-then-update
+        # can't interleave with the same update from another process
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return result
+
+    # --- Lifecycle ---
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    async def start(self):
+        await self._run(self._open)
+        logging.info(f"Order store opened: {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    # --- Orders ---
+    def _create(self, user_id: int, username, period, days: int, price):
+        def create():
+            now = time.time()
+            # У пользователя одна открытая заявка: новая заменяет прежнюю
+            self._conn.execute(
+                "UPDATE orders SET status = ?, updated_at = ? WHERE user_id = ? AND status = ?",
+                (CANCELLED, now, user_id, PENDING)
+            )
+            cursor = self._conn.execute(
+                "INSERT INTO orders (user_id, username, period, days, price, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, username, period, days, price, PENDING, now, now)
+            )
+            return self._get(cursor.lastrowid)
+        return self._write(create)
+
+    async def create(self, user_id, username: str, period: str, days: int, price: int) -> dict:
+        """
+        Add a pending order; an earlier pending order of the same user is cancelled.
+
+        Returns:
+            dict: The new order
+        """
+        order = await self._run(self._create, int(user_id), username, period, int(days), price)
+        self._created += 1
+        return order
+
+    def _get(self, order_id: int):
+        row = self._conn.execute(f"{SELECT_ORDER} WHERE id = ?", (order_id,)).fetchone()
+        return _row_to_order(row) if row is not None else None
+
+    async def get(self, order_id) -> dict | None:
+        return await self._run(self._get, int(order_id))
+
+    def _cancel(self, order_id: int, user_id: int) -> bool:
+        cursor = self._write(
+            self._conn.execute,
+            "UPDATE orders SET status = ?, updated_at = ? WHERE id = ? AND user_id = ? AND status = ?",
+            (CANCELLED, time.time(), order_id, user_id, PENDING)
+        )
+        return cursor.rowcount > 0
+
+    async def cancel(self, order_id, user_id) -> bool:
+        """
+        Cancel a pending order on behalf of its buyer.
+
+        Returns:
+            bool: False if the order is not the user's or is no longer pending
+                (an admin has taken it)
+        """
+        cancelled = await self._run(self._cancel, int(order_id), int(user_id))
+        if cancelled:
+            self._cancelled += 1
+        return cancelled
+
+    def _page(self, status: str, after, before, limit: int):
+        if before is not None:
+            rows = self._conn.execute(
+                f"{SELECT_ORDER} WHERE status = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (status, before, limit + 1)
+            ).fetchall()
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_next = True
+        else:
+            rows = self._conn.execute(
+                f"{SELECT_ORDER} WHERE status = ? AND id > ? ORDER BY id LIMIT ?",
+                (status, after if after is not None else 0, limit + 1)
+            ).fetchall()
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+            has_prev = after is not None and rows and self._conn.execute(
+                "SELECT 1 FROM orders WHERE status = ? AND id < ? LIMIT 1", (status, rows[0][0])
+            ).fetchone() is not None
+        return [_row_to_order(row) for row in rows], bool(has_prev), has_next
+
+    async def page(self, status: str = PENDING, after=None, before=None, limit: int = 10) -> tuple:
+        """
+        Return one page of orders with a status, oldest first.
+
+        Args:
+            status (str): Order status
+            after (int, optional): Cursor — return orders with greater IDs
+            before (int, optional): Cursor — return the orders right before this ID
+            limit (int): Page size
+
+        Returns:
+            tuple: (list of orders, has_prev, has_next)
+        """
+        return await self._run(self._page, status, after, before, limit)
+
+    def _count_by_status(self) -> dict:
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self._conn.execute("SELECT status, COUNT(*) FROM orders GROUP BY status").fetchall())
+        return counts
+
+    async def count_by_status(self) -> dict:
+        return await self._run(self._count_by_status)
+
+    # --- Resolution ---
+    def _claim(self, order_ids: list, admin_id: int):
+        def claim():
+            placeholders = ", ".join("?" * len(order_ids))
+            rows = self._conn.execute(
+                f"{SELECT_ORDER} WHERE status = ? AND id IN ({placeholders}) "
+                "AND user_id NOT IN (SELECT user_id FROM orders WHERE status = ?) ORDER BY id",
+                (PENDING, *order_ids, PROCESSING)
+            ).fetchall()
+            # Одна заявка покупателя за раз: два продления, выданные одновременно,
+            # посчитались бы от одной и той же даты окончания
+            claimed, users = [], set()
+            for row in rows:
+                if row[1] not in users:
+                    users.add(row[1])
+                    claimed.append(row)
+            self._conn.executemany(
+                "UPDATE orders SET status = ?, resolved_by = ?, updated_at = ? WHERE id = ?",
+                [(PROCESSING, admin_id, time.time(), row[0]) for row in claimed]
+            )
+            return [dict(_row_to_order(row), status=PROCESSING, resolved_by=admin_id) for row in claimed]
+        return self._write(claim)
+
+    async def claim(self, order_ids: list, admin_id: int) -> list:
+        """
+        Take pending orders for resolution.
+
+        At most one order per user is in processing at a time: orders of a
+        user who already has one in processing (or an earlier one in the same
+        call) stay pending.
+
+        Returns:
+            list: The claimed orders; orders that are no longer pending
+                (resolved by another admin, cancelled) are left out
+        """
+        if not order_ids:
+            return []
+        return await self._run(self._claim, [int(order_id) for order_id in order_ids], int(admin_id))
+
+    def _finish(self, results: list):
+        now = time.time()
+        self._write(
+            self._conn.executemany,
+            "UPDATE orders SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+            [(status, error, now, order_id, PROCESSING) for order_id, status, error in results]
+        )
+
+    async def finish(self, results: list):
+        """
+        Record the outcome of claimed orders in one transaction.
+
+        Args:
+            results (list): (order_id, status, error) tuples; status is APPROVED,
+                REJECTED or PENDING (the grant failed, the order goes back to the queue)
+        """
+        if not results:
+            return
+        await self._run(self._finish, results)
+        for _, status, _ in results:
+            if status == APPROVED:
+                self._approved += 1
+            elif status == REJECTED:
+                self._rejected += 1
+            else:
+                self._failed += 1
+
+    def _recover(self) -> int:
+        cursor = self._conn.execute(
+            "UPDATE orders SET status = ?, updated_at = ? WHERE status = ?",
+            (PENDING, time.time(), PROCESSING)
+        )
+        return cursor.rowcount
+
+    async def recover(self) -> int:
+        """
+        Return orders left in processing by a crash to the queue.
+
+        Call it at startup of the process that resolves orders, before any
+        admin action. Returns the number of recovered orders.
+        """
+        count = await self._run(self._recover)
+        if count:
+            logging.warning(f"{count} VPN orders were interrupted while processing and are pending again")
+        return count
+
+    def stats(self) -> dict:
+        return {
+            "created": self._created,
+            "approved": self._approved,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "cancelled": self._cancelled,
+        }
@@ -0,0 +1,99 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return " ".join(content.split()).casefold()
+    if isinstance(content, list):
+        return [
+            {**part, "text": _normalize_content(part["text"])} if isinstance(part, dict) and "text" in part else part
+            for part in content
+        ]
+    return content
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of complete GPT replies.
+
+    Keys are a hash of the model, the normalized messages (whitespace
+    collapsed, case folded) and the sampling settings, so the same short
+    question asked at the start of a conversation is answered without an
+    upstream call. Requests with a temperature above ``max_temperature``
+    are not cached: their replies are meant to vary.
+    """
+
+    def __init__(self, ttl: float = 6 * 3600, max_entries: int = 2000, max_temperature: float = 0.3):
+        """
+        Args:
+            ttl (float): Seconds a reply stays valid
+            max_entries (int): Maximum number of cached replies
+            max_temperature (float): Highest temperature that is still cached
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_temperature = max_temperature
+        self._entries = OrderedDict()  # key -> (text, expires_at); least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._bytes_saved = 0
+
+    def make_key(self, model: str, messages: list, temperature: float, max_tokens: int) -> str | None:
+        """
+        Return the cache key of a request, or None if it must not be cached.
+        """
+        if temperature > self.max_temperature:
+            return None
+        normalized = [
+            {"role": message["role"], "content": _normalize_content(message["content"])}
+            for message in messages
+        ]
+        raw = json.dumps([model, normalized, temperature, max_tokens], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str | None) -> str | None:
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        text, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        self._bytes_saved += len(text.encode("utf-8"))
+        return text
+
+    def put(self, key: str | None, text: str):
+        if key is None or not text:
+            return
+        self._entries[key] = (text, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def clear(self) -> int:
+        """Drop all cached replies and return how many there were."""
+        count = len(self._entries)
+        self._entries.clear()
+        return count
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": self._hits / lookups if lookups else 0.0,
+            "evictions": self._evictions,
+            "bytes_saved": self._bytes_saved,
+        }
@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    gpt_access INTEGER NOT NULL DEFAULT 0,
+    vpn_access INTEGER,
+    vpn_expires TEXT,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS blocked (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE INDEX IF NOT EXISTS idx_users_gpt_access ON users (gpt_access, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_vpn_expires ON users (vpn_expires) WHERE vpn_expires IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_users_username ON users (lower(username));
+"""
+
+# Наибольшее значение SQLite INTEGER
+MAX_ID = 2 ** 63 - 1
+
+SELECT_USER = "SELECT users.user_id, username, gpt_access, vpn_access, vpn_expires, extra FROM users"
+
+# Условия для списков пользователей в админ-меню
+VIEW_QUERIES = {
+    "all": (SELECT_USER, "WHERE 1"),
+    "gpt_on": (SELECT_USER, "WHERE gpt_access = 1"),
+    "gpt_off": (SELECT_USER, "WHERE gpt_access = 0"),
+    "blocked": (
+        "SELECT blocked.user_id, username, gpt_access, vpn_access, vpn_expires, extra "
+        "FROM blocked LEFT JOIN users ON users.user_id = blocked.user_id",
+        "WHERE 1",
+    ),
+}
+
+# Поля записи пользователя, которые хранятся в отдельных колонках;
+# всё остальное складывается в JSON-колонку extra.
+COLUMNS = ("username", "gpt_access", "vpn_access", "vpn_expires")
+
+
+def _row_to_record(row) -> dict:
+    username, gpt_access, vpn_access, vpn_expires, extra = row
+    record = json.loads(extra) if extra else {}
+    record["username"] = username
+    record["gpt_access"] = bool(gpt_access)
+    if vpn_access is not None:
+        record["vpn_access"] = bool(vpn_access)
+    if vpn_expires is not None:
+        record["vpn_expires"] = vpn_expires
+    return record
+
+
+def _id_prefix_ranges(prefix: str) -> list:
+    """Numeric [low, high) ranges of the IDs whose decimal form starts with prefix."""
+    if prefix.startswith("0"):
+        return []  # десятичная запись ID не начинается с нуля
+    ranges = []
+    base = int(prefix)
+    scale = 1
+    while base * scale <= MAX_ID:
+        ranges.append((base * scale, min((base + 1) * scale, MAX_ID)))
+        scale *= 10
+    return ranges
+
+
+def _split_fields(fields: dict) -> tuple:
+    columns = {k: v for k, v in fields.items() if k in COLUMNS}
+    extra = {k: v for k, v in fields.items() if k not in COLUMNS}
+    for flag in ("gpt_access", "vpn_access"):
+        if columns.get(flag) is not None:
+            columns[flag] = int(bool(columns[flag]))
+    return columns, extra
+
+
+class SQLiteUserStore:
+    """
+    User store backed by an SQLite database.
+
+    Access flags, blocked state and VPN expiry are indexed, so admin filters
+    and blocked checks don't scan the whole user base. The connection lives
+    on a dedicated single-thread executor: every query runs there, which
+    keeps the event loop free and serializes access to the connection.
+    Exposes the same async API as UserStore.
+    """
+
+    def __init__(self, path: str, on_timing=None):
+        """
+        Args:
+            path (str): Path to the SQLite database file
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every database call, e.g. to feed metrics
+        """
+        self.path = path
+        self.on_timing = on_timing
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="users-sqlite")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if self.on_timing is None:
+            return await loop.run_in_executor(self._executor, func, *args)
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    # --- Lifecycle ---
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    async def start(self):
+        await self._run(self._open)
+        logging.info(f"SQLite user store opened: {self.path}")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    async def flush(self):
+        # Every mutation is committed immediately
+        return
+
+    # --- Queries ---
+    def _get_user(self, user_id: int):
+        row = self._conn.execute(
+            "SELECT username, gpt_access, vpn_access, vpn_expires, extra FROM users WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        return _row_to_record(row) if row is not None else None
+
+    async def get_user(self, user_id) -> dict | None:
+        return await self._run(self._get_user, int(user_id))
+
+    def _list_users(self, gpt_access):
+        query = "SELECT user_id, username, gpt_access, vpn_access, vpn_expires, extra FROM users"
+        params = ()
+        if gpt_access is not None:
+            query += " WHERE gpt_access = ?"
+            params = (int(gpt_access),)
+        query += " ORDER BY user_id"
+        return [(str(row[0]), _row_to_record(row[1:])) for row in self._conn.execute(query, params)]
+
+    async def list_users(self, gpt_access: bool | None = None) -> list:
+        return await self._run(self._list_users, gpt_access)
+
+    def _page_users(self, view, after, before, limit):
+        select, where = VIEW_QUERIES[view]
+        key = "blocked.user_id" if view == "blocked" else "users.user_id"
+        if before is not None:
+            rows = self._conn.execute(
+                f"{select} {where} AND {key} < ? ORDER BY {key} DESC LIMIT ?", (before, limit + 1)
+            ).fetchall()
+            has_prev = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_next = True
+        else:
+            rows = self._conn.execute(
+                f"{select} {where} AND {key} > ? ORDER BY {key} LIMIT ?",
+                (after if after is not None else -1, limit + 1)
+            ).fetchall()
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+            has_prev = after is not None and bool(rows) and self._conn.execute(
+                f"{select} {where} AND {key} < ? LIMIT 1", (rows[0][0],)
+            ).fetchone() is not None
+        # Blocked IDs without a user record come back from the LEFT JOIN with NULL columns
+        items = [(str(row[0]), _row_to_record(row[1:]) if row[2] is not None else {}) for row in rows]
+        return items, has_prev, has_next
+
+    async def page_users(self, view: str, after=None, before=None, limit: int = 10) -> tuple:
+        return await self._run(self._page_users, view, after, before, limit)
+
+    def _search_users(self, query, limit):
+        query = query.strip().lstrip("@").lower()
+        if not query:
+            return []
+        found = {}
+        if query.isdigit():
+            for low, high in _id_prefix_ranges(query):
+                if len(found) >= limit:
+                    break
+                for row in self._conn.execute(
+                    f"{SELECT_USER} WHERE users.user_id >= ? AND users.user_id < ? ORDER BY users.user_id LIMIT ?",
+                    (low, high, limit - len(found))
+                ):
+                    found[str(row[0])] = _row_to_record(row[1:])
+        if len(found) < limit:
+            end = query[:-1] + chr(ord(query[-1]) + 1)
+            for row in self._conn.execute(
+                f"{SELECT_USER} WHERE lower(username) >= ? AND lower(username) < ? ORDER BY lower(username) LIMIT ?",
+                (query, end, limit)
+            ):
+                if len(found) >= limit:
+                    break
+                found.setdefault(str(row[0]), _row_to_record(row[1:]))
+        return list(found.items())
+
+    async def search_users(self, query: str, limit: int = 10) -> list:
+        return await self._run(self._search_users, query, limit)
+
+    def _list_vpn_expiring(self, before):
+        query = "SELECT user_id, vpn_expires FROM users WHERE vpn_expires IS NOT NULL"
+        params = ()
+        if before is not None:
+            query += " AND vpn_expires < ?"
+            params = (before,)
+        query += " ORDER BY vpn_expires"
+        return [(str(uid), expires) for uid, expires in self._conn.execute(query, params)]
+
+    async def list_vpn_expiring(self, before: str | None = None) -> list:
+        return await self._run(self._list_vpn_expiring, before)
+
+    def _is_blocked(self, user_id: int) -> bool:
+        return self._conn.execute("SELECT 1 FROM blocked WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    async def is_blocked(self, user_id) -> bool:
+        return await self._run(self._is_blocked, int(user_id))
+
+    def _blocked_ids(self) -> set:
+        return {row[0] for row in self._conn.execute("SELECT user_id FROM blocked")}
+
+    async def blocked_ids(self) -> set:
+        return await self._run(self._blocked_ids)
+
+    def _count(self, table: str) -> int:
+        return self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    async def count_users(self) -> int:
+        return await self._run(self._count, "users")
+
+    async def count_blocked(self) -> int:
+        return await self._run(self._count, "blocked")
+
+    # --- Mutations ---
+    def _ensure_user(self, user_id: int, username: str) -> dict:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO users (user_id, username, gpt_access) VALUES (?, ?, 0)",
+                (user_id, username)
+            )
+        return self._get_user(user_id)
+
+    async def ensure_user(self, user_id, username: str) -> dict:
+        return await self._run(self._ensure_user, int(user_id), username)
+
+    def _update_user(self, user_id: int, fields: dict) -> bool:
+        columns, extra = _split_fields(fields)
+        with self._conn:
+            row = self._conn.execute("SELECT extra FROM users WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return False
+            if extra:
+                merged = json.loads(row[0]) if row[0] else {}
+                merged.update(extra)
+                columns["extra"] = json.dumps(merged, ensure_ascii=False)
+            if columns:
+                assignments = ", ".join(f"{name} = ?" for name in columns)
+                self._conn.execute(
+                    f"UPDATE users SET {assignments} WHERE user_id = ?",
+                    (*columns.values(), user_id)
+                )
+        return True
+
+    async def update_user(self, user_id, **fields) -> bool:
+        return await self._run(self._update_user, int(user_id), fields)
+
+    def _block_user(self, user_id: int) -> bool:
+        with self._conn:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO blocked (user_id) VALUES (?)", (user_id,))
+        return cursor.rowcount > 0
+
+    async def block_user(self, user_id) -> bool:
+        return await self._run(self._block_user, int(user_id))
+
+    def _unblock_user(self, user_id: int) -> bool:
+        with self._conn:
+            cursor = self._conn.execute("DELETE FROM blocked WHERE user_id = ?", (user_id,))
+        return cursor.rowcount > 0
+
+    async def unblock_user(self, user_id) -> bool:
+        return await self._run(self._unblock_user, int(user_id))
+
+
+def migrate_json_to_sqlite(json_path: str, db_path: str) -> int:
+    """
+    One-shot migration of a users.json database into SQLite.
+
+    Existing rows with the same user ID are overwritten, so the migration
+    can be re-run safely.
+
+    Args:
+        json_path (str): Path to users.json
+        db_path (str): Path to the SQLite database to create or update
+
+    Returns:
+        int: Number of migrated users
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    rows = []
+    for uid, info in data.get("users", {}).items():
+        columns, extra = _split_fields(info)
+        rows.append((
+            int(uid),
+            columns.get("username"),
+            columns.get("gpt_access", 0),
+            columns.get("vpn_access"),
+            columns.get("vpn_expires"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        ))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, username, gpt_access, vpn_access, vpn_expires, extra) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(
+                "INSERT OR IGNORE INTO blocked (user_id) VALUES (?)",
+                [(int(uid),) for uid in data.get("blocked", [])]
+            )
+    finally:
+        conn.close()
+    return len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate users.json into an SQLite user database")
+    parser.add_argument("json_path", nargs="?", default="users.json")
+    parser.add_argument("db_path", nargs="?", default="users.db")
+    args = parser.parse_args()
+    count = migrate_json_to_sqlite(args.json_path, args.db_path)
+    print(f"Migrated {count} users from {args.json_path} to {args.db_path}")
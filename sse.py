@@ -0,0 +1,166 @@
+import codecs
+import json
+import logging
+from dataclasses import dataclass
+
+
+@dataclass
+class SSEEvent:
+    """A dispatched server-sent event."""
+    event: str = "message"
+    data: str = ""
+    id: str | None = None
+    retry: int | None = None
+
+
+class SSEStreamError(Exception):
+    """An error object received inside an OpenRouter stream."""
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for a text/event-stream body.
+
+    Bytes can be fed in arbitrarily sized chunks: UTF-8 sequences and lines
+    that straddle chunk boundaries are carried over to the next call. Line
+    endings, comments and the event/data/id/retry fields are handled as
+    described in the HTML Living Standard, section "Server-sent events".
+    """
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = []
+        self._skip_lf = False
+        self._first = True
+        self._event = ""
+        self._data = []
+        self._id = None
+        self._retry = None
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        Decode a chunk of the body.
+
+        Returns:
+            list: SSEEvent objects completed by this chunk
+        """
+        text = self._decoder.decode(chunk)
+        return self._feed_text(text) if text else []
+
+    def close(self) -> list:
+        """
+        Finish decoding at the end of the body.
+
+        A final line without a terminating newline is still processed and a
+        pending event is dispatched, so a stream cut right after its last
+        field isn't lost.
+        """
+        events = self._feed_text(self._decoder.decode(b"", final=True))
+        if self._partial:
+            line = "".join(self._partial)
+            self._partial = []
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _feed_text(self, text: str) -> list:
+        if self._first:
+            self._first = False
+            if text.startswith("\ufeff"):
+                text = text[1:]
+        if self._skip_lf and text.startswith("\n"):
+            text = text[1:]
+        self._skip_lf = text.endswith("\r")
+
+        # CR, LF and CRLF all terminate a line
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        if len(lines) == 1:
+            if lines[0]:
+                self._partial.append(lines[0])
+            return []
+
+        events = []
+        self._partial.append(lines[0])
+        lines[0] = "".join(self._partial)
+        self._partial = [lines[-1]] if lines[-1] else []
+        for line in lines[:-1]:
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _process_line(self, line: str):
+        if not line:
+            return self._dispatch()
+        if line.startswith(":"):
+            return None
+        name, sep, value = line.partition(":")
+        if sep and value.startswith(" "):
+            value = value[1:]
+        if name == "data":
+            self._data.append(value)
+        elif name == "event":
+            self._event = value
+        elif name == "id":
+            if "\0" not in value:
+                self._id = value
+        elif name == "retry":
+            if value.isdigit():
+                self._retry = int(value)
+        return None
+
+    def _dispatch(self):
+        if not self._data:
+            self._event = ""
+            return None
+        event = SSEEvent(
+            event=self._event or "message",
+            data="\n".join(self._data),
+            id=self._id,
+            retry=self._retry,
+        )
+        self._event = ""
+        self._data = []
+        return event
+
+
+async def iter_sse_events(chunks):
+    """
+    Turn an async iterable of byte chunks into SSE events.
+
+    Args:
+        chunks: Async iterable of bytes, e.g. aiohttp's response.content.iter_any()
+    """
+    decoder = SSEDecoder()
+    async for chunk in chunks:
+        for event in decoder.feed(chunk):
+            yield event
+    for event in decoder.close():
+        yield event
+
+
+async def iter_openrouter_deltas(chunks):
+    """
+    Yield the ``choices[0].delta`` objects of an OpenRouter/OpenAI stream.
+
+    Stops at the ``[DONE]`` sentinel. Raises SSEStreamError if the stream
+    carries an error object instead of a completion chunk.
+    """
+    async for event in iter_sse_events(chunks):
+        if event.data == "[DONE]":
+            return
+        try:
+            payload = json.loads(event.data)
+        except json.JSONDecodeError:
+            logging.error(f"JSON decode error in SSE event: {event.data[:200]}")
+            continue
+        if "error" in payload:
+            error = payload["error"]
+            message = error.get("message", "Unknown error") if isinstance(error, dict) else str(error)
+            raise SSEStreamError(message)
+        choices = payload.get("choices") or [{}]
+        yield choices[0].get("delta") or {}
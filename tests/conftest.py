@@ -0,0 +1,45 @@
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Run ``async def`` tests in a fresh event loop (pytest-asyncio is not required)."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    kwargs = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**kwargs))
+    return True
+
+
+@pytest.fixture
+def open_store():
+    """``await open_store(store_cls, path, **options)`` — create a store on a file and start it."""
+    async def open_store(store_cls, path, **options):
+        store = store_cls(str(path), **options)
+        await store.start()
+        return store
+
+    return open_store
+
+
+class FakeBot:
+    """Bot stand-in recording ``send_message`` calls as (chat_id, text)."""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+@pytest.fixture
+def fake_bot():
+    return FakeBot()
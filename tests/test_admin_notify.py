@@ -0,0 +1,59 @@
+import asyncio
+
+from admin_notify import AdminNotifier, DigestStore
+from rate_limit import TokenBucket
+
+
+def render(digest_id, items):
+    return f"{digest_id}: {len(items)}", None
+
+
+def make_notifier(bot, store=None, **options):
+    notifier = AdminNotifier(bot, [1, 2], TokenBucket(1000), store=store, **options)
+    notifier.register_digest("gpt_request", render)
+    return notifier
+
+
+async def test_items_within_window_become_one_digest_per_admin(fake_bot):
+    notifier = make_notifier(fake_bot, digest_window=0.05)
+    for user_id in (10, 11, 10):
+        notifier.add("gpt_request", user_id, (user_id, f"user{user_id}"))
+    await asyncio.sleep(0.1)
+    assert sorted(chat_id for chat_id, _ in fake_bot.sent) == [1, 2]
+    digest_id = fake_bot.sent[0][1].split(":")[0]
+    assert await notifier.digest(digest_id) == [(10, "user10"), (11, "user11")]
+    stats = notifier.stats()
+    assert (stats["digests"], stats["digested_items"], stats["sent"]) == (1, 2, 2)
+    await notifier.close()
+
+
+async def test_digest_is_sent_early_at_max_and_flushed_on_close(fake_bot):
+    notifier = make_notifier(fake_bot, digest_window=60, digest_max=3)
+    for user_id in range(4):
+        notifier.add("gpt_request", user_id, (user_id, None))
+    await asyncio.sleep(0.01)
+    assert len(fake_bot.sent) == 2
+    await notifier.close()
+    assert [text.split(": ")[1] for _, text in fake_bot.sent] == ["3", "3", "1", "1"]
+
+
+async def test_digest_from_another_process_is_found_in_store(tmp_path, open_store, fake_bot):
+    path = tmp_path / "digests.db"
+    # Сводку отправляет процесс пользователя, кнопку нажимают в процессе админа
+    sender = make_notifier(fake_bot, await open_store(DigestStore, path), digest_window=60)
+    receiver = make_notifier(fake_bot, await open_store(DigestStore, path))
+    sender.add("gpt_request", 10, (10, "user10"))
+    await sender.flush()
+    digest_id = sender.bot.sent[0][1].split(":")[0]
+    assert await receiver.digest(digest_id) == [[10, "user10"]]
+    assert await receiver.digest("deadbeef") is None
+    await sender.close()
+    await receiver.close()
+
+
+async def test_store_keeps_only_recent_digests(tmp_path, open_store):
+    store = await open_store(DigestStore, tmp_path / "digests.db", keep=2)
+    for i in range(3):
+        await store.save(f"d{i}", "gpt_request", [i])
+    assert [await store.get(f"d{i}") for i in range(3)] == [None, [1], [2]]
+    await store.close()
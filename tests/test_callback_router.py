@@ -0,0 +1,102 @@
+import pytest
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State, StatesGroup
+
+from callback_router import CallbackRouter
+
+
+class PageCallback(CallbackData, prefix="page"):
+    page: int
+
+
+class MenuCallback(CallbackData, prefix="menu"):
+    pass
+
+
+class DashCallback(CallbackData, prefix="dash", sep="-"):
+    page: int
+
+
+class Steps(StatesGroup):
+    confirm = State()
+
+
+class FakeCallback:
+    def __init__(self, data):
+        self.data = data
+        self.answers = []
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+
+class FakeState:
+    def __init__(self, current):
+        self.current = current
+
+    async def get_state(self):
+        return self.current
+
+
+def make_router():
+    calls = []
+
+    async def on_page(callback, callback_data, **kwargs):
+        calls.append(("page", callback_data.page))
+
+    async def on_menu(callback, callback_data):
+        calls.append(("menu", callback_data))
+
+    router = CallbackRouter(unknown_text="Кнопка устарела")
+    router.add(PageCallback, on_page, state=Steps.confirm)
+    router.add(MenuCallback, on_menu)
+    return router, calls
+
+
+async def test_dispatch_unpacks_typed_data():
+    router, calls = make_router()
+    await router.dispatch(FakeCallback("page:3"), state=FakeState(Steps.confirm.state))
+    await router.dispatch(FakeCallback("menu"))
+    assert calls == [("page", 3), ("menu", MenuCallback())]
+    assert router.stats()["dispatched"] == 2
+    assert router.route_name("page:3") == "on_page"
+
+
+async def test_unknown_prefix_is_answered():
+    router, calls = make_router()
+    for data in ("other:1", "", None):
+        callback = FakeCallback(data)
+        await router.dispatch(callback)
+        assert callback.answers == ["Кнопка устарела"]
+    assert calls == []
+    assert router.stats()["unknown"] == 3
+    assert router.route_name("other:1") == "unknown"
+
+
+async def test_invalid_payload_is_answered():
+    router, calls = make_router()
+    callback = FakeCallback("page:abc")
+    await router.dispatch(callback, raw_state=Steps.confirm.state)
+    assert callback.answers == ["Кнопка устарела"]
+    assert calls == []
+    assert router.stats()["invalid"] == 1
+
+
+async def test_wrong_state_is_ignored():
+    router, calls = make_router()
+    for kwargs in ({"raw_state": None}, {"state": FakeState("Other:step")}, {}):
+        callback = FakeCallback("page:1")
+        await router.dispatch(callback, **kwargs)
+        assert callback.answers == [None]
+    assert calls == []
+    assert router.stats()["wrong_state"] == 3
+
+
+def test_add_rejects_bad_routes():
+    router, _ = make_router()
+    with pytest.raises(ValueError):
+        router.add(PageCallback, lambda callback, callback_data: None)
+    with pytest.raises(ValueError):
+        router.add(DashCallback, lambda callback, callback_data: None)
+    with pytest.raises(TypeError):
+        router.add(dict, lambda callback, callback_data: None)
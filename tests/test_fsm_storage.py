@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+
+
+class Steps(StatesGroup):
+    period = State()
+    payment = State()
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def stored_keys(path):
+    with sqlite3.connect(path) as conn:
+        return sorted(row[0] for row in conn.execute("SELECT key FROM fsm"))
+
+
+async def test_state_survives_restart_and_is_shared(tmp_path, open_store):
+    path = tmp_path / "fsm.db"
+    first = await open_store(SQLiteStorage, path)
+    await first.set_state(key(1), Steps.period)
+    await first.set_data(key(1), {"period": "1m", "price": 599})
+
+    # Другой процесс на том же файле
+    second = await open_store(SQLiteStorage, path)
+    assert await second.get_state(key(1)) == Steps.period.state
+    assert await second.get_data(key(1)) == {"period": "1m", "price": 599}
+    await first.close()
+    await second.close()
+
+    # Перезапуск
+    restarted = await open_store(SQLiteStorage, path)
+    assert await restarted.get_state(key(1)) == Steps.period.state
+    assert await restarted.get_data(key(1)) == {"period": "1m", "price": 599}
+    assert await restarted.get_state(key(2)) is None
+    await restarted.close()
+
+
+async def test_abandoned_state_expires(tmp_path, open_store):
+    path = tmp_path / "fsm.db"
+    writer = await open_store(SQLiteStorage, path, state_ttl=0.1)
+    await writer.set_state(key(1), Steps.payment)
+    await writer.set_data(key(1), {"period": "3m"})
+    reader = await open_store(SQLiteStorage, path)
+    assert await reader.get_state(key(1)) == Steps.payment.state
+    await asyncio.sleep(0.15)
+
+    assert await writer.get_state(key(1)) is None
+    assert await writer.get_data(key(1)) == {}
+    # Срок хранится в базе, поэтому истекает и в кэше другого процесса
+    assert await reader.get_state(key(1)) is None
+    await writer.close()
+    await reader.close()
+
+
+async def test_cached_state_is_trusted_for_cache_ttl(tmp_path, open_store):
+    path = tmp_path / "fsm.db"
+    writer = await open_store(SQLiteStorage, path, cache_ttl=0)
+    cached = await open_store(SQLiteStorage, path, cache_ttl=0.2)
+    uncached = await open_store(SQLiteStorage, path, cache_ttl=0)
+    await writer.set_state(key(1), Steps.period)
+    assert await cached.get_state(key(1)) == Steps.period.state
+
+    await writer.set_state(key(1), Steps.payment)
+    assert await cached.get_state(key(1)) == Steps.period.state
+    assert await uncached.get_state(key(1)) == Steps.payment.state
+    await asyncio.sleep(0.25)
+    assert await cached.get_state(key(1)) == Steps.payment.state
+
+    stats = cached.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    for storage in (writer, cached, uncached):
+        await storage.close()
+
+
+async def test_close_is_idempotent(tmp_path, open_store):
+    path = tmp_path / "fsm.db"
+    storage = await open_store(SQLiteStorage, path)
+    await storage.set_state(key(1), Steps.period)
+    await storage.close()
+    await storage.close()
+
+    reopened = await open_store(SQLiteStorage, path)
+    assert await reopened.get_state(key(1)) == Steps.period.state
+    await reopened.close()
+
+
+async def test_purge_removes_expired_and_cleared_rows(tmp_path, open_store):
+    path = tmp_path / "fsm.db"
+    short = await open_store(SQLiteStorage, path, state_ttl=0.05)
+    await short.set_state(key(1), Steps.period)
+    await short.close()
+
+    storage = await open_store(SQLiteStorage, path, purge_interval=0.1)
+    await storage.set_state(key(2), Steps.period)
+    await storage.set_data(key(2), {"period": "1m"})
+    # Так FSMContext.clear() сбрасывает диалог: пустое состояние и пустые данные
+    await storage.set_state(key(2), None)
+    await storage.set_data(key(2), {})
+    await storage.set_state(key(3), Steps.payment)
+    assert len(stored_keys(path)) == 3
+    await asyncio.sleep(0.25)
+
+    assert stored_keys(path) == ["1:3:3:::default"]
+    assert storage.stats()["purged"] == 2
+    assert await storage.get_state(key(3)) == Steps.payment.state
+    await storage.close()
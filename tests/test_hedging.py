@@ -0,0 +1,48 @@
+import asyncio
+
+from hedging import HedgePolicy
+
+
+def make_policy():
+    policy = HedgePolicy(min_samples=1, min_delay=0.01, max_delay=0.01)
+    policy.observe(0.01)
+    return policy
+
+
+def request(delay, tokens=("ok",), result="done"):
+    async def start(push):
+        await asyncio.sleep(delay)
+        for token in tokens:
+            push(token)
+        return result
+    return start
+
+
+async def run_race(policy, primary, hedge):
+    received = []
+    result = await policy.run(primary, hedge, received.append)
+    return result, received
+
+
+async def test_hedge_wins_when_primary_is_slow():
+    policy = make_policy()
+    result, received = await run_race(policy, request(1.0, result="primary"), request(0.02, result="hedge"))
+    assert (result, received) == ("hedge", ["ok"])
+    assert (policy.stats()["won"], policy.stats()["lost"]) == (1, 0)
+
+
+async def test_primary_wins_after_hedge_is_fired():
+    policy = make_policy()
+    result, _ = await run_race(policy, request(0.03, result="primary"), request(1.0, result="hedge"))
+    assert result == "primary"
+    assert (policy.stats()["won"], policy.stats()["lost"]) == (0, 1)
+
+
+async def test_race_without_tokens_is_not_counted_as_loss():
+    policy = make_policy()
+    result, received = await run_race(
+        policy, request(0.03, tokens=(), result="error"), request(0.02, tokens=(), result="hedge error")
+    )
+    assert (result, received) == ("error", [])
+    stats = policy.stats()
+    assert (stats["won"], stats["lost"], stats["no_token"]) == (0, 0, 1)
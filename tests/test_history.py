@@ -0,0 +1,129 @@
+import asyncio
+
+from history import HistoryManager
+from history_store import HistoryDiskStore
+
+
+async def test_clear_during_failed_flush_is_not_written_back(tmp_path, open_store):
+    store = await open_store(HistoryDiskStore, tmp_path / "history.db")
+    history = HistoryManager(store=store, max_resident=1, flush_interval=60)
+    await history.append(1, "user", "первый")
+    await history.append(2, "user", "второй")  # пользователь 1 вытеснен на диск
+
+    saving = asyncio.Event()
+    release = asyncio.Event()
+    save_many = store.save_many
+
+    async def failing_save(snapshots):
+        saving.set()
+        await release.wait()
+        raise OSError("disk full")
+
+    store.save_many = failing_save
+    flush = asyncio.create_task(history.flush())
+    await saving.wait()
+    await history.clear(1)
+    await history.clear(2)
+    release.set()
+    await flush
+
+    store.save_many = save_many
+    await history.flush()
+    assert await store.load(1) is None
+    assert await store.load(2) is None
+    assert await history.build_messages(1) == []
+    assert history.stats()["pending_writes"] == 0
+    await history.close()
+
+
+def text(n):
+    # 36 символов: 13 оценочных токенов на сообщение
+    return f"{n:03d}" + "x" * 33
+
+
+async def settled(history):
+    while history.stats()["summarizing"]:
+        await asyncio.sleep(0.005)
+
+
+async def test_oldest_messages_are_dropped_to_fit_budget():
+    history = HistoryManager(token_budget=40, max_messages=10)
+    for n in range(5):
+        await history.append(1, "user", text(n))
+    assert [m["content"] for m in await history.build_messages(1)] == [text(2), text(3), text(4)]
+    # Самое новое сообщение остаётся, даже если оно одно не помещается в бюджет
+    await history.append(1, "user", "y" * 1000)
+    assert [m["content"] for m in await history.build_messages(1)] == ["y" * 1000]
+
+    history = HistoryManager(token_budget=1000, max_messages=2)
+    for n in range(5):
+        await history.append(1, "user", text(n))
+    assert [m["content"] for m in await history.build_messages(1)] == [text(3), text(4)]
+    assert history.stats()["evicted_messages"] == 3
+
+
+def folding_summarizer(calls, fail_first=0):
+    async def summarizer(summary, messages):
+        calls.append((summary, [m["content"] for m in messages]))
+        if len(calls) <= fail_first:
+            raise RuntimeError("503")
+        return f"{summary}+{len(messages)}"
+    return summarizer
+
+
+async def test_evicted_turns_are_folded_into_summary():
+    calls = []
+    history = HistoryManager(folding_summarizer(calls), token_budget=45, max_messages=10)
+    for n in range(4):
+        await history.append(1, "user", text(n))
+    await settled(history)
+    for n in range(4, 8):
+        await history.append(1, "user", text(n))
+    await settled(history)
+
+    messages = await history.build_messages(1)
+    summary = messages[0]["content"].split(": ", 1)[1]
+    assert messages[0]["role"] == "system"
+    # Каждое вытесненное сообщение попало в краткое содержание ровно один раз, по порядку
+    folded = [content for _, batch in calls for content in batch]
+    assert folded + [m["content"] for m in messages[1:]] == [text(n) for n in range(8)]
+    # Каждое следующее сжатие дополняет предыдущее краткое содержание
+    assert [previous for previous, _ in calls] == ["+".join([""] + [str(len(b)) for _, b in calls[:i]]) for i in range(len(calls))]
+    assert summary == "+" + "+".join(str(len(batch)) for _, batch in calls)
+    assert history.stats()["summaries_made"] == len(calls) >= 2
+
+
+async def test_failed_summary_is_retried_with_the_same_turns():
+    calls = []
+    history = HistoryManager(folding_summarizer(calls, fail_first=1), token_budget=40, summary_retry_delay=0.01)
+    for n in range(4):
+        await history.append(1, "user", text(n))
+    await settled(history)
+
+    assert calls[1] == calls[0]
+    folded = [content for _, batch in calls[1:] for content in batch]
+    messages = await history.build_messages(1)
+    assert folded + [m["content"] for m in messages[1:]] == [text(n) for n in range(4)]
+    stats = history.stats()
+    assert (stats["summary_errors"], stats["summary_dropped"]) == (1, 0)
+    assert stats["summaries_made"] == len(calls) - 1
+
+
+async def test_turns_are_dropped_after_retries_run_out():
+    attempts = []
+
+    async def summarizer(summary, messages):
+        attempts.append(len(messages))
+        raise RuntimeError("503")
+
+    history = HistoryManager(summarizer, token_budget=40, summary_retries=2, summary_retry_delay=0.01)
+    for n in range(4):
+        await history.append(1, "user", text(n))
+    # Пока идут повторы, вытесненные сообщения остаются в снимке для диска
+    assert text(0) in [m["content"] for m in history._snapshot(history._conversations[1])["messages"]]
+    await settled(history)
+
+    assert attempts == [1, 1, 1]
+    stats = history.stats()
+    assert (stats["summary_errors"], stats["summary_dropped"]) == (3, 1)
+    assert [m["content"] for m in await history.build_messages(1)] == [text(1), text(2), text(3)]
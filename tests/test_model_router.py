@@ -0,0 +1,109 @@
+import pytest
+
+import model_router
+from model_router import ModelRouter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(model_router.time, "monotonic", clock)
+    return clock
+
+
+def make_router():
+    return ModelRouter(
+        [{"name": "main"}, {"name": "backup"}, {"name": "eyes", "vision": True}],
+        failure_threshold=2, open_seconds=30, max_open_seconds=100,
+    )
+
+
+def breaker(router, name):
+    return next(m["breaker"] for m in router.stats() if m["name"] == name)
+
+
+def test_first_model_wins_ties_and_vision_is_respected(clock):
+    router = make_router()
+    assert router.choose() == "main"
+    assert router.choose(vision=True) == "eyes"
+    assert router.choose(exclude={"main"}) == "backup"
+
+
+def test_breaker_opens_after_threshold_of_overload_errors(clock):
+    router = make_router()
+    router.record_failure("main", 429)
+    assert breaker(router, "main") == "closed"
+    router.record_failure("main", 503)
+    assert breaker(router, "main") == "open"
+    assert router.choose() == "backup"
+
+
+def test_client_errors_do_not_open_breaker(clock):
+    router = make_router()
+    for _ in range(5):
+        router.record_failure("main", 400)
+    assert breaker(router, "main") == "closed"
+
+
+def test_half_open_probe_success_closes_breaker(clock):
+    router = make_router()
+    router.record_failure("main")
+    router.record_failure("main")
+    clock.now += 31
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+    assert breaker(router, "main") == "half-open"
+    # Пока проба не вернулась, модель больше никому не отдаётся
+    assert router.choose(exclude={"backup", "eyes"}) is None
+    router.record_success("main", 0.5)
+    assert breaker(router, "main") == "closed"
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+
+
+def test_half_open_probe_failure_reopens_with_backoff(clock):
+    router = make_router()
+    router.record_failure("main")
+    router.record_failure("main")
+    clock.now += 31
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+    router.record_failure("main", 502)
+    state = next(m for m in router.stats() if m["name"] == "main")
+    assert state["breaker"] == "open"
+    assert state["open_for"] == pytest.approx(60)
+
+
+def test_unreported_probe_lease_expires(clock):
+    router = make_router()
+    router.record_failure("main")
+    router.record_failure("main")
+    clock.now += 31
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+    clock.now += 31
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+
+
+def test_success_without_latency_closes_breaker_keeping_ewma(clock):
+    router = make_router()
+    router.record_success("main", 1.0)
+    router.record_failure("main")
+    router.record_failure("main")
+    clock.now += 31
+    assert router.choose(exclude={"backup", "eyes"}) == "main"
+    router.record_success("main")
+    state = next(m for m in router.stats() if m["name"] == "main")
+    assert state["breaker"] == "closed"
+    assert state["ewma_ttft"] == 1.0
+
+
+def test_no_model_when_all_capable_breakers_open(clock):
+    router = make_router()
+    for _ in range(2):
+        router.record_failure("eyes")
+    assert router.choose(vision=True) is None
@@ -0,0 +1,100 @@
+import asyncio
+
+from orders import APPROVED, CANCELLED, PENDING, PROCESSING, REJECTED, OrderStore
+
+
+async def test_new_order_replaces_pending_order_of_same_user(tmp_path, open_store):
+    store = await open_store(OrderStore, tmp_path / "orders.db")
+    first = await store.create(1, "alice", "1 месяц", 30, 599)
+    second = await store.create(1, "alice", "3 месяца", 90, 1797)
+    assert (await store.get(first["id"]))["status"] == CANCELLED
+    assert second["status"] == PENDING
+    counts = await store.count_by_status()
+    assert counts[PENDING] == 1 and counts[CANCELLED] == 1
+    await store.close()
+
+
+async def test_concurrent_claimers_get_disjoint_orders(tmp_path, open_store):
+    path = tmp_path / "orders.db"
+    first, second = await open_store(OrderStore, path), await open_store(OrderStore, path)
+    ids = [(await first.create(uid, f"user{uid}", "1 месяц", 30, 599))["id"] for uid in range(1, 41)]
+    claims = await asyncio.gather(
+        *(store.claim(ids, admin_id) for store, admin_id in ((first, 100), (second, 200)) for _ in range(5))
+    )
+    claimed = [order["id"] for claim in claims for order in claim]
+    assert sorted(claimed) == ids  # каждая заявка досталась ровно одному
+    assert (await first.count_by_status())[PROCESSING] == 40
+    await first.close()
+    await second.close()
+
+
+async def test_one_order_per_user_in_processing(tmp_path, open_store):
+    store = await open_store(OrderStore, tmp_path / "orders.db")
+    first = await store.create(1, "alice", "1 месяц", 30, 599)
+    other = await store.create(2, "bob", "1 месяц", 30, 599)
+    assert [o["id"] for o in await store.claim([first["id"]], 100)] == [first["id"]]
+    # Покупатель оплатил ещё раз, пока первая заявка выдаётся
+    second = await store.create(1, "alice", "1 месяц", 30, 599)
+    claimed = await store.claim([second["id"], other["id"]], 200)
+    assert [o["id"] for o in claimed] == [other["id"]]
+    assert (await store.get(second["id"]))["status"] == PENDING
+
+    await store.finish([(first["id"], APPROVED, None), (other["id"], REJECTED, None)])
+    claimed = await store.claim([second["id"]], 100)
+    assert [o["id"] for o in claimed] == [second["id"]]
+    await store.close()
+
+
+async def test_finish_and_recover(tmp_path, open_store):
+    path = tmp_path / "orders.db"
+    store = await open_store(OrderStore, path)
+    ids = [(await store.create(uid, f"user{uid}", "1 месяц", 30, 599))["id"] for uid in (1, 2, 3)]
+    await store.claim(ids, 100)
+    await store.finish([(ids[0], APPROVED, None), (ids[1], PENDING, "pool empty")])
+    await store.close()
+
+    # Процесс упал, не записав исход третьей заявки
+    store = await open_store(OrderStore, path)
+    assert await store.recover() == 1
+    assert [(await store.get(order_id))["status"] for order_id in ids] == [APPROVED, PENDING, PENDING]
+    assert (await store.get(ids[1]))["error"] == "pool empty"
+    page, has_prev, has_next = await store.page(PENDING)
+    assert [o["id"] for o in page] == ids[1:] and not has_prev and not has_next
+    await store.close()
+
+
+async def test_finish_ignores_orders_not_in_processing(tmp_path, open_store):
+    store = await open_store(OrderStore, tmp_path / "orders.db")
+    order = await store.create(1, "alice", "1 месяц", 30, 599)
+    await store.finish([(order["id"], APPROVED, None)])
+    assert (await store.get(order["id"]))["status"] == PENDING
+    await store.close()
+
+
+async def test_page_cursors(tmp_path, open_store):
+    store = await open_store(OrderStore, tmp_path / "orders.db")
+    ids = [(await store.create(uid, f"user{uid}", "1 месяц", 30, 599))["id"] for uid in range(1, 8)]
+    first = await store.page(PENDING, limit=3)
+    second = await store.page(PENDING, after=first[0][-1]["id"], limit=3)
+    back = await store.page(PENDING, before=second[0][0]["id"], limit=3)
+    assert [o["id"] for o in first[0]] == ids[:3] and first[1:] == (False, True)
+    assert [o["id"] for o in second[0]] == ids[3:6] and second[1:] == (True, True)
+    assert [o["id"] for o in back[0]] == ids[:3] and back[1] is False
+    await store.close()
+
+
+async def test_buyer_cancels_only_own_pending_order(tmp_path, open_store):
+    store = await open_store(OrderStore, tmp_path / "orders.db")
+    order = await store.create(1, "alice", "1 месяц", 30, 599)
+    taken = await store.create(2, "bob", "1 месяц", 30, 599)
+    await store.claim([taken["id"]], 100)
+    results = (
+        await store.cancel(order["id"], 2),  # чужая заявка
+        await store.cancel(taken["id"], 2),  # уже в обработке
+        await store.cancel(order["id"], 1),
+        await store.cancel(order["id"], 1),
+    )
+    assert results == (False, False, True, False)
+    page, _, _ = await store.page(PENDING)
+    assert page == [] and store.stats()["cancelled"] == 1
+    await store.close()
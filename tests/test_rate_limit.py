@@ -0,0 +1,42 @@
+import asyncio
+
+from rate_limit import TokenBucket
+
+
+async def test_burst_up_to_capacity_then_rate():
+    loop = asyncio.get_running_loop()
+    bucket = TokenBucket(rate=20, capacity=5)
+    started = loop.time()
+    for _ in range(5):
+        await bucket.acquire()
+    assert loop.time() - started < 0.05
+    for _ in range(4):
+        await bucket.acquire()
+    # Четыре токена сверх ёмкости при 20 токенах в секунду
+    assert 0.18 <= loop.time() - started < 0.5
+
+
+async def test_waiters_are_served_in_order():
+    bucket = TokenBucket(rate=50, capacity=1)
+    order = []
+
+    async def take(n):
+        await bucket.acquire()
+        order.append(n)
+
+    tasks = []
+    for n in range(6):
+        tasks.append(asyncio.create_task(take(n)))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    assert order == list(range(6))
+
+
+async def test_pause_blocks_everyone():
+    loop = asyncio.get_running_loop()
+    bucket = TokenBucket(rate=1000, capacity=10)
+    await bucket.acquire()
+    bucket.pause(0.2)
+    started = loop.time()
+    await asyncio.gather(bucket.acquire(), bucket.acquire())
+    assert 0.19 <= loop.time() - started < 0.5
@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from sse import SSEDecoder, SSEStreamError, iter_openrouter_deltas
+
+STREAM = (
+    "﻿: OPENROUTER PROCESSING\r\n\r\n"
+    'data: {"choices": [{"delta": {"content": "Привет"}}]}\r\n\r\n'
+    "event: note\nid: 7\nretry: 1500\ndata: первая\ndata: вторая 🙂\n\n"
+    "data: cr-only\r\r"
+    "data: tail"
+).encode()
+
+
+def decode(chunks):
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    return events + decoder.close()
+
+
+def test_whole_stream():
+    events = decode([STREAM])
+    assert [e.data for e in events] == [
+        '{"choices": [{"delta": {"content": "Привет"}}]}',
+        "первая\nвторая 🙂",
+        "cr-only",
+        "tail",
+    ]
+    note = events[1]
+    assert (note.event, note.id, note.retry) == ("note", "7", 1500)
+    assert events[0].event == "message"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7])
+def test_chunk_boundaries_do_not_change_events(size):
+    chunks = [STREAM[i:i + size] for i in range(0, len(STREAM), size)]
+    assert decode(chunks) == decode([STREAM])
+
+
+def test_every_single_split_point():
+    expected = decode([STREAM])
+    for i in range(1, len(STREAM)):
+        assert decode([STREAM[:i], STREAM[i:]]) == expected, i
+
+
+async def collect_deltas(lines):
+    async def chunks():
+        for line in lines:
+            yield line.encode()
+
+    return [delta async for delta in iter_openrouter_deltas(chunks())]
+
+
+async def test_openrouter_deltas_stop_at_done():
+    body = "".join(
+        f"data: {json.dumps({'choices': [{'delta': {'content': token}}]})}\n\n" for token in ("a", "b")
+    ) + "data: [DONE]\n\ndata: {\"choices\": [{\"delta\": {\"content\": \"late\"}}]}\n\n"
+    # Разрезаем посреди JSON, как это бывает у TCP-сегментов
+    assert await collect_deltas([body[:17], body[17:40], body[40:]]) == [{"content": "a"}, {"content": "b"}]
+
+
+async def test_openrouter_error_event_raises():
+    with pytest.raises(SSEStreamError, match="overloaded"):
+        await collect_deltas(['data: {"error": {"message": "overloaded"}}\n\n'])
@@ -0,0 +1,28 @@
+import pytest
+
+from sqlite_user_store import SQLiteUserStore
+from user_store import UserStore
+
+USERS = {101: "alice", 1012: "bob", 2101: "albert", 30: "carol"}
+
+
+async def search_both(tmp_path, open_store, query):
+    results = []
+    for store_cls, name in ((UserStore, "users.json"), (SQLiteUserStore, "users.db")):
+        store = await open_store(store_cls, tmp_path / name)
+        for uid, username in USERS.items():
+            await store.ensure_user(uid, username)
+        results.append(sorted(uid for uid, _ in await store.search_users(query)))
+        await store.close()
+    return results
+
+
+@pytest.mark.parametrize("query", ["10", "101", "al", "@Bob", "0", "01", "3"])
+async def test_backends_agree_on_search(tmp_path, open_store, query):
+    memory, sqlite = await search_both(tmp_path, open_store, query)
+    assert memory == sqlite
+
+
+async def test_zero_prefix_matches_nothing(tmp_path, open_store):
+    memory, sqlite = await search_both(tmp_path, open_store, "0")
+    assert memory == sqlite == []
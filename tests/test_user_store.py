@@ -0,0 +1,64 @@
+import json
+
+from user_store import JournaledUserStore
+
+
+async def test_journal_replay_restores_mutations(tmp_path, open_store):
+    path = tmp_path / "users.json"
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    await store.ensure_user(1, "alice")
+    await store.update_user(1, gpt_access=True)
+    await store.block_user(2)
+    await store.close()
+
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    assert store.replayed_records == 3
+    assert (await store.get_user(1)) == {"username": "alice", "gpt_access": True}
+    assert await store.is_blocked(2)
+    await store.close()
+
+
+async def test_torn_journal_line_is_truncated_before_next_append(tmp_path, open_store):
+    path = tmp_path / "users.json"
+    journal = tmp_path / "users.json.journal"
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    await store.ensure_user(1, "alice")
+    await store.close()
+
+    # Сбой посреди записи: последняя строка оборвана
+    with open(journal, "ab") as f:
+        f.write(b'{"op": "set", "user": "2", "fie')
+
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    assert await store.get_user(2) is None
+    await store.ensure_user(3, "carol")
+    await store.close()
+
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    assert (await store.get_user(3)) == {"username": "carol", "gpt_access": False}
+    assert (await store.get_user(1)) == {"username": "alice", "gpt_access": False}
+    assert store.replayed_records == 2
+    await store.close()
+    assert journal.read_bytes().endswith(b"\n")
+
+
+async def test_compaction_folds_journal_into_snapshot(tmp_path, open_store):
+    path = tmp_path / "users.json"
+    journal = tmp_path / "users.json.journal"
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01, compact_bytes=200)
+    for uid in range(10):
+        await store.ensure_user(uid, f"user{uid}")
+    await store.flush()
+    assert store.stats()["journal_bytes"] == 0
+    await store.update_user(5, gpt_access=True)
+    await store.close()
+
+    store = await open_store(JournaledUserStore, path, flush_interval=0.01)
+    assert store.replayed_records == 1
+    assert await store.count_users() == 10
+    assert (await store.get_user(5))["gpt_access"] is True
+    await store.close()
+
+    snapshot = json.loads(path.read_text(encoding="utf-8"))
+    assert len(snapshot["users"]) == 10
+    assert journal.stat().st_size < 200
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from rate_limit import TokenBucket
+from user_store import UserStore
+from vpn_expiry import EXPIRED_TEXT, NOTICE_FIELD, ExpiryScheduler
+
+
+def in_seconds(seconds):
+    return datetime.now() + timedelta(seconds=seconds)
+
+
+async def open_users(open_store, path, users):
+    store = await open_store(UserStore, path, flush_interval=0.01)
+    for user_id in users:
+        await store.ensure_user(user_id, f"user{user_id}")
+    return store
+
+
+def make_scheduler(store, bot, **options):
+    return ExpiryScheduler(store, bot, TokenBucket(1000), max_sleep=0.05, **options)
+
+
+async def test_reminders_then_revocation(tmp_path, open_store, fake_bot):
+    store = await open_users(open_store, tmp_path / "users.json", [1])
+    expired = []
+
+    async def on_expired(user_id):
+        expired.append(user_id)
+
+    scheduler = make_scheduler(store, fake_bot, reminders=(0.4, 0.2), on_expired=on_expired)
+    await scheduler.start()
+    await scheduler.set_expiry(1, in_seconds(0.6))
+    await asyncio.sleep(1.0)
+    await scheduler.close()
+
+    assert [chat_id for chat_id, _ in fake_bot.sent] == [1, 1, 1]
+    assert "меньше чем через сутки" in fake_bot.sent[0][1]
+    assert fake_bot.sent[-1][1] == EXPIRED_TEXT
+    assert expired == [1]
+    info = await store.get_user(1)
+    assert (info["vpn_access"], info["vpn_expires"], info[NOTICE_FIELD]) == (False, None, None)
+    assert scheduler.stats()["reminded"] == 2
+    assert scheduler.stats()["revoked"] == 1
+    assert scheduler.stats()["tracked"] == 0
+    await store.close()
+
+
+async def test_entries_fire_in_expiry_order(tmp_path, open_store, fake_bot):
+    store = await open_users(open_store, tmp_path / "users.json", [1, 2, 3])
+    scheduler = make_scheduler(store, fake_bot, reminders=())
+    for user_id, delay in ((1, 0.45), (2, 0.15), (3, 0.3)):
+        await store.update_user(user_id, vpn_access=True, vpn_expires=in_seconds(delay).isoformat())
+    # Начальная загрузка из хранилища, а не через schedule()
+    await scheduler.start()
+    assert scheduler.stats()["queued"] == 3
+    await asyncio.sleep(0.7)
+    await scheduler.close()
+
+    assert [chat_id for chat_id, _ in fake_bot.sent] == [2, 3, 1]
+    await store.close()
+
+
+async def test_extension_invalidates_old_entry(tmp_path, open_store, fake_bot):
+    store = await open_users(open_store, tmp_path / "users.json", [1])
+    scheduler = make_scheduler(store, fake_bot, reminders=(0.2,))
+    await scheduler.start()
+    await scheduler.set_expiry(1, in_seconds(0.3))
+    extended = await scheduler.set_expiry(1, in_seconds(60))
+    await asyncio.sleep(0.5)
+    await scheduler.close()
+
+    assert fake_bot.sent == []
+    info = await store.get_user(1)
+    assert (info["vpn_access"], info["vpn_expires"]) == (True, extended)
+    # Устаревшие записи кучи отброшены, осталась только запись продлённого срока
+    assert scheduler.stats()["queued"] == 1
+    assert scheduler.stats()["tracked"] == 1
+    await store.close()
+
+
+async def test_restart_does_not_repeat_sent_reminder(tmp_path, open_store, fake_bot):
+    store = await open_users(open_store, tmp_path / "users.json", [1, 2])
+    expires = in_seconds(3).isoformat()
+    # Напоминание за 5 секунд пропущено, пока бот был остановлен;
+    # пользователь 1 его уже получил до остановки
+    await store.update_user(1, vpn_access=True, vpn_expires=expires, **{NOTICE_FIELD: {"expires": expires, "stage": 1}})
+    await store.update_user(2, vpn_access=True, vpn_expires=expires)
+    scheduler = make_scheduler(store, fake_bot, reminders=(10, 5))
+    await scheduler.start()
+    await asyncio.sleep(0.2)
+    await scheduler.close()
+
+    assert [chat_id for chat_id, _ in fake_bot.sent] == [2]
+    assert (await store.get_user(2))[NOTICE_FIELD] == {"expires": expires, "stage": 1}
+    assert scheduler.stats()["queued"] == 2
+    await store.close()
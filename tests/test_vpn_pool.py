@@ -0,0 +1,80 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from vpn_pool import CredentialPool
+
+
+def make_pool(path, **options):
+    # Сеть /29: адреса .1–.6, сервер .1, клиентам остаётся пять
+    options.setdefault("size", 3)
+    return CredentialPool(str(path), "10.9.0.0/29", server_address="10.9.0.1", low_watermark=1, batch_size=3, **options)
+
+
+def saved_addresses(path):
+    if not path.exists():
+        return []
+    return sorted(entry["address"] for entry in json.loads(path.read_text(encoding="utf-8")))
+
+
+async def started(pool, issued_addresses=()):
+    """Start the pool and wait until it is full and saved."""
+    await pool.start(issued_addresses)
+    while pool.stats()["ready"] < pool.size or len(saved_addresses(Path(pool.path))) < pool.size:
+        await asyncio.sleep(0.01)
+    return pool
+
+
+async def test_taken_entry_stays_in_file_until_commit(tmp_path):
+    path = tmp_path / "vpn_pool.json"
+    pool = await started(make_pool(path, size=2))
+    credential = await pool.take()
+    await pool.close()
+    assert credential["address"] in saved_addresses(path)
+
+    await pool.commit(credential["address"])
+    assert credential["address"] not in saved_addresses(path)
+    assert pool.stats()["taken"] == 1
+
+
+async def test_restart_skips_entries_issued_before_crash(tmp_path):
+    path = tmp_path / "vpn_pool.json"
+    pool = await started(make_pool(path))
+    credential = await pool.take()
+    await pool.close()
+    # Сбой после записи в реестр, но до commit(): запись осталась в файле пула
+    ready = [address for address in saved_addresses(path) if address != credential["address"]]
+
+    pool = await started(make_pool(path), issued_addresses=[credential["address"]])
+    addresses = [(await pool.take())["address"] for _ in range(3)]
+    await pool.close()
+    assert credential["address"] not in addresses
+    assert addresses[:2] == ready
+
+
+async def test_restart_returns_uncommitted_entry_not_in_registry(tmp_path):
+    path = tmp_path / "vpn_pool.json"
+    pool = await started(make_pool(path))
+    credential = await pool.take()
+    await pool.close()
+
+    # Реестр не сохранён: адрес никому не выдан и снова готов к выдаче
+    pool = await started(make_pool(path))
+    taken = await pool.take()
+    await pool.close()
+    assert taken == credential
+
+
+async def test_addresses_are_unique_until_released(tmp_path):
+    pool = await started(make_pool(tmp_path / "vpn_pool.json", size=1))
+    await pool.close()  # дальше ключи генерируются только по запросу
+    addresses = [(await pool.take())["address"] for _ in range(5)]
+    assert sorted(addresses) == [f"10.9.0.{n}" for n in range(2, 7)]
+    assert pool.stats()["generated_on_demand"] == 4
+    with pytest.raises(RuntimeError):
+        await pool.take()
+
+    pool.release(addresses[2])
+    assert (await pool.take())["address"] == addresses[2]
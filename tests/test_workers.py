@@ -0,0 +1,27 @@
+from aiogram.types import Update
+
+from workers import WorkerSupervisor, shard_of
+
+
+def message_update(update_id, user_id):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": "hi",
+        },
+    })
+
+
+async def test_updates_go_to_user_shard_unless_pinned():
+    supervisor = WorkerSupervisor(print, workers=4, pinned={6: 0})
+    for update_id, user_id in enumerate((5, 6, 7, 5)):
+        await supervisor.dispatch(message_update(update_id, user_id))
+    sent = [worker.sent for worker in supervisor._workers]
+    assert sent[shard_of(5, 4)] == 2
+    assert sent[0] == 1  # закреплённый пользователь 6, а не shard_of(6) == 2
+    assert sent[shard_of(7, 4)] == 1
+    assert sent[shard_of(6, 4)] == 0
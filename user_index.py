@@ -0,0 +1,117 @@
+from bisect import bisect_left, bisect_right, insort
+
+# Списки пользователей, по которым листают админ-меню
+VIEWS = ("all", "gpt_on", "gpt_off", "blocked")
+
+
+def _remove(keys: list, key):
+    i = bisect_left(keys, key)
+    if i < len(keys) and keys[i] == key:
+        del keys[i]
+
+
+def _prefix_end(prefix: str) -> str:
+    """Smallest string greater than every string starting with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class UserIndex:
+    """
+    Sorted secondary indexes over the in-memory user records.
+
+    Keeps user IDs sorted per admin view (all users, with/without GPT
+    access, blocked) plus sorted username and ID-string keys for prefix
+    search. The indexes are rebuilt once after loading and then updated
+    incrementally on each mutation, so a page or a search costs
+    O(log n + page size) instead of a scan over all users.
+    """
+
+    def __init__(self):
+        self._views = {view: [] for view in VIEWS}
+        self._usernames = []
+        self._id_strings = []
+
+    def rebuild(self, users: dict, blocked: set):
+        self._views = {
+            "all": sorted(int(uid) for uid in users),
+            "gpt_on": sorted(int(uid) for uid, info in users.items() if info.get("gpt_access", False)),
+            "gpt_off": sorted(int(uid) for uid, info in users.items() if not info.get("gpt_access", False)),
+            "blocked": sorted(blocked),
+        }
+        self._usernames = sorted(
+            ((info.get("username") or "").lower(), int(uid)) for uid, info in users.items()
+        )
+        self._id_strings = sorted(users)
+
+    # --- Incremental updates ---
+    def update_user(self, uid: str, old: dict | None, new: dict):
+        user_id = int(uid)
+        if old is None:
+            insort(self._views["all"], user_id)
+            insort(self._id_strings, uid)
+        old_access = bool(old.get("gpt_access", False)) if old is not None else None
+        new_access = bool(new.get("gpt_access", False))
+        if old_access != new_access:
+            if old_access is not None:
+                _remove(self._views["gpt_on" if old_access else "gpt_off"], user_id)
+            insort(self._views["gpt_on" if new_access else "gpt_off"], user_id)
+        old_name = (old.get("username") or "").lower() if old is not None else None
+        new_name = (new.get("username") or "").lower()
+        if old_name != new_name:
+            if old_name is not None:
+                _remove(self._usernames, (old_name, user_id))
+            insort(self._usernames, (new_name, user_id))
+
+    def set_blocked(self, user_id: int, blocked: bool):
+        if blocked:
+            i = bisect_left(self._views["blocked"], user_id)
+            if i == len(self._views["blocked"]) or self._views["blocked"][i] != user_id:
+                self._views["blocked"].insert(i, user_id)
+        else:
+            _remove(self._views["blocked"], user_id)
+
+    # --- Queries ---
+    def page(self, view: str, after: int | None = None, before: int | None = None, limit: int = 10) -> tuple:
+        """
+        Return one page of user IDs of a view using keyset pagination.
+
+        Args:
+            view (str): One of VIEWS
+            after (int, optional): Return IDs greater than this one
+            before (int, optional): Return the last IDs smaller than this one
+            limit (int): Page size
+
+        Returns:
+            tuple: (ids, has_prev, has_next)
+        """
+        keys = self._views[view]
+        if before is not None:
+            end = bisect_left(keys, before)
+            start = max(0, end - limit)
+        else:
+            start = bisect_right(keys, after) if after is not None else 0
+            end = min(len(keys), start + limit)
+        return keys[start:end], start > 0, end < len(keys)
+
+    def count(self, view: str) -> int:
+        return len(self._views[view])
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Return up to ``limit`` user IDs whose username or ID starts with query."""
+        query = query.strip().lstrip("@").lower()
+        if not query:
+            return []
+        found = []
+        if query.isdigit():
+            i = bisect_left(self._id_strings, query)
+            end = _prefix_end(query)
+            while i < len(self._id_strings) and self._id_strings[i] < end and len(found) < limit:
+                found.append(int(self._id_strings[i]))
+                i += 1
+        i = bisect_left(self._usernames, (query, -1))
+        end = _prefix_end(query)
+        while i < len(self._usernames) and self._usernames[i][0] < end and len(found) < limit:
+            if self._usernames[i][1] not in found:
+                found.append(self._usernames[i][1])
+            i += 1
+        return found
@@ -0,0 +1,409 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from file_utils import atomic_write_json
+from sqlite_user_store import SQLiteUserStore
+from user_index import UserIndex
+
+
+def _uid(user_id) -> str:
+    """Normalize a Telegram user ID to the string key used in users.json."""
+    return str(int(user_id))
+
+
+class UserStore:
+    """
+    Long-lived in-memory user database backed by users.json.
+
+    The file is read once on start(). Handlers read and mutate the in-memory
+    records through the async methods below; mutations only mark the store
+    dirty, and a background task coalesces them into a single atomic rewrite
+    of the file (temp file + rename, done in a worker thread) at most once
+    per flush interval. close() always performs a final flush.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 1.0, on_timing=None):
+        """
+        Args:
+            path (str): Path to the JSON database file
+            flush_interval (float): Minimum delay in seconds between two writes
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every file operation, e.g. to feed metrics
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.on_timing = on_timing
+        self._users = {}
+        self._blocked = set()
+        self._index = UserIndex()
+        self._dirty = asyncio.Event()
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    # --- Lifecycle ---
+    async def start(self):
+        """Load the database from disk and start the background flusher."""
+        data = await self._to_thread(self._read_file)
+        self._users = data.get("users", {})
+        self._blocked = {int(uid) for uid in data.get("blocked", [])}
+        self._index.rebuild(self._users, self._blocked)
+        logging.info(f"User store loaded: {len(self._users)} users, {len(self._blocked)} blocked")
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the background flusher and write any pending changes."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _to_thread(self, func, *args):
+        if self.on_timing is None:
+            return await asyncio.to_thread(func, *args)
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(func, *args)
+        finally:
+            self.on_timing(func.__name__.lstrip("_"), time.perf_counter() - started)
+
+    def _read_file(self) -> dict:
+        try:
+            if not os.path.exists(self.path):
+                return {"users": {}, "blocked": []}
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logging.error(f"Error loading users: {e}")
+            return {"users": {}, "blocked": []}
+
+    # --- Persistence ---
+    def _apply(self, record: dict):
+        """Apply a mutation record to the in-memory state."""
+        op = record["op"]
+        if op == "set":
+            uid = record["user"]
+            old = self._users.get(uid)
+            old_copy = dict(old) if old is not None else None
+            info = self._users.setdefault(uid, {})
+            info.update(record["fields"])
+            self._index.update_user(uid, old_copy, info)
+        elif op == "block":
+            self._blocked.add(int(record["user"]))
+            self._index.set_blocked(int(record["user"]), True)
+        elif op == "unblock":
+            self._blocked.discard(int(record["user"]))
+            self._index.set_blocked(int(record["user"]), False)
+
+    def _commit(self, record: dict):
+        """Apply a mutation and schedule it for persistence."""
+        self._apply(record)
+        self._dirty.set()
+
+    def _snapshot(self) -> dict:
+        # Copy on the event loop so the writer thread never sees a dict that
+        # is being mutated by a handler.
+        return {
+            "users": {uid: dict(info) for uid, info in self._users.items()},
+            "blocked": sorted(self._blocked),
+        }
+
+    def _write_file(self, data: dict):
+        atomic_write_json(self.path, data, ensure_ascii=False, indent=2)
+
+    async def flush(self):
+        """Write the database to disk now if there are unsaved changes."""
+        async with self._write_lock:
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            snapshot = self._snapshot()
+            try:
+                await self._to_thread(self._write_file, snapshot)
+            except Exception as e:
+                logging.error(f"Error saving users: {e}")
+                self._dirty.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            # Give other mutations a chance to pile up into the same write
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    # --- Queries ---
+    async def get_user(self, user_id) -> dict | None:
+        """Return a copy of the user record or None if the user is unknown."""
+        info = self._users.get(_uid(user_id))
+        return dict(info) if info is not None else None
+
+    async def list_users(self, gpt_access: bool | None = None) -> list:
+        """
+        Return (user_id, record) pairs, optionally filtered by GPT access.
+
+        Args:
+            gpt_access (bool, optional): Only return users with this access flag
+        """
+        if gpt_access is None:
+            return [(uid, dict(info)) for uid, info in self._users.items()]
+        return [
+            (uid, dict(info)) for uid, info in self._users.items()
+            if info.get("gpt_access", False) == gpt_access
+        ]
+
+    async def list_vpn_expiring(self, before: str | None = None) -> list:
+        """
+        Return (user_id, vpn_expires) pairs ordered by expiry time.
+
+        Args:
+            before (str, optional): Only return expiries earlier than this ISO timestamp
+        """
+        result = [
+            (uid, info["vpn_expires"]) for uid, info in self._users.items()
+            if info.get("vpn_expires") and (before is None or info["vpn_expires"] < before)
+        ]
+        result.sort(key=lambda item: item[1])
+        return result
+
+    async def page_users(self, view: str, after=None, before=None, limit: int = 10) -> tuple:
+        """
+        Return one page of an admin user list.
+
+        Args:
+            view (str): "all", "gpt_on", "gpt_off" or "blocked"
+            after (int, optional): Cursor — return users with greater IDs
+            before (int, optional): Cursor — return the users right before this ID
+            limit (int): Page size
+
+        Returns:
+            tuple: (list of (user_id, record), has_prev, has_next)
+        """
+        ids, has_prev, has_next = self._index.page(view, after=after, before=before, limit=limit)
+        return [(str(uid), dict(self._users.get(str(uid), {}))) for uid in ids], has_prev, has_next
+
+    async def search_users(self, query: str, limit: int = 10) -> list:
+        """Return (user_id, record) pairs whose username or ID starts with query."""
+        return [
+            (str(uid), dict(self._users[str(uid)]))
+            for uid in self._index.search(query, limit=limit)
+        ]
+
+    async def is_blocked(self, user_id) -> bool:
+        return int(user_id) in self._blocked
+
+    async def blocked_ids(self) -> set:
+        return set(self._blocked)
+
+    async def count_users(self) -> int:
+        return len(self._users)
+
+    async def count_blocked(self) -> int:
+        return len(self._blocked)
+
+    # --- Mutations ---
+    async def ensure_user(self, user_id, username: str) -> dict:
+        """
+        Register a user if they are not in the database yet.
+
+        Returns:
+            dict: Copy of the (possibly new) user record
+        """
+        uid = _uid(user_id)
+        if uid not in self._users:
+            self._commit({"op": "set", "user": uid, "fields": {"username": username, "gpt_access": False}})
+        return dict(self._users[uid])
+
+    async def update_user(self, user_id, **fields) -> bool:
+        """
+        Update fields of an existing user record.
+
+        Returns:
+            bool: False if the user does not exist
+        """
+        uid = _uid(user_id)
+        if uid not in self._users:
+            return False
+        self._commit({"op": "set", "user": uid, "fields": fields})
+        return True
+
+    async def block_user(self, user_id) -> bool:
+        """Block a user. Returns False if the user was already blocked."""
+        user_id = int(user_id)
+        if user_id in self._blocked:
+            return False
+        self._commit({"op": "block", "user": user_id})
+        return True
+
+    async def unblock_user(self, user_id) -> bool:
+        """Unblock a user. Returns False if the user was not blocked."""
+        user_id = int(user_id)
+        if user_id not in self._blocked:
+            return False
+        self._commit({"op": "unblock", "user": user_id})
+        return True
+
+
+class JournaledUserStore(UserStore):
+    """
+    User store that persists mutations to an append-only journal.
+
+    Every mutation is written as one JSON line to ``<path>.journal``, so the
+    cost of a write is proportional to the change rather than to the size of
+    the database. Records from the same flush interval are appended and
+    fsync'ed together. On start the snapshot (users.json) is loaded and the
+    journal is replayed on top of it; once the journal grows past
+    ``compact_bytes`` it is folded into a fresh snapshot in the background
+    and truncated, which keeps the replay (and so the recovery time) bounded.
+
+    Records are idempotent ("set these fields", "block", "unblock"), so
+    replaying a record that is already contained in the snapshot is harmless.
+    This is what makes a crash between writing the snapshot and truncating
+    the journal safe.
+    """
+
+    def __init__(
+        self, path: str, flush_interval: float = 0.05, compact_bytes: int = 4 * 1024 * 1024, on_timing=None
+    ):
+        """
+        Args:
+            path (str): Path to the JSON snapshot file
+            flush_interval (float): Group commit delay for journal appends
+            compact_bytes (int): Journal size that triggers compaction
+            on_timing (callable, optional): ``on_timing(operation, seconds)`` called
+                after every file operation
+        """
+        super().__init__(path, flush_interval=flush_interval, on_timing=on_timing)
+        self.journal_path = f"{path}.journal"
+        self.compact_bytes = compact_bytes
+        self._pending = []
+        self._journal_size = 0
+        self.recovery_seconds = 0.0
+        self.replayed_records = 0
+
+    async def start(self):
+        """Load the snapshot, replay the journal and start the background writer."""
+        started = time.perf_counter()
+        data = await self._to_thread(self._read_file)
+        self._users = data.get("users", {})
+        self._blocked = {int(uid) for uid in data.get("blocked", [])}
+        self._index.rebuild(self._users, self._blocked)
+        records = await self._to_thread(self._read_journal)
+        for record in records:
+            self._apply(record)
+        self.replayed_records = len(records)
+        self.recovery_seconds = time.perf_counter() - started
+        logging.info(
+            f"User store recovered: {len(self._users)} users, "
+            f"{self.replayed_records} journal records replayed in {self.recovery_seconds:.3f}s"
+        )
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _read_journal(self) -> list:
+        records = []
+        if not os.path.exists(self.journal_path):
+            return records
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        # Everything after the last newline is a torn record from a crash
+        # mid-append. Cut it off, otherwise the next append would continue
+        # that line and the first new record would be lost on the next replay.
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logging.error(
+                f"Discarding torn journal record in {self.journal_path} ({len(data) - complete} bytes)"
+            )
+            with open(self.journal_path, "r+b") as f:
+                f.truncate(complete)
+                f.flush()
+                os.fsync(f.fileno())
+        for line in data[:complete].splitlines():
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                logging.error(f"Skipping corrupt journal record in {self.journal_path}")
+        self._journal_size = complete
+        return records
+
+    def _commit(self, record: dict):
+        self._apply(record)
+        self._pending.append(record)
+        self._dirty.set()
+
+    def _append_journal(self, lines: str) -> int:
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+            return f.tell()
+
+    def _truncate_journal(self):
+        with open(self.journal_path, "w", encoding="utf-8") as f:
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def flush(self):
+        """Append pending records to the journal and compact it if it grew too large."""
+        async with self._write_lock:
+            if self._pending:
+                records, self._pending = self._pending, []
+                self._dirty.clear()
+                lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+                try:
+                    self._journal_size = await self._to_thread(self._append_journal, lines)
+                except Exception as e:
+                    logging.error(f"Error appending to user journal: {e}")
+                    self._pending = records + self._pending
+                    self._dirty.set()
+                    return
+            if self._journal_size >= self.compact_bytes:
+                await self._compact()
+
+    async def _compact(self):
+        # Runs under _write_lock: new mutations keep accumulating in
+        # self._pending and are appended to the fresh journal afterwards.
+        started = time.perf_counter()
+        snapshot = self._snapshot()
+        try:
+            await self._to_thread(self._write_file, snapshot)
+            await self._to_thread(self._truncate_journal)
+        except Exception as e:
+            logging.error(f"Error compacting user journal: {e}")
+            return
+        self._journal_size = 0
+        logging.info(f"User journal compacted in {time.perf_counter() - started:.3f}s")
+
+    def stats(self) -> dict:
+        return {
+            "journal_bytes": self._journal_size,
+            "pending_records": len(self._pending),
+            "recovery_seconds": self.recovery_seconds,
+            "replayed_records": self.replayed_records,
+        }
+
+
+def create_user_store(backend: str, path: str, **options) -> UserStore:
+    """
+    Create the user store selected in the bot configuration.
+
+    Args:
+        backend (str): "json" (whole-file snapshots), "journal" (append-only log)
+            or "sqlite" (indexed SQLite database)
+        path (str): Path to the users database file
+        **options: Backend specific settings
+
+    Returns:
+        UserStore: Store instance, not started yet
+    """
+    if backend == "json":
+        return UserStore(path, **options)
+    if backend == "journal":
+        return JournaledUserStore(path, **options)
+    if backend == "sqlite":
+        return SQLiteUserStore(path, **options)
+    raise ValueError(f"Unknown user store backend: {backend}")
@@ -0,0 +1,297 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from rate_limit import TokenBucket
+
+# Поле записи пользователя: последний отправленный этап для текущего vpn_expires
+NOTICE_FIELD = "vpn_notice"
+
+EXPIRED_TEXT = (
+    "⌛ Подписка на VPN закончилась, доступ отключён.\n"
+    "Чтобы продлить её, нажмите «Купить VPN»."
+)
+
+
+def _parse(expires: str) -> datetime | None:
+    try:
+        return datetime.fromisoformat(expires)
+    except (TypeError, ValueError):
+        return None
+
+
+def _days(seconds: float) -> str:
+    days = round(seconds / 86400)
+    if days % 10 == 1 and days % 100 != 11:
+        return f"{days} день"
+    if days % 10 in (2, 3, 4) and days % 100 not in (12, 13, 14):
+        return f"{days} дня"
+    return f"{days} дней"
+
+
+class ExpiryScheduler:
+    """
+    Renewal reminders and revocation of expiring VPN subscriptions.
+
+    Every subscription has one entry in a min-heap keyed by the time of its
+    next stage: a reminder ``reminders[i]`` seconds before expiry, or the
+    expiry itself, which revokes ``vpn_access``. The heap is built once from
+    ``list_vpn_expiring()`` at start and updated by schedule() whenever an
+    expiry is set or extended, so a tick only touches entries that are due.
+    Entries are invalidated lazily: a due entry whose expiry no longer
+    matches the latest known one is dropped.
+
+    The stage reached is saved in the user record, so a restart neither
+    repeats reminders nor loses the one that fell due while the bot was
+    down. Revocation clears ``vpn_expires``, so lapsed subscriptions are not
+    loaded again. Messages take tokens from the shared TokenBucket.
+    """
+
+    def __init__(
+        self,
+        user_store,
+        bot: Bot,
+        limiter: TokenBucket,
+        reminders: tuple = (3 * 86400, 86400),
+        batch_size: int = 50,
+        max_sleep: float = 60.0,
+        resync_interval: float | None = None,
+        on_expired=None,
+    ):
+        """
+        Args:
+            user_store: User store holding ``vpn_access`` and ``vpn_expires``
+            bot (Bot): Bot instance used for sending
+            limiter (TokenBucket): Shared limiter for outgoing messages
+            reminders (tuple): Seconds before expiry to send reminders at
+            batch_size (int): Due entries processed concurrently
+            max_sleep (float): Longest sleep between ticks (clock changes, resync)
+            resync_interval (float, optional): Reload the expiries due soon from the
+                store this often; needed when other processes change them
+            on_expired: Optional ``async on_expired(user_id)`` called after revocation
+        """
+        self.user_store = user_store
+        self.bot = bot
+        self.limiter = limiter
+        self.reminders = tuple(sorted(reminders, reverse=True))
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self.resync_interval = resync_interval
+        self.on_expired = on_expired
+        self._heap = []  # (fire_at, user_id, expires, stage)
+        self._expires = {}  # user_id -> latest known vpn_expires
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._reminded = 0
+        self._revoked = 0
+        self._failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- Public API ---
+    async def start(self):
+        """Load the expiries from the store and start the scheduler."""
+        if self.running:
+            return
+        await self._load()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def schedule(self, user_id, expires: str):
+        """
+        Track a new or extended expiry; call after saving it in the user record.
+
+        Args:
+            user_id: Telegram user ID
+            expires (str): New ``vpn_expires`` (ISO timestamp)
+        """
+        user_id = int(user_id)
+        if self._push(user_id, expires, time.time()):
+            self._wakeup.set()
+
+    async def set_expiry(self, user_id, expires: datetime) -> str:
+        """
+        Grant or extend VPN access until ``expires`` and schedule its reminders.
+
+        Returns:
+            str: The saved ``vpn_expires``
+        """
+        value = expires.isoformat()
+        await self.user_store.update_user(user_id, vpn_access=True, vpn_expires=value, **{NOTICE_FIELD: None})
+        self.schedule(user_id, value)
+        return value
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._expires),
+            "queued": len(self._heap),
+            "next_in": max(0.0, self._heap[0][0] - time.time()) if self._heap else None,
+            "reminded": self._reminded,
+            "revoked": self._revoked,
+            "failed": self._failed,
+        }
+
+    # --- Heap ---
+    def _stage_time(self, expires_at: float, stage: int) -> float:
+        if stage < len(self.reminders):
+            return expires_at - self.reminders[stage]
+        return expires_at
+
+    def _first_stage(self, expires_at: float, now: float) -> int:
+        """The last stage already due (a reminder missed while stopped), else the next one."""
+        stage = 0
+        while stage < len(self.reminders) and self._stage_time(expires_at, stage + 1) <= now:
+            stage += 1
+        return stage
+
+    def _push(self, user_id: int, expires: str, now: float, stage: int | None = None) -> bool:
+        parsed = _parse(expires)
+        if parsed is None:
+            logging.error(f"Invalid vpn_expires of user {user_id}: {expires!r}")
+            return False
+        expires_at = parsed.timestamp()
+        if stage is None:
+            stage = self._first_stage(expires_at, now)
+        self._expires[user_id] = expires
+        heapq.heappush(self._heap, (self._stage_time(expires_at, stage), user_id, expires, stage))
+        return True
+
+    async def _load(self):
+        now = time.time()
+        self._heap = []
+        self._expires = {}
+        for uid, expires in await self.user_store.list_vpn_expiring():
+            parsed = _parse(expires)
+            if parsed is None:
+                logging.error(f"Invalid vpn_expires of user {uid}: {expires!r}")
+                continue
+            expires_at = parsed.timestamp()
+            stage = self._first_stage(expires_at, now)
+            self._expires[int(uid)] = expires
+            self._heap.append((self._stage_time(expires_at, stage), int(uid), expires, stage))
+        heapq.heapify(self._heap)
+        logging.info(f"VPN expiry scheduler: {len(self._heap)} subscriptions tracked")
+
+    async def _resync(self):
+        """Pick up expiries changed by other processes that fall due before the next resync."""
+        now = time.time()
+        lead = self.reminders[0] if self.reminders else 0
+        horizon = datetime.fromtimestamp(now + lead + self.resync_interval).isoformat()
+        for uid, expires in await self.user_store.list_vpn_expiring(before=horizon):
+            if self._expires.get(int(uid)) != expires:
+                self._push(int(uid), expires, now)
+
+    # --- Processing ---
+    async def _run(self):
+        next_resync = time.monotonic() + self.resync_interval if self.resync_interval else None
+        while True:
+            try:
+                if next_resync is not None and time.monotonic() >= next_resync:
+                    await self._resync()
+                    next_resync = time.monotonic() + self.resync_interval
+                now = time.time()
+                batch = []
+                while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                    batch.append(heapq.heappop(self._heap))
+                if batch:
+                    await asyncio.gather(*(self._fire(*entry[1:]) for entry in batch))
+                    continue
+                delay = self.max_sleep
+                if self._heap:
+                    delay = min(delay, self._heap[0][0] - now)
+                if next_resync is not None:
+                    delay = min(delay, next_resync - time.monotonic())
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), max(delay, 0.0))
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error in VPN expiry scheduler: {e}")
+                await asyncio.sleep(self.max_sleep)
+
+    async def _fire(self, user_id: int, expires: str, stage: int):
+        if self._expires.get(user_id) != expires:
+            return  # срок продлён или отозван, запись устарела
+        try:
+            info = await self.user_store.get_user(user_id)
+            if not info or not info.get("vpn_access") or info.get("vpn_expires") != expires:
+                self._expires.pop(user_id, None)
+                return
+            notice = info.get(NOTICE_FIELD) or {}
+            already_done = notice.get("expires") == expires and notice.get("stage", -1) >= stage
+            if stage < len(self.reminders):
+                if not already_done:
+                    await self._remind(user_id, expires)
+                    await self.user_store.update_user(user_id, **{NOTICE_FIELD: {"expires": expires, "stage": stage}})
+                self._push(user_id, expires, time.time(), stage + 1)
+            else:
+                await self._revoke(user_id)
+        except Exception as e:
+            self._failed += 1
+            logging.error(f"Failed to process VPN expiry of user {user_id}: {e}")
+
+    async def _remind(self, user_id: int, expires: str):
+        left = _parse(expires).timestamp() - time.time()
+        when = f"через {_days(left)}" if left >= 86400 else "меньше чем через сутки"
+        text = (
+            f"⏳ Подписка на VPN заканчивается {expires[:10]} ({when}).\n"
+            "Чтобы продлить её, нажмите «Купить VPN»."
+        )
+        if await self._send(user_id, text):
+            self._reminded += 1
+
+    async def _revoke(self, user_id: int):
+        await self.user_store.update_user(user_id, vpn_access=False, vpn_expires=None, **{NOTICE_FIELD: None})
+        self._expires.pop(user_id, None)
+        self._revoked += 1
+        logging.info(f"VPN access of user {user_id} expired")
+        if self.on_expired is not None:
+            try:
+                await self.on_expired(user_id)
+            except Exception as e:
+                logging.error(f"Error in VPN expiry hook for user {user_id}: {e}")
+        await self._send(user_id, EXPIRED_TEXT)
+
+    async def _send(self, chat_id: int, text: str, max_retries: int = 3) -> bool:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except TelegramRetryAfter as e:
+                self.limiter.pause(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                logging.info(f"VPN notice to {chat_id} not delivered: {e}")
+                return False
+            except (TelegramNetworkError, TelegramServerError) as e:
+                attempt += 1
+                if attempt > max_retries:
+                    logging.error(f"VPN notice to {chat_id} failed after {attempt} attempts: {e}")
+                    return False
+                await asyncio.sleep(min(30, 2 ** attempt))
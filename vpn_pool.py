@@ -0,0 +1,339 @@
+import asyncio
+import base64
+import ipaddress
+import json
+import logging
+import os
+import secrets
+from collections import deque
+
+from file_utils import atomic_write_json
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, PublicFormat
+except ImportError:  # cryptography is optional: without it keys are derived in pure Python
+    X25519PrivateKey = None
+
+# Curve25519 (RFC 7748)
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_POINT = (9).to_bytes(32, "little")
+
+
+def _x25519(scalar: bytes, point: bytes) -> bytes:
+    """X25519 scalar multiplication (RFC 7748, section 5)."""
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    n = int.from_bytes(k, "little")
+    x1 = int.from_bytes(point, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (n >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a = x2 + z2
+        aa = a * a % _P
+        b = x2 - z2
+        bb = b * b % _P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, x3, z2, z3 = x3, x2, z3, z2
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def generate_keypair() -> tuple:
+    """
+    Generate a WireGuard key pair.
+
+    Returns:
+        tuple: (private_key, public_key), base64 like ``wg genkey`` / ``wg pubkey``
+    """
+    if X25519PrivateKey is not None:
+        key = X25519PrivateKey.generate()
+        private = key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+        public = key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    else:
+        private = bytearray(secrets.token_bytes(32))
+        # Clamped like ``wg genkey`` does, so the stored key is canonical
+        private[0] &= 248
+        private[31] = (private[31] & 127) | 64
+        private = bytes(private)
+        public = _x25519(private, _BASE_POINT)
+    return base64.b64encode(private).decode(), base64.b64encode(public).decode()
+
+
+def render_config(credential: dict, server: dict) -> str:
+    """
+    Build the wg-quick config of a client.
+
+    Args:
+        credential (dict): Pool entry (private_key, preshared_key, address)
+        server (dict): endpoint, public_key, dns, allowed_ips, keepalive
+
+    Returns:
+        str: Contents of the .conf file
+    """
+    lines = [
+        "[Interface]",
+        f"PrivateKey = {credential['private_key']}",
+        f"Address = {credential['address']}/32",
+    ]
+    if server.get("dns"):
+        lines.append(f"DNS = {server['dns']}")
+    lines += [
+        "",
+        "[Peer]",
+        f"PublicKey = {server['public_key']}",
+        f"PresharedKey = {credential['preshared_key']}",
+        f"Endpoint = {server['endpoint']}",
+        f"AllowedIPs = {server.get('allowed_ips', '0.0.0.0/0, ::/0')}",
+    ]
+    if server.get("keepalive"):
+        lines.append(f"PersistentKeepalive = {server['keepalive']}")
+    return "\n".join(lines) + "\n"
+
+
+async def _wg(*args, input: bytes | None = None):
+    process = await asyncio.create_subprocess_exec(
+        "wg", *args,
+        stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await process.communicate(input)
+    if process.returncode != 0:
+        raise RuntimeError(f"wg {' '.join(args[:4])} failed: {stderr.decode().strip()}")
+
+
+async def add_peer(interface: str, credential: dict):
+    """
+    Add the client as a peer of the local WireGuard interface (``wg set``).
+
+    Idempotent: an existing peer with the same public key is updated. The
+    change is not written to the wg-quick config; the bot adds the peers
+    of all issued configs again at start.
+
+    Args:
+        interface (str): WireGuard interface, e.g. "wg0"
+        credential (dict): Pool entry (public_key, preshared_key, address)
+    """
+    await _wg(
+        "set", interface, "peer", credential["public_key"],
+        "preshared-key", "/dev/stdin", "allowed-ips", f"{credential['address']}/32",
+        input=credential["preshared_key"].encode(),
+    )
+
+
+async def remove_peer(interface: str, public_key: str):
+    """Remove a client peer from the local WireGuard interface."""
+    await _wg("set", interface, "peer", public_key, "remove")
+
+
+def _load_json(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class CredentialPool:
+    """
+    Pool of pre-generated WireGuard client credentials.
+
+    Each entry is a key pair, a preshared key and a free address of the VPN
+    network. A background task keeps the pool between ``low_watermark`` and
+    ``size`` entries, generating keys in a thread, so a grant only pops an
+    entry. The pool is saved to disk (atomically, after every change) so an
+    entry is never handed out twice and keys survive restarts; the file
+    holds private keys and is created with owner-only permissions.
+
+    A taken entry stays in the pool file until commit(): the caller records
+    the credential as issued first and then commits it, so a crash in
+    between can't lose an address (start() skips saved entries whose
+    address is already issued). Addresses of issued configs are passed to
+    start() and returned with release() when a subscription ends.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        network: str,
+        server_address: str | None = None,
+        size: int = 50,
+        low_watermark: int = 20,
+        batch_size: int = 10,
+    ):
+        """
+        Args:
+            path (str): Path of the pool file
+            network (str): VPN network the client addresses are taken from, e.g. "10.8.0.0/16"
+            server_address (str, optional): Address of the server, never handed out
+            size (int): Entries to keep ready
+            low_watermark (int): Refill when fewer entries are left
+            batch_size (int): Entries generated (and saved) per refill step
+        """
+        self.path = path
+        self.network = ipaddress.ip_network(network)
+        self.server_address = ipaddress.ip_address(server_address) if server_address else None
+        self.size = size
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self._entries = deque()
+        self._held = {}  # address -> taken entry not committed yet
+        self._in_use = set()  # addresses of pool entries and issued configs
+        self._cursor = 1  # offset of the next address to try in the network
+        self._refill_needed = asyncio.Event()
+        self._save_lock = asyncio.Lock()
+        self._task = None
+        self._generated = 0
+        self._taken = 0
+        self._generated_on_demand = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    # --- Public API ---
+    async def start(self, issued_addresses=()):
+        """
+        Load the saved pool and start refilling it.
+
+        Args:
+            issued_addresses: Addresses of configs that are already issued
+        """
+        if self.running:
+            return
+        self._in_use = {ipaddress.ip_address(address) for address in issued_addresses}
+        if os.path.exists(self.path):
+            try:
+                saved = await asyncio.to_thread(_load_json, self.path)
+            except Exception as e:
+                logging.error(f"Failed to load VPN credential pool: {e}")
+                saved = []
+            for entry in saved:
+                address = ipaddress.ip_address(entry["address"])
+                if address in self._in_use:
+                    continue  # выдан до сбоя, но пул не успел сохраниться
+                self._in_use.add(address)
+                self._entries.append(entry)
+        self._refill_needed.set()
+        self._task = asyncio.create_task(self._refill_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def take(self) -> dict:
+        """
+        Take a credential for a new config.
+
+        Normally an O(1) pop from the pool; if the pool is empty a credential
+        is generated on the spot. Call commit() once the credential is
+        recorded as issued, or release() if it won't be issued.
+
+        Returns:
+            dict: private_key, public_key, preshared_key, address
+
+        Raises:
+            RuntimeError: If the VPN network has no free addresses left
+        """
+        if self._entries:
+            entry = self._entries.popleft()
+        else:
+            entry = await asyncio.to_thread(self._generate, self._allocate())
+            self._generated_on_demand += 1
+        self._held[entry["address"]] = entry
+        self._taken += 1
+        if len(self._entries) < self.low_watermark:
+            self._refill_needed.set()
+        return entry
+
+    async def commit(self, address: str):
+        """Remove a taken credential from the pool file; call after it is recorded as issued."""
+        self._held.pop(address, None)
+        await self._save()
+
+    def release(self, address: str):
+        """Return the address of a config that is no longer valid (or of a taken one that wasn't issued)."""
+        self._held.pop(address, None)
+        self._in_use.discard(ipaddress.ip_address(address))
+
+    def stats(self) -> dict:
+        return {
+            "ready": len(self._entries),
+            "size": self.size,
+            "generated": self._generated,
+            "taken": self._taken,
+            "generated_on_demand": self._generated_on_demand,
+            "addresses_in_use": len(self._in_use),
+            "addresses_total": self.network.num_addresses - 2 - (1 if self.server_address else 0),
+            "fast_keys": X25519PrivateKey is not None,
+        }
+
+    # --- Generation ---
+    def _allocate(self) -> str:
+        """Reserve the next free address of the network."""
+        total = self.network.num_addresses
+        first = self.network.network_address
+        for _ in range(total):
+            offset = self._cursor
+            self._cursor = self._cursor + 1 if self._cursor + 1 < total - 1 else 1
+            address = first + offset
+            if address == self.server_address or address in self._in_use:
+                continue
+            self._in_use.add(address)
+            return str(address)
+        raise RuntimeError(f"No free addresses left in {self.network}")
+
+    async def _save(self):
+        async with self._save_lock:
+            try:
+                entries = list(self._held.values()) + list(self._entries)
+                await asyncio.to_thread(atomic_write_json, self.path, entries)
+            except Exception as e:
+                logging.error(f"Failed to save VPN credential pool: {e}")
+
+    def _generate(self, address: str) -> dict:
+        private_key, public_key = generate_keypair()
+        self._generated += 1
+        return {
+            "private_key": private_key,
+            "public_key": public_key,
+            "preshared_key": base64.b64encode(secrets.token_bytes(32)).decode(),
+            "address": address,
+        }
+
+    async def _refill_loop(self):
+        while True:
+            await self._refill_needed.wait()
+            self._refill_needed.clear()
+            try:
+                while len(self._entries) < self.size:
+                    count = min(self.batch_size, self.size - len(self._entries))
+                    addresses = [self._allocate() for _ in range(count)]
+                    batch = await asyncio.to_thread(lambda: [self._generate(address) for address in addresses])
+                    self._entries.extend(batch)
+                    await self._save()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Failed to refill VPN credential pool: {e}")
+                await asyncio.sleep(60)
+                self._refill_needed.set()
@@ -0,0 +1,45 @@
+import json
+import logging
+import os
+
+from file_utils import atomic_write_json
+
+VPN_USERS_FILE = "vpn_users.json"
+
+
+def load_vpn_users(path: str = VPN_USERS_FILE) -> dict:
+    """
+    Load the registry of issued VPN configs.
+
+    Args:
+        path (str): Path to the registry file
+
+    Returns:
+        dict: user_id (str) -> credential (keys and address, see vpn_pool)
+            plus "expires", "granted_at" and "username"; empty if the file
+            does not exist or can't be read
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to load VPN users from {path}: {e}")
+        return {}
+
+
+def save_vpn_users(vpn_users: dict, path: str = VPN_USERS_FILE):
+    """
+    Save the registry of issued VPN configs atomically.
+
+    The registry holds the client keys (so a config can be sent again); the
+    file is created with owner-only permissions.
+
+    Blocking: call it through asyncio.to_thread from async code.
+
+    Args:
+        vpn_users (dict): Registry as returned by load_vpn_users
+        path (str): Path to the registry file
+    """
+    atomic_write_json(path, vpn_users, ensure_ascii=False, indent=2)
@@ -0,0 +1,150 @@
+import asyncio
+import hmac
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Receives Telegram updates over a webhook.
+
+    The handler only checks the secret token, parses the body and puts the
+    update on a bounded queue, so Telegram gets its 200 right away. A pool
+    of workers feeds queued updates to the dispatcher. When the queue is
+    full the request is answered with 503 and Telegram redelivers the update
+    later, which is the backpressure signal.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        path: str = "/webhook",
+        secret_token: str | None = None,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        queue_size: int = 1000,
+        workers: int = 16,
+    ):
+        """
+        Args:
+            bot (Bot): Bot instance passed to handlers
+            dp (Dispatcher): Dispatcher processing the updates
+            path (str): URL path of the webhook endpoint
+            secret_token (str, optional): Expected X-Telegram-Bot-Api-Secret-Token value
+            host (str): Interface to listen on
+            port (int): Port to listen on
+            queue_size (int): Updates buffered before answering 503
+            workers (int): Updates processed concurrently
+        """
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.app = web.Application()
+        self.app.router.add_post(path, self._handle)
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._runner = None
+        self._worker_tasks = []
+        self._received = 0
+        self._unauthorized = 0
+        self._rejected_full = 0
+        self._processed = 0
+        self._errors = 0
+        self._processing_time = 0.0
+
+    # --- Lifecycle ---
+    async def start(self, url: str | None = None):
+        """
+        Start the HTTP server and the workers.
+
+        Args:
+            url (str, optional): Public webhook URL to register with Telegram;
+                skipped when None (e.g. in the local benchmark)
+        """
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Webhook server listening on {self.host}:{self.port}{self.path}")
+        if url is not None:
+            await self.bot.set_webhook(
+                url,
+                secret_token=self.secret_token,
+                allowed_updates=self.dp.resolve_used_update_types(),
+            )
+            logging.info(f"Webhook registered: {url}")
+
+    async def close(self, drain_timeout: float = 10.0):
+        """Stop accepting updates, finish the queued ones and stop the workers."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook queue not drained on shutdown: {self._queue.qsize()} updates left")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+
+    async def drain(self):
+        """Wait until every accepted update has been processed."""
+        await self._queue.join()
+
+    # --- HTTP ---
+    async def _handle(self, request: web.Request) -> web.Response:
+        if self.secret_token is not None and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            self._unauthorized += 1
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self._rejected_full += 1
+            return web.Response(status=503)
+        self._received += 1
+        return web.Response()
+
+    # --- Processing ---
+    async def _worker(self):
+        while True:
+            data = await self._queue.get()
+            started = time.perf_counter()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+                self._processed += 1
+            except Exception as e:
+                self._errors += 1
+                logging.error(f"Error processing webhook update: {e}")
+            finally:
+                self._processing_time += time.perf_counter() - started
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        handled = self._processed + self._errors
+        return {
+            "received": self._received,
+            "unauthorized": self._unauthorized,
+            "rejected_full": self._rejected_full,
+            "processed": self._processed,
+            "errors": self._errors,
+            "queued": self._queue.qsize(),
+            "processing_avg": self._processing_time / handled if handled else 0.0,
+        }
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from file_utils import atomic_write_json
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    """Index of the worker process that owns a user."""
+    return int(user_id) % workers
+
+
+def update_owner(update: Update) -> int:
+    """User ID used to shard an update (chat ID for updates without a user)."""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat is not None else 0
+
+
+def read_status(path: str) -> dict | None:
+    """Latest status written by the supervisor; None if there is none yet."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class _Worker:
+    __slots__ = ("index", "queue", "processed", "process", "sent", "restarts", "started_at")
+
+    def __init__(self, index: int, queue, processed):
+        self.index = index
+        self.queue = queue
+        self.processed = processed
+        self.process = None
+        self.sent = 0
+        self.restarts = 0
+        self.started_at = 0.0
+
+
+class WorkerSupervisor:
+    """
+    Fans updates out to N worker processes sharded by user ID.
+
+    The supervisor process only receives updates (polling or webhook) and
+    puts each of them on the queue of the worker that owns its user, so a
+    user's updates are always handled by the same process, in order, and
+    the FSM cache of that process stays valid. Users listed in ``pinned``
+    go to a fixed worker instead; the bot pins all admins to one worker,
+    which is the only one resolving VPN orders. Workers share the
+    persistent stores (SQLite). Crashed workers are restarted with the
+    same queue, so queued updates are not lost (the ones being handled at
+    the moment of the crash are). Per-worker queue depth
+    (sent minus processed) is logged and written to a status file that the
+    workers read for the admin stats screen.
+    """
+
+    def __init__(
+        self,
+        target,
+        workers: int = 4,
+        queue_size: int = 1000,
+        restart_delay: float = 1.0,
+        status_path: str = "workers_status.json",
+        status_interval: float = 5.0,
+        pinned: dict | None = None,
+    ):
+        """
+        Args:
+            target: Picklable ``target(index, queue, processed)`` run in each worker process
+            workers (int): Number of worker processes
+            queue_size (int): Updates buffered per worker before ingestion blocks
+            restart_delay (float): Seconds to wait before restarting a crashed worker
+            status_path (str): File with the latest stats() snapshot
+            status_interval (float): Seconds between health checks and status writes
+            pinned (dict, optional): user_id -> index of the worker that handles the user
+        """
+        self.target = target
+        self.restart_delay = restart_delay
+        self.status_path = status_path
+        self.status_interval = status_interval
+        self.pinned = dict(pinned or {})
+        # spawn: children must not inherit the running event loop or open SQLite connections
+        self._ctx = multiprocessing.get_context("spawn")
+        self._workers = [
+            _Worker(i, self._ctx.Queue(maxsize=queue_size), self._ctx.Value("q", 0))
+            for i in range(workers)
+        ]
+        self._monitor_task = None
+        self._closing = False
+
+    # --- Lifecycle ---
+    def _spawn(self, worker: _Worker):
+        worker.process = self._ctx.Process(
+            target=self.target,
+            args=(worker.index, worker.queue, worker.processed),
+            name=f"bot-worker-{worker.index}",
+            daemon=False,
+        )
+        worker.process.start()
+        worker.started_at = time.time()
+        logging.info(f"Worker {worker.index} started (pid {worker.process.pid})")
+
+    async def start(self):
+        for worker in self._workers:
+            self._spawn(worker)
+        self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def close(self, timeout: float = 30.0):
+        """Let workers finish their queues and stop them."""
+        self._closing = True
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            try:
+                await self._monitor_task
+            except asyncio.CancelledError:
+                pass
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.queue.put, None)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            await loop.run_in_executor(None, worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logging.warning(f"Worker {worker.index} did not stop in time, terminating")
+                worker.process.terminate()
+                await loop.run_in_executor(None, worker.process.join)
+        await asyncio.to_thread(atomic_write_json, self.status_path, self.stats())
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.status_interval)
+            for worker in self._workers:
+                if self._closing or worker.process.is_alive():
+                    continue
+                logging.error(f"Worker {worker.index} exited with code {worker.process.exitcode}, restarting")
+                worker.restarts += 1
+                await asyncio.sleep(self.restart_delay)
+                self._spawn(worker)
+            stats = self.stats()
+            try:
+                await asyncio.to_thread(atomic_write_json, self.status_path, stats)
+            except Exception as e:
+                logging.error(f"Failed to write worker status: {e}")
+            depths = ", ".join(f"{w['index']}: {w['queue_depth']}" for w in stats["workers"])
+            logging.info(f"Worker queue depth — {depths}")
+
+    # --- Routing ---
+    async def dispatch(self, update: Update):
+        """Send an update to the worker owning its user; waits while that queue is full."""
+        user_id = update_owner(update)
+        index = self.pinned.get(user_id)
+        worker = self._workers[index if index is not None else shard_of(user_id, len(self._workers))]
+        data = (user_id, update.model_dump_json(exclude_unset=True))
+        try:
+            worker.queue.put_nowait(data)
+        except queue_module.Full:
+            # Backpressure: polling slows down, webhook requests wait
+            await asyncio.get_running_loop().run_in_executor(None, worker.queue.put, data)
+        worker.sent += 1
+
+    async def middleware(self, handler, event: Update, data: dict):
+        """Outer middleware of the ingestion dispatcher: route instead of handling."""
+        await self.dispatch(event)
+
+    def stats(self) -> dict:
+        workers = []
+        for worker in self._workers:
+            processed = worker.processed.value
+            workers.append({
+                "index": worker.index,
+                "pid": worker.process.pid if worker.process is not None else None,
+                "alive": worker.process is not None and worker.process.is_alive(),
+                "restarts": worker.restarts,
+                "sent": worker.sent,
+                "processed": processed,
+                "queue_depth": max(0, worker.sent - processed),
+                "uptime": time.time() - worker.started_at if worker.started_at else 0.0,
+            })
+        return {"updated_at": time.time(), "supervisor_pid": os.getpid(), "workers": workers}
+
+
+async def _process(bot: Bot, dp: Dispatcher, raw: str, previous: asyncio.Task | None, processed):
+    if previous is not None:
+        # Keep the order of a user's updates
+        await asyncio.wait([previous])
+    try:
+        update = Update.model_validate_json(raw, context={"bot": bot})
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logging.error(f"Error processing update in worker: {e}")
+    finally:
+        with processed.get_lock():
+            processed.value += 1
+
+
+async def worker_loop(bot: Bot, dp: Dispatcher, queue, processed):
+    """
+    Feed updates from the supervisor queue to the dispatcher until a None arrives.
+
+    Updates of different users are handled concurrently, updates of the same
+    user one after another.
+    """
+    loop = asyncio.get_running_loop()
+    tails = {}  # user_id -> task handling the user's latest update
+
+    def forget(user_id, task):
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    while True:
+        item = await loop.run_in_executor(None, queue.get)
+        if item is None:
+            break
+        user_id, raw = item
+        task = asyncio.create_task(_process(bot, dp, raw, tails.get(user_id), processed))
+        tails[user_id] = task
+        task.add_done_callback(lambda t, user_id=user_id: forget(user_id, t))
+    await asyncio.gather(*tails.values(), return_exceptions=True)